@@ -0,0 +1,278 @@
+import itertools
+import os
+import time
+from collections import Counter
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
+from typing import Callable, Dict, Iterable, List, Sequence
+import numpy as np
+
+from CleWin_cif_creator import (
+    CleWin_layer,
+    CIF_shape_arrays,
+    CIF_symbol_call,
+    CIF_SHAPE_ARRAY_NAMES,
+    get_cif_path,
+    write_to_cif,
+)
+
+
+class CIF_export_job:
+    def __init__(self, filename, layers: List[CleWin_layer], calls: List[CIF_symbol_call] = None):
+        """
+        A file to write with write_many_to_cif, with the same arguments as write_to_cif.
+        The layers are sent to the worker through shared memory; the calls and their symbols are pickled.
+        Object-backed layers are first converted to arrays in the calling process, see write_many_to_cif.
+        """
+        self.filename = filename
+        self.layers = layers
+        self.calls = calls
+
+
+class CIF_export_report:
+    def __init__(
+        self,
+        filename,
+        seconds: float,
+        shape_count: int,
+        file_size_bytes: int,
+        process_id: int,
+        parameters: Dict = None,
+    ):
+        """
+        The result of writing one file in a batch.
+
+        Args:
+        -----
+        filename: str
+            The path of the file without the .cif extension
+        seconds: float
+            The time spent by the worker on the job, including generating the layers for a sweep
+        shape_count: int
+            The number of shapes in the layers of the main symbol
+        file_size_bytes: int
+            The size of the written file
+        process_id: int
+            The process that wrote the file
+        parameters: Dict
+            The parameters the layers were generated with, for write_sweep_to_cif
+        """
+        self.filename = filename
+        self.seconds = seconds
+        self.shape_count = shape_count
+        self.file_size_bytes = file_size_bytes
+        self.process_id = process_id
+        self.parameters = parameters
+
+    def __repr__(self):
+        return (
+            f"CIF_export_report({get_cif_path(self.filename)}: {self.shape_count} shapes, "
+            f"{self.file_size_bytes} bytes in {self.seconds:.3f} s)"
+        )
+
+
+def write_many_to_cif(jobs: Iterable, processes: int = None) -> List[CIF_export_report]:
+    """
+    Writes many CIF files at once, spread over a pool of processes.
+
+    The shapes of every layer are copied once into a shared memory block, which the workers read without
+    copying or pickling. A layer used by several jobs, e.g. an unchanged layer in a set of mask variants,
+    is shared by all of them. At most two jobs per process are prepared at a time, and every block is freed as
+    soon as the last job using it is done.
+
+    The speed-up applies to array-backed layers, whose arrays are only copied. Object-backed layers are
+    converted to arrays in this process, one after another, while the workers write the jobs prepared before.
+    Converting is still several times faster than pickling the shape objects for the workers, but it takes
+    at least as long as writing the layer would, so jobs of object-backed layers are not written faster than
+    with one process. Build the layers with array_backed=True, or use write_sweep_to_cif to generate them
+    in the workers.
+
+    Args:
+    -----
+    jobs: Iterable
+        CIF_export_job objects, or (filename, layers) or (filename, layers, calls) tuples
+    processes: int
+        The number of worker processes. Defaults to the number of cores. With 1, the files are written
+        one after another in this process.
+
+    Returns:
+    --------
+    reports: List[CIF_export_report]
+        One report per job, in the order of the jobs
+    """
+    jobs = [job if isinstance(job, CIF_export_job) else CIF_export_job(*job) for job in jobs]
+    processes = os.cpu_count() if processes is None else processes
+    if processes <= 1 or len(jobs) <= 1:
+        return [_write_job(job.filename, job.layers, job.calls) for job in jobs]
+
+    remaining_uses = Counter(id(layer) for job in jobs for layer in job.layers)
+    shared_layers: Dict[int, _Shared_layer] = {}
+    reports: List[CIF_export_report | None] = [None] * len(jobs)
+    pending = {}
+    try:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            for job_index, job in enumerate(jobs):
+                if len(pending) >= 2 * processes:
+                    _collect_done(pending, reports, jobs, remaining_uses, shared_layers, FIRST_COMPLETED)
+                for layer in job.layers:
+                    if id(layer) not in shared_layers:
+                        shared_layers[id(layer)] = _Shared_layer(layer)
+                descriptions = [shared_layers[id(layer)].description for layer in job.layers]
+                pending[executor.submit(_write_shared_job, job.filename, descriptions, job.calls)] = job_index
+            _collect_done(pending, reports, jobs, remaining_uses, shared_layers)
+    finally:
+        for shared_layer in shared_layers.values():
+            shared_layer.free()
+    return reports
+
+
+def write_sweep_to_cif(
+    generate: Callable,
+    parameter_grid: Dict[str, Sequence],
+    filename_format: str,
+    processes: int = None,
+) -> List[CIF_export_report]:
+    """
+    Generates and writes one CIF file for every combination of parameters, spread over a pool of processes.
+    The layers are generated in the workers, so no geometry is sent between processes.
+
+    Args:
+    -----
+    generate: Callable
+        Called as generate(**parameters). Returns the layers, or a (layers, calls) tuple.
+        It must be defined at the top level of a module, so the workers can import it.
+    parameter_grid: Dict[str, Sequence]
+        The values of every parameter. Every combination of values is written.
+    filename_format: str
+        The path of each file without the .cif extension, formatted with the parameters,
+        e.g. "masks/gap_{gap_nm}_width_{width_nm}"
+    processes: int
+        The number of worker processes. Defaults to the number of cores.
+
+    Returns:
+    --------
+    reports: List[CIF_export_report]
+        One report per combination, in the order of itertools.product over the grid
+    """
+    names = list(parameter_grid)
+    parameter_sets = [
+        dict(zip(names, values)) for values in itertools.product(*(parameter_grid[name] for name in names))
+    ]
+    filenames = [filename_format.format(**parameters) for parameters in parameter_sets]
+    processes = os.cpu_count() if processes is None else processes
+    if processes <= 1 or len(parameter_sets) <= 1:
+        return [
+            _generate_and_write(generate, parameters, filename)
+            for parameters, filename in zip(parameter_sets, filenames)
+        ]
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        return list(
+            executor.map(
+                _generate_and_write,
+                itertools.repeat(generate),
+                parameter_sets,
+                filenames,
+            )
+        )
+
+
+class _Shared_layer:
+    def __init__(self, layer: CleWin_layer):
+        """
+        The shapes of a layer copied into one shared memory block, with what a worker needs to rebuild the layer.
+        The arrays are laid out in the order of CIF_SHAPE_ARRAY_NAMES.
+        """
+        shape_arrays = layer.get_shape_arrays()
+        arrays = [getattr(shape_arrays, name) for name in CIF_SHAPE_ARRAY_NAMES]
+        offsets = np.cumsum([0] + [array.nbytes for array in arrays])
+        self.block = shared_memory.SharedMemory(create=True, size=max(int(offsets[-1]), 1))
+        layouts = []
+        for array, offset in zip(arrays, offsets[:-1].tolist()):
+            target = np.ndarray(array.shape, dtype=array.dtype, buffer=self.block.buf, offset=offset)
+            target[...] = array
+            layouts.append((array.dtype.str, array.shape, offset))
+            del target
+
+        self.description = {
+            "block_name": self.block.name,
+            "layouts": layouts,
+            "layer_name": layer.layer_name,
+            "layer_alias": layer.layer_alias,
+            "layer_index": layer.layer_index,
+            "fill_color": layer.fill_color,
+            "border_color": layer.border_color,
+        }
+
+    def free(self):
+        self.block.close()
+        self.block.unlink()
+
+
+def _collect_done(pending, reports, jobs, remaining_uses, shared_layers, return_when=ALL_COMPLETED):
+    """
+    Waits for pending jobs, by default for all of them, stores their reports
+    and frees the shared layers that no other job needs
+    """
+    done, _ = wait(pending, return_when=return_when)
+    for future in done:
+        job_index = pending.pop(future)
+        reports[job_index] = future.result()
+        for layer in jobs[job_index].layers:
+            remaining_uses[id(layer)] -= 1
+            if remaining_uses[id(layer)] == 0:
+                shared_layers.pop(id(layer)).free()
+
+
+def _write_shared_job(filename, descriptions: List[Dict], calls) -> CIF_export_report:
+    """Writes a job in a worker, with the layers read from shared memory"""
+    blocks = [shared_memory.SharedMemory(name=description["block_name"]) for description in descriptions]
+    try:
+        layers = [_layer_from_block(description, block) for description, block in zip(descriptions, blocks)]
+        report = _write_job(filename, layers, calls)
+        # The arrays point into the blocks, so they have to be gone before the blocks are closed
+        del layers
+    finally:
+        for block in blocks:
+            block.close()
+    return report
+
+
+def _layer_from_block(description: Dict, block: shared_memory.SharedMemory) -> CleWin_layer:
+    arrays = {
+        name: np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf, offset=offset)
+        for name, (dtype, shape, offset) in zip(CIF_SHAPE_ARRAY_NAMES, description["layouts"])
+    }
+    layer = CleWin_layer(
+        layer_name=description["layer_name"],
+        layer_alias=description["layer_alias"],
+        layer_index=description["layer_index"],
+        fill_color=description["fill_color"],
+        border_color=description["border_color"],
+        array_backed=True,
+    )
+    layer.shape_arrays = CIF_shape_arrays.from_arrays(**arrays)
+    layer.shape_arrays.set_read_only()
+    return layer
+
+
+def _generate_and_write(generate: Callable, parameters: Dict, filename) -> CIF_export_report:
+    start = time.perf_counter()
+    result = generate(**parameters)
+    layers, calls = result if isinstance(result, tuple) else (result, None)
+    report = _write_job(filename, layers, calls)
+    report.seconds = time.perf_counter() - start
+    report.parameters = parameters
+    return report
+
+
+def _write_job(filename, layers: List[CleWin_layer], calls) -> CIF_export_report:
+    start = time.perf_counter()
+    write_to_cif(filename, layers, calls)
+    return CIF_export_report(
+        filename=filename,
+        seconds=time.perf_counter() - start,
+        shape_count=sum(layer.get_shape_count() for layer in layers),
+        file_size_bytes=os.path.getsize(get_cif_path(filename)),
+        process_id=os.getpid(),
+    )
@@ -0,0 +1,279 @@
+import json
+import struct
+from typing import Dict, List
+import numpy as np
+
+from CleWin_cif_creator import (
+    CleWin_color,
+    CleWin_layer,
+    CIF_shape_arrays,
+    CIF_symbol,
+    CIF_symbol_call,
+    CIF_transformation,
+    CIF_SHAPE_ARRAY_NAMES,
+    flatten_symbol_calls,
+    load_cif_with_symbols,
+    write_to_cif,
+    _collect_called_symbols,
+    _convert_to_object_backed,
+)
+
+# The extension of binary layout files
+BINARY_LAYOUT_EXTENSION = ".clwb"
+
+# The first bytes of every binary layout file. The line break catches files that went through a text conversion.
+BINARY_LAYOUT_MAGIC = b"CLWBIN\r\n"
+
+BINARY_LAYOUT_VERSION = 1
+
+# Arrays start at multiples of this many bytes from the start of the file
+BINARY_LAYOUT_ALIGNMENT = 64
+
+# The magic, the version and the length of the JSON header, followed by the header itself
+_PREAMBLE = struct.Struct("<8sII")
+
+# Kinds are stored as bytes, all other arrays as 64-bit integers, both little-endian
+_ARRAY_DTYPES = {name: "<i8" for name in CIF_SHAPE_ARRAY_NAMES}
+_ARRAY_DTYPES["kinds"] = "|u1"
+
+
+def write_to_binary(filename, layers: List[CleWin_layer], calls: List[CIF_symbol_call] = None):
+    """
+    Writes the layers to the binary layout file {filename}.clwb.
+
+    The file starts with a JSON header with the metadata of every layer and symbol and the position of every
+    array, followed by the geometry as contiguous little-endian arrays in the columnar form of CIF_shape_arrays.
+    Every array starts at a multiple of BINARY_LAYOUT_ALIGNMENT bytes, so it can be used directly
+    from a memory map of the file.
+
+    Args:
+    -----
+    filename: str
+        The path of the file without the .clwb extension
+    layers: List[CleWin_layer]
+        The layers to write
+    calls: List[CIF_symbol_call]
+        Symbols placed in the main symbol. Every symbol is stored once.
+    """
+    calls = [] if calls is None else calls
+    symbols: Dict[int, CIF_symbol] = {}
+    for call in calls:
+        if id(call.symbol) not in symbols:
+            symbols[id(call.symbol)] = call.symbol
+            _collect_called_symbols(call.symbol, symbols)
+    symbol_indices = {symbol_id: index for index, symbol_id in enumerate(symbols)}
+
+    arrays = []
+    size = 0
+
+    def describe_layer(layer: CleWin_layer) -> Dict:
+        nonlocal size
+        shape_arrays = layer.get_shape_arrays()
+        layouts = {}
+        for name in CIF_SHAPE_ARRAY_NAMES:
+            array = np.ascontiguousarray(getattr(shape_arrays, name), dtype=_ARRAY_DTYPES[name])
+            layouts[name] = {"offset": size, "shape": list(array.shape)}
+            arrays.append((size, array))
+            size = _aligned(size + array.nbytes)
+        return {
+            "name": layer.layer_name,
+            "alias": layer.layer_alias,
+            "index": layer.layer_index,
+            "fill_color": list(layer.fill_color.rgb),
+            "border_color": list(layer.border_color.rgb),
+            "arrays": layouts,
+        }
+
+    header = {
+        "version": BINARY_LAYOUT_VERSION,
+        "dtypes": _ARRAY_DTYPES,
+        "layers": [describe_layer(layer) for layer in layers],
+        "symbols": [
+            {
+                "name": symbol.symbol_name,
+                "layers": [describe_layer(layer) for layer in symbol.layers],
+                "calls": [_describe_call(call, symbol_indices) for call in symbol.calls],
+            }
+            for symbol in symbols.values()
+        ],
+        "calls": [_describe_call(call, symbol_indices) for call in calls],
+    }
+    header_bytes = json.dumps(header).encode("utf-8")
+    data_start = _aligned(_PREAMBLE.size + len(header_bytes))
+
+    with open(f"{filename}{BINARY_LAYOUT_EXTENSION}", "wb") as file:
+        file.write(_PREAMBLE.pack(BINARY_LAYOUT_MAGIC, BINARY_LAYOUT_VERSION, len(header_bytes)))
+        file.write(header_bytes)
+        position = _PREAMBLE.size + len(header_bytes)
+        for offset, array in arrays:
+            file.write(bytes(data_start + offset - position))
+            file.write(memoryview(array.reshape(-1).view(np.uint8)))
+            position = data_start + offset + array.nbytes
+        file.write(bytes(data_start + size - position))
+
+
+def load_binary(filename, mmap_mode: str | None = "c", array_backed: bool = True) -> List[CleWin_layer]:
+    """
+    Loads the layers of the binary layout file {filename}.clwb. Symbols placed with calls are flattened
+    into the layers, which copies the geometry of the layers that have symbols placed on them.
+
+    Args:
+    -----
+    filename: str
+        The path of the file without the .clwb extension
+    mmap_mode: str | None
+        How the file is memory mapped, see load_binary_with_symbols
+    array_backed: bool
+        Whether the returned layers store their shapes in a CIF_shape_arrays
+
+    Returns:
+    --------
+    layers: List[CleWin_layer]
+        The layers stored in the file with all their shapes
+    """
+    layers, calls = load_binary_with_symbols(filename, mmap_mode=mmap_mode, array_backed=True)
+    flatten_symbol_calls(layers, calls)
+    if not array_backed:
+        for layer in layers:
+            _convert_to_object_backed(layer)
+    return layers
+
+
+def load_binary_with_symbols(filename, mmap_mode: str | None = "c", array_backed: bool = True):
+    """
+    Loads the binary layout file {filename}.clwb while keeping its symbol hierarchy.
+
+    With a memory map, opening the file only reads the header. The arrays of array-backed layers are views on the
+    map, so the geometry is read from disk when it is used, and shape objects are only created for the shapes
+    that are accessed through CleWin_layer.shapes.
+
+    Args:
+    -----
+    filename: str
+        The path of the file without the .clwb extension
+    mmap_mode: str | None
+        "c" maps the file copy-on-write, so the layers can be shifted or changed in memory without changing
+        the file. "r" maps it read-only, and changing the geometry in place raises an error.
+        None reads the whole file into memory.
+    array_backed: bool
+        Whether the returned layers store their shapes in a CIF_shape_arrays. Object-backed layers are
+        created from all shapes at once.
+
+    Returns:
+    --------
+    layers: List[CleWin_layer]
+        The layers stored in the file with the shapes of the main symbol
+    calls: List[CIF_symbol_call]
+        The symbols placed in the main symbol
+    """
+    path = f"{filename}{BINARY_LAYOUT_EXTENSION}"
+    with open(path, "rb") as file:
+        preamble = file.read(_PREAMBLE.size)
+        if len(preamble) < _PREAMBLE.size or not preamble.startswith(BINARY_LAYOUT_MAGIC):
+            raise ValueError(f"{path} is not a binary layout file")
+        _, version, header_length = _PREAMBLE.unpack(preamble)
+        if version > BINARY_LAYOUT_VERSION:
+            raise ValueError(f"{path} has version {version}, only versions up to {BINARY_LAYOUT_VERSION} are supported")
+        header = json.loads(file.read(header_length).decode("utf-8"))
+
+    if mmap_mode is None:
+        data = np.fromfile(path, dtype=np.uint8)
+    else:
+        data = np.memmap(path, dtype=np.uint8, mode=mmap_mode)
+    data_start = _aligned(_PREAMBLE.size + header_length)
+    dtypes = header["dtypes"]
+
+    def layer_from_description(description: Dict) -> CleWin_layer:
+        arrays = {}
+        for name, layout in description["arrays"].items():
+            dtype = np.dtype(dtypes[name])
+            start = data_start + layout["offset"]
+            count = int(np.prod(layout["shape"]))
+            if start + count * dtype.itemsize > len(data):
+                raise ValueError(f"{path} is truncated")
+            arrays[name] = data[start : start + count * dtype.itemsize].view(dtype).reshape(layout["shape"])
+        layer = CleWin_layer(
+            layer_name=description["name"],
+            layer_alias=description["alias"],
+            layer_index=description["index"],
+            fill_color=CleWin_color(*description["fill_color"]),
+            border_color=CleWin_color(*description["border_color"]),
+            array_backed=True,
+        )
+        layer.shape_arrays = CIF_shape_arrays.from_arrays(**arrays)
+        if not array_backed:
+            _convert_to_object_backed(layer)
+        return layer
+
+    symbols = [
+        CIF_symbol(
+            symbol_name=symbol_description["name"],
+            layers=[layer_from_description(description) for description in symbol_description["layers"]],
+        )
+        for symbol_description in header["symbols"]
+    ]
+    for symbol, symbol_description in zip(symbols, header["symbols"]):
+        symbol.calls = [_call_from_description(description, symbols) for description in symbol_description["calls"]]
+
+    layers = [layer_from_description(description) for description in header["layers"]]
+    calls = [_call_from_description(description, symbols) for description in header["calls"]]
+    return layers, calls
+
+
+def cif_to_binary(cif_filename, binary_filename=None):
+    """
+    Converts {cif_filename}.cif to a binary layout file, keeping its symbols.
+    Writing the binary file back with binary_to_cif gives the same file as loading the .cif file with
+    load_cif_with_symbols and writing it with write_to_cif.
+
+    Args:
+    -----
+    cif_filename: str
+        The path of the .cif file without the extension
+    binary_filename: str
+        The path of the binary file without the .clwb extension. Defaults to cif_filename.
+    """
+    layers, calls = load_cif_with_symbols(cif_filename, array_backed=True)
+    write_to_binary(cif_filename if binary_filename is None else binary_filename, layers, calls)
+
+
+def binary_to_cif(binary_filename, cif_filename=None):
+    """
+    Converts the binary layout file {binary_filename}.clwb to a .cif file, keeping its symbols.
+
+    Args:
+    -----
+    binary_filename: str
+        The path of the binary file without the .clwb extension
+    cif_filename: str
+        The path of the .cif file without the extension. Defaults to binary_filename.
+    """
+    layers, calls = load_binary_with_symbols(binary_filename, mmap_mode="r")
+    write_to_cif(binary_filename if cif_filename is None else cif_filename, layers, calls)
+
+
+def _aligned(position: int) -> int:
+    return -(-position // BINARY_LAYOUT_ALIGNMENT) * BINARY_LAYOUT_ALIGNMENT
+
+
+def _describe_call(call: CIF_symbol_call, symbol_indices: Dict[int, int]) -> Dict:
+    transformation = call.transformation
+    return {
+        "symbol": symbol_indices[id(call.symbol)],
+        "x_shift_nm": transformation.x_shift_nm,
+        "y_shift_nm": transformation.y_shift_nm,
+        "rotation_deg": transformation.rotation_deg,
+        "mirror_x": transformation.mirror_x,
+    }
+
+
+def _call_from_description(description: Dict, symbols: List[CIF_symbol]) -> CIF_symbol_call:
+    return CIF_symbol_call(
+        symbol=symbols[description["symbol"]],
+        transformation=CIF_transformation(
+            x_shift_nm=description["x_shift_nm"],
+            y_shift_nm=description["y_shift_nm"],
+            rotation_deg=description["rotation_deg"],
+            mirror_x=description["mirror_x"],
+        ),
+    )
@@ -0,0 +1,623 @@
+from typing import Callable, Dict
+import numpy as np
+
+from CleWin_cif_creator import (
+    CleWin_layer,
+    CIF_shape_arrays,
+    RECTANGLE_KIND,
+    POLYGON_KIND,
+    _offsets_from_counts,
+)
+
+# The boolean operations, as functions of the coverage of the first and the second layer
+BOOLEAN_OPERATIONS: Dict[str, Callable[[np.ndarray, np.ndarray], np.ndarray]] = {
+    "union": lambda a, b: a | b,
+    "difference": lambda a, b: a & ~b,
+    "intersection": lambda a, b: a & b,
+    "xor": lambda a, b: a ^ b,
+}
+
+
+def merge_layer(layer: CleWin_layer, outlines: bool = True) -> CleWin_layer:
+    """
+    Returns a copy of the layer where all overlapping and touching rectangles and rectilinear polygons are
+    merged, see boolean_layers for the form of the result. Other polygons and wires are copied unchanged.
+    """
+    shape_arrays = layer.get_shape_arrays()
+    manhattan, other = _split_manhattan(shape_arrays)
+    result = layer.empty_copy()
+    result.add_shape_arrays_to_layer(_boolean_shape_arrays(manhattan, None, "union", outlines))
+    result.add_shape_arrays_to_layer(other)
+    return result
+
+
+def union_layers(layer_a: CleWin_layer, layer_b: CleWin_layer, outlines: bool = True) -> CleWin_layer:
+    """Returns the area covered by either layer, see boolean_layers"""
+    return boolean_layers(layer_a, layer_b, "union", outlines)
+
+
+def difference_layers(layer_a: CleWin_layer, layer_b: CleWin_layer, outlines: bool = True) -> CleWin_layer:
+    """Returns the area covered by layer_a but not by layer_b, see boolean_layers"""
+    return boolean_layers(layer_a, layer_b, "difference", outlines)
+
+
+def intersection_layers(layer_a: CleWin_layer, layer_b: CleWin_layer, outlines: bool = True) -> CleWin_layer:
+    """Returns the area covered by both layers, see boolean_layers"""
+    return boolean_layers(layer_a, layer_b, "intersection", outlines)
+
+
+def xor_layers(layer_a: CleWin_layer, layer_b: CleWin_layer, outlines: bool = True) -> CleWin_layer:
+    """Returns the area covered by exactly one of the layers, see boolean_layers"""
+    return boolean_layers(layer_a, layer_b, "xor", outlines)
+
+
+def boolean_layers(
+    layer_a: CleWin_layer, layer_b: CleWin_layer, operation: str, outlines: bool = True
+) -> CleWin_layer:
+    """
+    Applies a boolean operation to the area covered by two layers.
+
+    The layers are cut into tiles, and each tile is swept band by band over the sorted y-coordinates of its
+    horizontal edges. In each band the covered x-intervals of both layers are combined, and identical intervals
+    in neighbouring bands are merged into one rectangle. Coordinates are kept as integers throughout,
+    so the result is exact.
+
+    With outlines, the outline of every connected region of the result is traced and written as one shape:
+    a rectangle if the region is one, otherwise a polygon. Holes are joined to the outline around them by a cut
+    of zero width. Without outlines, the result is a set of non-overlapping rectangles.
+    Rectangles whose center is not a whole nanometer are written as polygons. Rectangles with odd sizes have
+    edges at half nanometers; where these end up as polygon vertices, they are rounded up.
+
+    Only rectangles and rectilinear polygons take part. For union, other polygons and wires are copied to the
+    result unchanged, and for the other operations they raise a ValueError.
+
+    Args:
+    -----
+    layer_a: CleWin_layer
+        The first layer. The result has its name, alias, index, colors and storage mode.
+    layer_b: CleWin_layer
+        The second layer
+    operation: str
+        "union", "difference", "intersection" or "xor"
+    outlines: bool
+        Whether to write every connected region as a single shape, instead of as non-overlapping rectangles
+
+    Returns:
+    --------
+    layer: CleWin_layer
+        A new layer with the result
+    """
+    if operation not in BOOLEAN_OPERATIONS:
+        raise ValueError(f"Unknown boolean operation {operation}, use one of {list(BOOLEAN_OPERATIONS)}")
+
+    manhattan_a, other_a = _split_manhattan(layer_a.get_shape_arrays())
+    manhattan_b, other_b = _split_manhattan(layer_b.get_shape_arrays())
+    if operation != "union" and (len(other_a) or len(other_b)):
+        raise ValueError(
+            f"The {operation} of layers with wires or non-rectilinear polygons is not supported"
+        )
+
+    result = layer_a.empty_copy()
+    result.add_shape_arrays_to_layer(
+        _boolean_shape_arrays(manhattan_a, manhattan_b, operation, outlines)
+    )
+    result.add_shape_arrays_to_layer(other_a)
+    result.add_shape_arrays_to_layer(other_b)
+    return result
+
+
+def _split_manhattan(shape_arrays: CIF_shape_arrays):
+    """Splits shapes into rectangles and rectilinear polygons, and all other shapes"""
+    kinds = shape_arrays.kinds
+    points, offsets = shape_arrays.polygon_points, shape_arrays.polygon_offsets
+    edges = np.roll(points, -1, axis=0) - points
+    edges[offsets[1:] - 1] = points[offsets[:-1]] - points[offsets[1:] - 1]
+    is_axis_aligned = (edges[:, 0] == 0) | (edges[:, 1] == 0)
+    is_rectilinear = np.ones(len(offsets) - 1, dtype=bool)
+    has_points = np.diff(offsets) > 0
+    is_rectilinear[has_points] = np.logical_and.reduceat(is_axis_aligned, offsets[:-1][has_points])
+
+    is_manhattan = kinds == RECTANGLE_KIND
+    is_manhattan[kinds == POLYGON_KIND] = is_rectilinear
+    return (
+        shape_arrays.take(np.flatnonzero(is_manhattan)),
+        shape_arrays.take(np.flatnonzero(~is_manhattan)),
+    )
+
+
+def _boolean_shape_arrays(
+    shape_arrays_a: CIF_shape_arrays,
+    shape_arrays_b: CIF_shape_arrays | None,
+    operation: str,
+    outlines: bool,
+) -> CIF_shape_arrays:
+    operands = [shape_arrays_a] if shape_arrays_b is None else [shape_arrays_a, shape_arrays_b]
+    rectangles = _boolean_rectangles(operands, operation)
+    if len(rectangles) == 0:
+        return CIF_shape_arrays()
+    if outlines:
+        return _shape_arrays_from_loops(*_outline_loops(rectangles))
+    # Join rectangles that were split at tile borders
+    rectangles = _merge_abutting(_merge_abutting(rectangles, vertical=True), vertical=False)
+    return _shape_arrays_from_edges(rectangles)
+
+
+def _boolean_rectangles(operands, operation: str) -> np.ndarray:
+    """
+    Returns the result of a boolean operation on one or two sets of rectangles and rectilinear polygons
+    as non-overlapping (x_low, x_high, y_low, y_high) rectangles in doubled coordinates
+    """
+    boxes = [_doubled_bounding_boxes(shape_arrays) for shape_arrays in operands]
+    tiling = _Tiling(np.concatenate(boxes))
+    edges = [
+        _vertical_edges(shape_arrays, shape_boxes, tiling)
+        for shape_arrays, shape_boxes in zip(operands, boxes)
+    ]
+
+    keys = np.sort(np.concatenate([np.concatenate([low, high]) for _, low, high, _ in edges]))
+    if len(keys) == 0:
+        return np.zeros((0, 4), dtype=np.int64)
+    keys = keys[np.append(True, keys[1:] != keys[:-1])]
+    bands, x_low, x_high = _covered_runs(edges, keys, BOOLEAN_OPERATIONS[operation])
+    if len(bands) == 0:
+        return np.zeros((0, 4), dtype=np.int64)
+    return _merge_bands(bands, x_low, x_high, tiling.get_y(keys))
+
+
+class _Tiling:
+    def __init__(self, boxes: np.ndarray, shapes_per_tile: int = 32):
+        """
+        A grid of tiles that are swept independently, so every sweep only sees the y-coordinates of nearby shapes.
+        Positions within a tile are encoded as tile * span + y, which sorts by tile and then by y.
+        """
+        if len(boxes) == 0:
+            boxes = np.zeros((1, 4), dtype=np.int64)
+        self.origin = boxes[:, :2].min(axis=0)
+        extent = boxes[:, 2:].max(axis=0) - self.origin + 1
+        size = np.sqrt(float(extent[0]) * float(extent[1]) * shapes_per_tile / len(boxes))
+        size = max(int(np.ceil(size)), 1)
+        while np.prod(-(-extent // size)) > 4 * len(boxes) + 16:
+            size *= 2
+        self.size = size
+        self.columns, self.rows = (-(-extent // size)).tolist()
+        # Larger than any y within a tile, including the upper border of the last row
+        self.span = self.rows * size + 1
+
+    def get_tile_ranges(self, boxes: np.ndarray):
+        """Returns the first and last tile column and row overlapped by each box"""
+        first = np.clip((boxes[:, :2] - self.origin) // self.size, 0, [self.columns - 1, self.rows - 1])
+        last = np.clip((boxes[:, 2:] - self.origin) // self.size, 0, [self.columns - 1, self.rows - 1])
+        return first, last
+
+    def get_tile_bounds(self, columns: np.ndarray, rows: np.ndarray):
+        lower = self.origin + self.size * np.stack([columns, rows], axis=1)
+        return lower, lower + self.size
+
+    def get_key(self, tiles: np.ndarray, y: np.ndarray) -> np.ndarray:
+        return tiles * self.span + (y - self.origin[1])
+
+    def get_y(self, keys: np.ndarray) -> np.ndarray:
+        return keys % self.span + self.origin[1]
+
+
+def _doubled_bounding_boxes(shape_arrays: CIF_shape_arrays) -> np.ndarray:
+    """Returns the bounding boxes of the shapes in doubled coordinates, as int64"""
+    return np.round(2 * shape_arrays.get_shape_bounding_boxes()).astype(np.int64).reshape(-1, 4)
+
+
+def _vertical_edges(shape_arrays: CIF_shape_arrays, boxes: np.ndarray, tiling: _Tiling):
+    """
+    Returns the vertical edges of rectangles and rectilinear polygons, cut into the tiles that the
+    shapes overlap, as (x, key_low, key_high, step) arrays. The step is +1 for edges where the inside of
+    the shape begins when going in the +x direction, and -1 where it ends. Coordinates are doubled, so the edges of
+    rectangles with odd sizes are whole numbers. Edges to the left or right of a tile are moved to the
+    border of the tile, which keeps the inside of the shape within the tile unchanged.
+    """
+    first, last = tiling.get_tile_ranges(boxes)
+    widths = last[:, 0] - first[:, 0] + 1
+    counts = widths * (last[:, 1] - first[:, 1] + 1)
+    pair_shapes = np.repeat(np.arange(len(boxes)), counts)
+    local = np.arange(counts.sum()) - np.repeat(_offsets_from_counts(counts)[:-1], counts)
+    columns = first[pair_shapes, 0] + local % widths[pair_shapes]
+    rows = first[pair_shapes, 1] + local // widths[pair_shapes]
+    tiles = rows * tiling.columns + columns
+    tile_lower, tile_upper = tiling.get_tile_bounds(columns, rows)
+
+    # Every (shape, tile) pair with all vertical edges of the shape
+    kinds = shape_arrays.kinds
+    kind_indices = shape_arrays.get_kind_indices()
+    rectangles = shape_arrays.rectangles
+    points = 2 * shape_arrays.polygon_points
+    offsets = shape_arrays.polygon_offsets
+    next_points = np.arange(1, len(points) + 1)
+    next_points[offsets[1:] - 1] = offsets[:-1]
+    is_vertical = (points[:, 0] == points[next_points, 0]) & (points[:, 1] != points[next_points, 1])
+    vertical_counts = np.bincount(
+        np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))[is_vertical], minlength=len(offsets) - 1
+    )
+    vertical_edges = np.flatnonzero(is_vertical)
+    vertical_offsets = _offsets_from_counts(vertical_counts)
+
+    is_rectangle = kinds[pair_shapes] == RECTANGLE_KIND
+    pair_kind_indices = kind_indices[pair_shapes]
+    edge_counts = np.full(len(pair_shapes), 2)
+    edge_counts[~is_rectangle] = vertical_counts[pair_kind_indices[~is_rectangle]]
+    pair_ids = np.repeat(np.arange(len(pair_shapes)), edge_counts)
+    edge_local = np.arange(edge_counts.sum()) - np.repeat(_offsets_from_counts(edge_counts)[:-1], edge_counts)
+    is_rectangle_edge = is_rectangle[pair_ids]
+
+    x = np.empty(len(pair_ids), dtype=np.int64)
+    y_low = np.empty(len(pair_ids), dtype=np.int64)
+    y_high = np.empty(len(pair_ids), dtype=np.int64)
+    steps = np.empty(len(pair_ids), dtype=np.int64)
+
+    rectangle_rows = rectangles[pair_kind_indices[pair_ids[is_rectangle_edge]]]
+    sign = 2 * edge_local[is_rectangle_edge] - 1
+    x[is_rectangle_edge] = 2 * rectangle_rows[:, 2] + sign * rectangle_rows[:, 0]
+    y_low[is_rectangle_edge] = 2 * rectangle_rows[:, 3] - rectangle_rows[:, 1]
+    y_high[is_rectangle_edge] = 2 * rectangle_rows[:, 3] + rectangle_rows[:, 1]
+    steps[is_rectangle_edge] = -sign
+
+    is_polygon_edge = ~is_rectangle_edge
+    polygon_pairs = pair_ids[is_polygon_edge]
+    edge_points = vertical_edges[
+        vertical_offsets[pair_kind_indices[polygon_pairs]] + edge_local[is_polygon_edge]
+    ]
+    x[is_polygon_edge] = points[edge_points, 0]
+    y_low[is_polygon_edge] = np.minimum(points[edge_points, 1], points[next_points[edge_points], 1])
+    y_high[is_polygon_edge] = np.maximum(points[edge_points, 1], points[next_points[edge_points], 1])
+    # In a counterclockwise polygon, the inside begins at edges going down
+    signed_areas = np.zeros(len(offsets) - 1)
+    has_points = np.diff(offsets) > 0
+    float_points = points.astype(np.float64)
+    signed_areas[has_points] = np.add.reduceat(
+        float_points[:, 0] * float_points[next_points, 1] - float_points[next_points, 0] * float_points[:, 1],
+        offsets[:-1][has_points],
+    )
+    orientations = np.sign(signed_areas).astype(np.int64)
+    steps[is_polygon_edge] = -np.sign(points[next_points[edge_points], 1] - points[edge_points, 1]) * (
+        orientations[pair_kind_indices[polygon_pairs]]
+    )
+
+    # Cut the edges to their tile
+    x = np.clip(x, tile_lower[pair_ids, 0], tile_upper[pair_ids, 0])
+    y_low = np.maximum(y_low, tile_lower[pair_ids, 1])
+    y_high = np.minimum(y_high, tile_upper[pair_ids, 1])
+    is_long = y_high > y_low
+    pair_ids = pair_ids[is_long]
+    return (
+        x[is_long],
+        tiling.get_key(tiles[pair_ids], y_low[is_long]),
+        tiling.get_key(tiles[pair_ids], y_high[is_long]),
+        steps[is_long],
+    )
+
+
+def _covered_runs(edges, keys: np.ndarray, operation):
+    """
+    Returns the x-intervals where the operation of the coverage of the operands is true, in every band between
+    consecutive keys, as (band, x_low, x_high) arrays. Touching intervals are joined.
+    """
+    bands, x, steps = [], [], []
+    for operand, (edge_x, key_low, key_high, edge_steps) in enumerate(edges):
+        first_bands = np.searchsorted(keys, key_low)
+        band_counts = np.searchsorted(keys, key_high) - first_bands
+        edge_ids = np.repeat(np.arange(len(edge_x)), band_counts)
+        bands.append(
+            np.repeat(first_bands, band_counts)
+            + (np.arange(band_counts.sum()) - np.repeat(_offsets_from_counts(band_counts)[:-1], band_counts))
+        )
+        x.append(edge_x[edge_ids])
+        operand_steps = np.zeros((len(edge_ids), len(edges)), dtype=np.int32)
+        operand_steps[:, operand] = edge_steps[edge_ids]
+        steps.append(operand_steps)
+    bands, x, steps = np.concatenate(bands), np.concatenate(x), np.concatenate(steps)
+
+    if len(x) and len(keys) * (int(x.max() - x.min()) + 1) < 1 << 62:
+        order = np.argsort(bands * (int(x.max() - x.min()) + 1) + (x - x.min()))
+    else:
+        order = np.lexsort((x, bands))
+    bands, x = bands[order], x[order]
+    # The steps of every band add up to 0, so a running sum over all bands gives the coverage after each step
+    is_covered = np.cumsum(steps[order], axis=0, dtype=np.int32) > 0
+    if len(edges) == 1:
+        is_inside = is_covered[:, 0]
+    else:
+        is_inside = operation(is_covered[:, 0], is_covered[:, 1])
+
+    is_segment = (bands[:-1] == bands[1:]) & (x[1:] > x[:-1]) & is_inside[:-1]
+    segment_bands = bands[:-1][is_segment]
+    starts, ends = x[:-1][is_segment], x[1:][is_segment]
+    if len(starts) == 0:
+        return segment_bands, starts, ends
+    is_run_start = np.ones(len(starts), dtype=bool)
+    is_run_start[1:] = (segment_bands[1:] != segment_bands[:-1]) | (starts[1:] != ends[:-1])
+    run_starts = np.flatnonzero(is_run_start)
+    run_ends = np.append(run_starts[1:], len(starts)) - 1
+    return segment_bands[run_starts], starts[run_starts], ends[run_ends]
+
+
+def _merge_bands(bands, x_low, x_high, ys) -> np.ndarray:
+    """Merges identical intervals in consecutive bands into (x_low, x_high, y_low, y_high) rectangles"""
+    order = np.lexsort((bands, x_high, x_low))
+    bands, x_low, x_high = bands[order], x_low[order], x_high[order]
+    is_rectangle_start = np.ones(len(bands), dtype=bool)
+    is_rectangle_start[1:] = (
+        (x_low[1:] != x_low[:-1]) | (x_high[1:] != x_high[:-1]) | (bands[1:] != bands[:-1] + 1)
+    )
+    starts = np.flatnonzero(is_rectangle_start)
+    ends = np.append(starts[1:], len(bands)) - 1
+    rectangles = np.stack([x_low[starts], x_high[starts], ys[bands[starts]], ys[bands[ends] + 1]], axis=1)
+    return rectangles
+
+
+def _merge_abutting(rectangles: np.ndarray, vertical: bool) -> np.ndarray:
+    """
+    Merges chains of (x_low, x_high, y_low, y_high) rectangles with the same x-interval that continue
+    each other in y, or with vertical=False, the same y-interval that continue each other in x
+    """
+    if not vertical:
+        return _merge_abutting(rectangles[:, [2, 3, 0, 1]], vertical=True)[:, [2, 3, 0, 1]]
+    order = np.lexsort((rectangles[:, 2], rectangles[:, 1], rectangles[:, 0]))
+    rectangles = rectangles[order]
+    is_chain_start = np.ones(len(rectangles), dtype=bool)
+    is_chain_start[1:] = (
+        (rectangles[1:, 0] != rectangles[:-1, 0])
+        | (rectangles[1:, 1] != rectangles[:-1, 1])
+        | (rectangles[1:, 2] != rectangles[:-1, 3])
+    )
+    starts = np.flatnonzero(is_chain_start)
+    ends = np.append(starts[1:], len(rectangles)) - 1
+    merged = rectangles[starts]
+    merged[:, 3] = rectangles[ends, 3]
+    return merged
+
+
+def _outline_loops(rectangles: np.ndarray):
+    """
+    Traces the outline of the area covered by non-overlapping (x_low, x_high, y_low, y_high) rectangles.
+    Returns the vertices of one closed loop per connected region as (points, offsets), where holes are joined to
+    the surrounding outline by a cut of zero width, so every region can be written as a single polygon.
+    """
+    segments = [
+        _directed_segments(rectangles[:, [0, 1]], rectangles[:, 2], rectangles[:, 3], horizontal=True),
+        _directed_segments(rectangles[:, [2, 3]], rectangles[:, 0], rectangles[:, 1], horizontal=False),
+    ]
+    starts = np.concatenate([segment_starts for segment_starts, _ in segments])
+    ends = np.concatenate([segment_ends for _, segment_ends in segments])
+    directions = np.sign(ends - starts)
+    next_segments = _link_segments(starts, ends, directions)
+
+    # A vertex per segment, at its start
+    order, offsets = _trace_loops(next_segments)
+    areas = _loop_areas(starts, order, offsets)
+    if np.any(areas < 0):
+        # Number the segments loop by loop, so the links are mostly to the next number when tracing again
+        ranks = np.empty_like(order)
+        ranks[order] = np.arange(len(order))
+        starts, ends, directions = starts[order], ends[order], directions[order]
+        next_segments, order = ranks[next_segments[order]], np.arange(len(order))
+        starts, next_segments = _join_holes(rectangles, starts, ends, directions, next_segments, order, offsets, areas)
+        order, offsets = _trace_loops(next_segments)
+    return starts[order], offsets
+
+
+def _directed_segments(intervals: np.ndarray, low: np.ndarray, high: np.ndarray, horizontal: bool):
+    """
+    Returns the outline segments along one axis as (starts, ends) point arrays, directed so the covered area is
+    on the left. intervals are the extents of the rectangles along the segments, and low and high the
+    coordinates of the lines where the rectangles begin and end.
+    """
+    lines = np.concatenate([low, low, high, high])
+    positions = np.concatenate([intervals[:, 0], intervals[:, 1], intervals[:, 0], intervals[:, 1]])
+    count = len(low)
+    steps = np.concatenate([np.ones(count), -np.ones(count), -np.ones(count), np.ones(count)]).astype(np.int64)
+    order = np.lexsort((positions, lines))
+    lines, positions = lines[order], positions[order]
+    # +1 where the covered area is on the high side of the line, -1 where it is on the low side
+    sides = np.cumsum(steps[order])
+
+    is_segment = (lines[:-1] == lines[1:]) & (positions[1:] > positions[:-1]) & (sides[:-1] != 0)
+    segment_lines, sides = lines[:-1][is_segment], sides[:-1][is_segment]
+    segment_starts, segment_ends = positions[:-1][is_segment], positions[1:][is_segment]
+    is_run_start = np.ones(len(segment_starts), dtype=bool)
+    is_run_start[1:] = (
+        (segment_lines[1:] != segment_lines[:-1])
+        | (segment_starts[1:] != segment_ends[:-1])
+        | (sides[1:] != sides[:-1])
+    )
+    run_starts = np.flatnonzero(is_run_start)
+    run_ends = np.append(run_starts[1:], len(segment_starts)) - 1
+    segment_lines, sides = segment_lines[run_starts], sides[run_starts]
+    segment_starts, segment_ends = segment_starts[run_starts], segment_ends[run_ends]
+
+    # Keep the covered area on the left: bottom edges go +x and left edges go -y
+    is_forward = sides > 0 if horizontal else sides < 0
+    first = np.where(is_forward, segment_starts, segment_ends)
+    second = np.where(is_forward, segment_ends, segment_starts)
+    if horizontal:
+        return np.stack([first, segment_lines], axis=1), np.stack([second, segment_lines], axis=1)
+    return np.stack([segment_lines, first], axis=1), np.stack([segment_lines, second], axis=1)
+
+
+def _link_segments(starts: np.ndarray, ends: np.ndarray, directions: np.ndarray) -> np.ndarray:
+    """
+    Returns the segment that follows each segment along the outline. Where two regions touch at a corner,
+    two segments start at the same point, and the one turning left is taken so the regions stay separate loops.
+    """
+    lower = starts.min(axis=0) if len(starts) else np.zeros(2, dtype=np.int64)
+    span = int(starts[:, 1].max() - lower[1]) + 1 if len(starts) else 1
+    start_keys = (starts[:, 0] - lower[0]) * span + (starts[:, 1] - lower[1])
+    end_keys = (ends[:, 0] - lower[0]) * span + (ends[:, 1] - lower[1])
+    order = np.argsort(start_keys)
+    first = np.searchsorted(start_keys[order], end_keys)
+    next_segments = order[first]
+
+    is_corner = np.searchsorted(start_keys[order], end_keys, side="right") - first == 2
+    left_turns = np.stack([-directions[is_corner, 1], directions[is_corner, 0]], axis=1)
+    is_second_left = np.all(directions[order[first[is_corner] + 1]] == left_turns, axis=1)
+    next_segments[is_corner] = order[first[is_corner] + is_second_left]
+    return next_segments
+
+
+def _trace_loops(next_nodes: np.ndarray):
+    """
+    Splits a permutation into its cycles by pointer jumping. Returns the nodes ordered loop by loop,
+    starting at the lowest node of each loop, and the offsets of the loops.
+    """
+    count = len(next_nodes)
+    index_type = np.int32 if count < 2**31 else np.int64
+    next_nodes = next_nodes.astype(index_type)
+    # Every loop is labelled by its lowest node; the labels are final once they agree along every loop
+    labels, jumps = np.arange(count, dtype=index_type), next_nodes
+    while not np.array_equal(labels, labels[next_nodes]):
+        labels = np.minimum(labels, labels[jumps])
+        jumps = jumps[jumps]
+
+    # The distance of every node to the last node of its loop
+    is_last = next_nodes == labels
+    distances = (~is_last).astype(index_type)
+    successors = np.where(is_last, np.arange(count, dtype=index_type), next_nodes)
+    while True:
+        following = successors[successors]
+        if np.array_equal(following, successors):
+            break
+        distances = distances + distances[successors]
+        successors = following
+
+    order = np.argsort(labels.astype(np.int64) * count + (count - 1 - distances), kind="stable")
+    loop_starts = np.flatnonzero(np.append(True, labels[order][1:] != labels[order][:-1]))
+    return order, np.append(loop_starts, count)
+
+
+def _loop_areas(points: np.ndarray, order: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """Returns the signed area of every loop, which is positive for counterclockwise loops"""
+    loop_points = points[order].astype(np.float64)
+    following = np.arange(1, len(order) + 1)
+    following[offsets[1:] - 1] = offsets[:-1]
+    cross = loop_points[:, 0] * loop_points[following, 1] - loop_points[following, 0] * loop_points[:, 1]
+    return np.add.reduceat(cross, offsets[:-1]) / 2 if len(order) else np.zeros(0)
+
+
+def _join_holes(rectangles, starts, ends, directions, next_segments, order, offsets, areas):
+    """
+    Joins every hole to the outline directly below its lowest vertex with a vertical cut, going up to the hole,
+    around it and back down. Returns the vertices and the links of the joined outline.
+    """
+    holes = np.flatnonzero(areas < 0)
+    loop_ids = np.repeat(np.arange(len(areas)), np.diff(offsets))
+    hole_nodes = order[np.isin(loop_ids, holes)]
+    hole_ids = loop_ids[np.isin(loop_ids, holes)]
+    # The lowest vertex of every hole, and the leftmost of those
+    ranked = np.lexsort((starts[hole_nodes, 0], starts[hole_nodes, 1], hole_ids))
+    is_first = np.append(True, hole_ids[ranked][1:] != hole_ids[ranked][:-1])
+    lowest = hole_nodes[ranked[is_first]]
+    x, y = starts[lowest, 0], starts[lowest, 1]
+
+    # Walk down through the rectangles right of the cut until the covered area ends
+    rectangle_tops = _Interval_lookup(rectangles[:, 3], rectangles[:, 0], rectangles[:, 1])
+    bottoms = y.copy()
+    pending = np.arange(len(lowest))
+    while len(pending):
+        below = rectangle_tops.find(bottoms[pending], x[pending])
+        pending = pending[below >= 0]
+        bottoms[pending] = rectangles[below[below >= 0], 2]
+    is_bottom = directions[:, 0] > 0
+    targets = np.flatnonzero(is_bottom)[
+        _Interval_lookup(starts[is_bottom, 1], starts[is_bottom, 0], ends[is_bottom, 0]).find(bottoms, x)
+    ]
+
+    # Every cut adds four vertices: its bottom, two copies of the lowest vertex of the hole, and its bottom again.
+    # Cuts into the same segment are chained from left to right.
+    cut_order = np.lexsort((x, targets))
+    lowest, x, bottoms, targets = lowest[cut_order], x[cut_order], bottoms[cut_order], targets[cut_order]
+    count, cut_count = len(starts), len(lowest)
+    cut_bottoms = count + 4 * np.arange(cut_count)
+    is_last = np.append(targets[1:] != targets[:-1], True)
+    is_first = np.append(True, targets[1:] != targets[:-1])
+    followers = np.where(is_last, next_segments[targets], np.roll(cut_bottoms, -1))
+    cut_nodes = np.stack([cut_bottoms + 1, next_segments[lowest], cut_bottoms + 3, followers], axis=1)
+    cut_points = np.stack(
+        [np.stack([x, bottoms], axis=1), starts[lowest], starts[lowest], np.stack([x, bottoms], axis=1)], axis=1
+    )
+
+    previous_nodes = np.empty_like(next_segments)
+    previous_nodes[next_segments] = np.arange(count)
+    next_nodes = np.concatenate([next_segments, cut_nodes.reshape(-1)])
+    next_nodes[previous_nodes[lowest]] = cut_bottoms + 2
+    next_nodes[targets[is_first]] = cut_bottoms[is_first]
+    points = np.concatenate([starts, cut_points.reshape(-1, 2)])
+
+    # The lowest vertices themselves are replaced by their copies
+    is_used = np.ones(len(points), dtype=bool)
+    is_used[lowest] = False
+    new_numbers = np.cumsum(is_used) - 1
+    return points[is_used], new_numbers[next_nodes[is_used]]
+
+
+class _Interval_lookup:
+    """Finds the interval [low, high) on a given line that contains a position. Intervals on a line must not overlap."""
+
+    def __init__(self, lines: np.ndarray, lows: np.ndarray, highs: np.ndarray):
+        self.lines, self.lows, self.highs = lines, lows, highs
+        self.unique_lines = np.unique(lines)
+        self.lower = lows.min(initial=0)
+        self.span = int(highs.max(initial=0) - self.lower) + 1
+        keys = np.searchsorted(self.unique_lines, lines) * self.span + (lows - self.lower)
+        self.order = np.argsort(keys)
+        self.sorted_keys = keys[self.order]
+
+    def find(self, query_lines: np.ndarray, query_positions: np.ndarray) -> np.ndarray:
+        """Returns the index of the interval containing every query, or -1"""
+        if len(self.lines) == 0:
+            return np.full(len(query_lines), -1)
+        offsets = np.clip(query_positions - self.lower, 0, self.span - 1)
+        query_keys = np.searchsorted(self.unique_lines, query_lines) * self.span + offsets
+        found = self.order[np.maximum(np.searchsorted(self.sorted_keys, query_keys, side="right") - 1, 0)]
+        is_found = (
+            (self.lines[found] == query_lines)
+            & (self.lows[found] <= query_positions)
+            & (query_positions < self.highs[found])
+        )
+        return np.where(is_found, found, -1)
+
+
+def _shape_arrays_from_edges(rectangles: np.ndarray) -> CIF_shape_arrays:
+    """
+    Converts (x_low, x_high, y_low, y_high) rectangles in doubled coordinates to CIF rectangles,
+    or to polygons where the center is not a whole nanometer
+    """
+    rectangles = rectangles.astype(np.int64).reshape(-1, 4)
+    sizes = rectangles[:, [1, 3]] - rectangles[:, [0, 2]]
+    doubled_centers = rectangles[:, [1, 3]] + rectangles[:, [0, 2]]
+    is_box = np.all((sizes % 2 == 0) & (doubled_centers % 4 == 0), axis=1)
+
+    polygons = (rectangles[~is_box] + 1) // 2
+    polygon_points = np.stack(
+        [polygons[:, [0, 2]], polygons[:, [1, 2]], polygons[:, [1, 3]], polygons[:, [0, 3]]], axis=1
+    ).reshape(-1, 2)
+    return CIF_shape_arrays.from_arrays(
+        rectangles=np.concatenate([sizes[is_box] // 2, doubled_centers[is_box] // 4], axis=1),
+        polygon_points=polygon_points,
+        polygon_offsets=4 * np.arange(len(polygons) + 1),
+    )
+
+
+def _shape_arrays_from_loops(points: np.ndarray, offsets: np.ndarray) -> CIF_shape_arrays:
+    """Converts outline loops in doubled coordinates to CIF rectangles where they are rectangles, and polygons"""
+    counts = np.diff(offsets)
+    is_rectangle = counts == 4
+    loop_ids = np.repeat(np.arange(len(counts)), counts)
+    is_rectangle_point = is_rectangle[loop_ids]
+
+    corners = points[is_rectangle_point].reshape(-1, 4, 2)
+    lower, upper = corners.min(axis=1), corners.max(axis=1)
+    rectangles = np.stack([lower[:, 0], upper[:, 0], lower[:, 1], upper[:, 1]], axis=1)
+    shape_arrays = _shape_arrays_from_edges(rectangles)
+    shape_arrays.extend_arrays(
+        CIF_shape_arrays.from_arrays(
+            polygon_points=(points[~is_rectangle_point] + 1) // 2,
+            polygon_offsets=_offsets_from_counts(counts[~is_rectangle]),
+        )
+    )
+    return shape_arrays
@@ -1,12 +1,158 @@
+import bz2
+import codecs
 import copy
+import gc
+import gzip
+import lzma
+import operator
+import os
+import queue
+import re
+import threading
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from collections import OrderedDict
+from collections.abc import Sequence
 import matplotlib.pyplot as plt
-from matplotlib.patches import Rectangle, Circle, Polygon
-from typing import List, Tuple, Iterable
+from matplotlib.patches import Rectangle, Polygon
+from matplotlib.collections import EllipseCollection, PolyCollection
+from typing import Dict, List, Tuple, Iterable
 import numpy as np
 
+try:
+    import zstandard
+except ImportError:
+    # Only needed for .cif.zst files
+    zstandard = None
+
+from CleWin_instrumentation import get_active_report, phase, _file_report
+
 # Define an alias for a point for typing clarity
 Point = Tuple[int, int]
 
+# Number of shapes serialized into one string before it is handed to the file
+CIF_SHAPES_PER_CHUNK = 4096
+
+# Size of the write buffer used by write_to_cif, in bytes
+CIF_WRITE_BUFFER_SIZE = 1 << 20
+
+# Number of characters read at a time by load_cif
+CIF_READ_CHUNK_SIZE = 1 << 22
+
+# Number of bytes of a file parsed by each task when load_cif runs in several processes
+CIF_PARALLEL_RANGE_SIZE = 1 << 24
+
+# Largest number of characters of CIF text kept per layer for reuse by the next export
+CIF_LAYER_CACHE_MAX_CHARACTERS = 1 << 26
+
+# The extension of compressed CIF files for each compression. The compression of a file is detected from it.
+CIF_COMPRESSED_EXTENSIONS = {"gzip": ".cif.gz", "bz2": ".cif.bz2", "xz": ".cif.xz", "zstd": ".cif.zst"}
+
+# The compression level used for each compression when none is given
+CIF_DEFAULT_COMPRESSION_LEVELS = {"gzip": 6, "bz2": 9, "xz": 6, "zstd": 10}
+
+# Number of blocks waiting for the background thread that compresses or decompresses a CIF file
+CIF_COMPRESSION_QUEUE_BLOCKS = 4
+
+# Codes identifying the kind of each shape in a CIF_shape_arrays
+RECTANGLE_KIND = 0
+POLYGON_KIND = 1
+WIRE_KIND = 2
+
+# The arrays of a CIF_shape_arrays, as named in CIF_shape_arrays.from_arrays
+CIF_SHAPE_ARRAY_NAMES = (
+    "kinds",
+    "rectangles",
+    "polygon_points",
+    "polygon_offsets",
+    "wire_points",
+    "wire_offsets",
+    "wire_widths",
+)
+
+
+class _CIF_edit_counter:
+    """Counts the changes of a shape list and of the shape objects it holds"""
+
+    __slots__ = ("count",)
+
+    def __init__(self):
+        self.count = 0
+
+
+def _count_shape_edit(shape):
+    """
+    Counts a change of the geometry of a shape object in every shape list that holds it. The owner of a shape
+    is None, the _CIF_edit_counter of the one list holding it, or a tuple of counters for several lists.
+    """
+    owner = shape._owner
+    if owner is None:
+        return
+    if type(owner) is tuple:
+        for counter in owner:
+            counter.count += 1
+    else:
+        owner.count += 1
+
+
+def _add_shape_owner(shape, counter: _CIF_edit_counter):
+    try:
+        owner = shape._owner
+    except AttributeError:
+        # Shape objects of other classes are not tracked
+        return
+    if owner is None:
+        shape._owner = counter
+    elif type(owner) is tuple:
+        if not any(other is counter for other in owner):
+            shape._owner = owner + (counter,)
+    elif owner is not counter:
+        shape._owner = (owner, counter)
+
+
+def _count_points_edit(shape):
+    """Counts a change made to the points of a polygon or wire in place, see _CIF_points"""
+    shape_arrays = getattr(shape, "_shape_arrays", None)
+    if shape_arrays is not None:
+        shape_arrays._modification_count += 1
+    _count_shape_edit(shape)
+
+
+class _CIF_points(np.ndarray):
+    """
+    The points of a CIF_polygon or CIF_wire as returned by its points property. Assignments to the array, or to
+    views taken from it, are counted as changes of the shape, so p.points[0][0] += 100 is written like
+    p.points = new_points.
+    """
+
+    def __array_finalize__(self, obj):
+        self._shape = getattr(obj, "_shape", None)
+
+    def __setitem__(self, index, value):
+        super().__setitem__(index, value)
+        if self._shape is not None:
+            _count_points_edit(self._shape)
+
+    def __repr__(self):
+        return repr(self.view(np.ndarray))
+
+
+def _tracked_points(points: np.ndarray, shape) -> _CIF_points:
+    tracked = points.view(_CIF_points)
+    tracked._shape = shape
+    return tracked
+
+
+def _tracked_slot(name: str) -> property:
+    """A property stored in the slot name, whose changes are counted by _count_shape_edit"""
+
+    def setter(self, value):
+        setattr(self, name, value)
+        _count_shape_edit(self)
+
+    return property(operator.attrgetter(name), setter)
+
 
 class CleWin_color:
     def __init__(self, red: int, green: int, blue: int):
@@ -16,11 +162,11 @@ class CleWin_color:
         self.rgb = [red, green, blue]
         for color_channel in self.rgb:
 
-            if not isinstance(color_channel, int):
-                raise "Color channels must be integers"
+            if not isinstance(color_channel, (int, np.integer)):
+                raise TypeError("Color channels must be integers")
 
             if not 0 <= color_channel <= 255:
-                raise "Color channels must have value between 0 and 255"
+                raise ValueError("Color channels must have value between 0 and 255")
 
         self.red = red
         self.green = green
@@ -34,6 +180,10 @@ class CleWin_color:
 
 
 class CIF_rectangle:
+    # The object takes 80 bytes, plus 28 bytes for each int coordinate larger than 256 that it does not share with
+    # another object, so about 140 to 210 bytes in a layout. Array-backed layers store a rectangle in 33 bytes.
+    __slots__ = ("_x_size_nm", "_y_size_nm", "_x_center_nm", "_y_center_nm", "color", "_owner")
+
     def __init__(
         self, x_size_nm, y_size_nm, x_center_nm, y_center_nm, color: str = "blue"
     ):
@@ -60,21 +210,55 @@ class CIF_rectangle:
             The color of the rectangle in plotting. Defaults to blue. Supports hex colors.
         """
 
-        self.x_size_nm = x_size_nm
-        self.y_size_nm = y_size_nm
-        self.x_center_nm = x_center_nm
-        self.y_center_nm = y_center_nm
+        self._x_size_nm = x_size_nm
+        self._y_size_nm = y_size_nm
+        self._x_center_nm = x_center_nm
+        self._y_center_nm = y_center_nm
         self.color = color
+        # The edit counters of the shape lists holding the rectangle, see _count_shape_edit
+        self._owner = None
+
+    x_size_nm = _tracked_slot("_x_size_nm")
+    y_size_nm = _tracked_slot("_y_size_nm")
+    x_center_nm = _tracked_slot("_x_center_nm")
+    y_center_nm = _tracked_slot("_y_center_nm")
 
     def get_cif_content(self):
-        return f"B {int(self.x_size_nm)} {int(self.y_size_nm)} {int(self.x_center_nm)} {int(self.y_center_nm)};\n"
+        return f"B {int(self._x_size_nm)} {int(self._y_size_nm)} {int(self._x_center_nm)} {int(self._y_center_nm)};\n"
 
     def shift(self, shift_x_nm, shift_y_nm):
-        self.x_center_nm += shift_x_nm
-        self.y_center_nm += shift_y_nm
+        self._shift_slots(shift_x_nm, shift_y_nm)
+        _count_shape_edit(self)
+
+    def transform(self, transformation: "CIF_transformation"):
+        """Mirrors, rotates and shifts the rectangle, see CIF_transformation"""
+        self._transform_slots(transformation)
+        _count_shape_edit(self)
+
+    def _shift_slots(self, shift_x_nm, shift_y_nm):
+        # Leaves counting the edit to the caller, see CleWin_layer.transform
+        self._x_center_nm += shift_x_nm
+        self._y_center_nm += shift_y_nm
+
+    def _transform_slots(self, transformation: "CIF_transformation"):
+        (xx, xy), (yx, yy) = transformation._matrix_rows
+        x_center_nm, y_center_nm = self._x_center_nm, self._y_center_nm
+        self._x_center_nm = xx * x_center_nm + xy * y_center_nm + transformation.x_shift_nm
+        self._y_center_nm = yx * x_center_nm + yy * y_center_nm + transformation.y_shift_nm
+        if transformation.rotation_deg % 180 != 0:
+            self._x_size_nm, self._y_size_nm = self._y_size_nm, self._x_size_nm
+
+    def get_bounding_box(self):
+        """Returns the bounding box of the rectangle as (x_min, y_min, x_max, y_max) in nm"""
+        return (
+            self.x_center_nm - self.x_size_nm / 2,
+            self.y_center_nm - self.y_size_nm / 2,
+            self.x_center_nm + self.x_size_nm / 2,
+            self.y_center_nm + self.y_size_nm / 2,
+        )
 
     def deepcopy(self):
-        return copy.deepcopy(self)
+        return CIF_rectangle(self._x_size_nm, self._y_size_nm, self._x_center_nm, self._y_center_nm, self.color)
 
     def add_shape_to_ax(self, ax: plt.Axes, alpha=1):
         ax.add_patch(
@@ -93,6 +277,8 @@ class CIF_rectangle:
 
 
 class CIF_polygon:
+    __slots__ = ("_points", "color", "_owner")
+
     def __init__(self, points, color: str = "blue"):
         """
         A polygon CIF object.
@@ -108,26 +294,51 @@ class CIF_polygon:
         color: str
             The color of the polygon in plotting. Defaults to blue. Supports hex colors.
         """
+        self._owner = None
         self.points = points
         self.color = color
 
-    def get_cif_content(self):
-        cif_content = "P"
-        for point in self.points:
-            x_coord = int(point[0])
-            y_coord = int(point[1])
-            cif_content += f" {x_coord} {y_coord}"
-        cif_content += ";\n"
+    @property
+    def points(self) -> np.ndarray:
+        """
+        The corners as an (N, 2) array in nm, int64 for integer coordinates and float64 otherwise.
+        Coordinates are truncated to whole nanometers when the polygon is written.
+        """
+        return _tracked_points(self._points, self)
 
-        return cif_content
+    @points.setter
+    def points(self, points):
+        self._points = _as_points(points)
+        _count_shape_edit(self)
+
+    def get_cif_content(self):
+        coordinates = "".join(f" {x} {y}" for x, y in _truncated(self.points).tolist())
+        return f"P{coordinates};\n"
 
     def shift(self, shift_x_nm, shift_y_nm):
-        for n in range(len(self.points)):
-            self.points[n][0] += shift_x_nm
-            self.points[n][1] += shift_y_nm
+        self._shift_slots(shift_x_nm, shift_y_nm)
+        _count_shape_edit(self)
+
+    def transform(self, transformation: "CIF_transformation"):
+        """Mirrors, rotates and shifts the polygon, see CIF_transformation"""
+        self._transform_slots(transformation)
+        _count_shape_edit(self)
+
+    def _shift_slots(self, shift_x_nm, shift_y_nm):
+        # Leaves counting the edit to the caller, see CleWin_layer.transform
+        self._points = self._points + np.array([shift_x_nm, shift_y_nm])
+
+    def _transform_slots(self, transformation: "CIF_transformation"):
+        self._points = self._points @ transformation.matrix.T + transformation.translation
+
+    def get_bounding_box(self):
+        """Returns the bounding box of the polygon as (x_min, y_min, x_max, y_max) in nm"""
+        x_min, y_min = self.points.min(axis=0).tolist()
+        x_max, y_max = self.points.max(axis=0).tolist()
+        return (x_min, y_min, x_max, y_max)
 
     def deepcopy(self):
-        return copy.deepcopy(self)
+        return _new_polygon(np.array(self.points), self.color)
 
     def add_shape_to_ax(self, ax: plt.Axes, alpha: float = 1):
         xy = np.array(self.points)
@@ -136,6 +347,8 @@ class CIF_polygon:
 
 
 class CIF_wire:
+    __slots__ = ("_points", "_width_nm", "color", "_owner")
+
     def __init__(self, points: List[Point], width_nm: int, color: str = "blue"):
         """
         Create a wire CIF object.
@@ -153,70 +366,58 @@ class CIF_wire:
         color: str
             The color of the wire in plotting. Defaults to blue.
         """
-        if not isinstance(width_nm, (int, float)):
-            raise "Width must be a number"
+        if not isinstance(width_nm, (int, float, np.integer, np.floating)):
+            raise TypeError("Width must be a number")
 
         if not isinstance(points, Iterable):
-            raise "Points must be an iterable"
+            raise TypeError("Points must be an iterable")
 
-        self.points = np.array(points).squeeze()  # remove extra (empty) dimensions
-        self.width_nm = width_nm
+        self._owner = None
+        self.points = points
+        self._width_nm = width_nm
         self.color = color
 
-    def get_cif_content(self):
-        """Create a Wire object in the cif file in the proper .CIF format"""
-        cif_content = f"W {int(self.width_nm)}"
+    width_nm = _tracked_slot("_width_nm")
 
-        for point in self.points:
-            cif_content += f" {int(point[0])} {int(point[1])}"
+    @property
+    def points(self) -> np.ndarray:
+        """
+        The centerline points as an (N, 2) array in nm, int64 for integer coordinates and float64 otherwise.
+        Coordinates are truncated to whole nanometers when the wire is written.
+        """
+        return _tracked_points(self._points, self)
 
-        cif_content += ";\n"
+    @points.setter
+    def points(self, points):
+        self._points = _as_points(points)
+        _count_shape_edit(self)
 
-        return cif_content
+    def get_cif_content(self):
+        """Create a Wire object in the cif file in the proper .CIF format"""
+        coordinates = "".join(f" {x} {y}" for x, y in _truncated(self.points).tolist())
+        return f"W {int(self.width_nm)}{coordinates};\n"
 
     def shift(self, shift_x_nm, shift_y_nm):
         """Shift the wire by a certain amount in the x and y direction"""
-        for n in range(len(self.points)):
-            self.points[n][0] += shift_x_nm
-            self.points[n][1] += shift_y_nm
-
-    def __paint_rect_between_points(
-        self,
-        point1: Point,
-        point2: Point,
-        width_nm: int,
-        color: str,
-        ax: plt.Axes,
-        alpha: float = 1,
-    ):
-
-        if not color:
-            color = self.color
-
-        rot = np.array([[0, -1], [1, 0]])
-        vec = point2 - point1
-        adjust = vec / np.linalg.norm(vec) * width_nm / 2
-        rot_adjust = rot @ adjust
-
-        angle = np.arctan2(vec[1], vec[0]) * 180 / np.pi  # angle in degrees...
+        self._shift_slots(shift_x_nm, shift_y_nm)
+        _count_shape_edit(self)
 
-        rect = Rectangle(
-            point1 - rot_adjust,
-            angle=angle,
-            width=np.linalg.norm(vec),
-            height=width_nm,
-            facecolor=color,
-            alpha=alpha,
-        )
+    def transform(self, transformation: "CIF_transformation"):
+        """Mirrors, rotates and shifts the wire, see CIF_transformation"""
+        self._transform_slots(transformation)
+        _count_shape_edit(self)
 
-        startCircle = Circle(point1, radius=width_nm / 2, facecolor=color, alpha=alpha)
-        endCircle = Circle(point2, radius=width_nm / 2, facecolor=color, alpha=alpha)
+    _shift_slots = CIF_polygon._shift_slots
+    _transform_slots = CIF_polygon._transform_slots
 
-        ax.add_patch(rect)
-        ax.add_patch(startCircle)
-        ax.add_patch(endCircle)
+    def get_bounding_box(self):
+        """Returns the bounding box of the wire, including its width, as (x_min, y_min, x_max, y_max) in nm"""
+        x_min, y_min = (self.points.min(axis=0) - self.width_nm / 2).tolist()
+        x_max, y_max = (self.points.max(axis=0) + self.width_nm / 2).tolist()
+        return (x_min, y_min, x_max, y_max)
 
-        return None
+    def deepcopy(self):
+        return _new_wire(np.array(self.points), self.width_nm, self.color)
 
     def preview_plotAndShow(self, window_size: int = 10_000_000):
         """
@@ -231,9 +432,7 @@ class CIF_wire:
         """
         fig, ax = plt.subplots()
         ax.set_xlim(-window_size / 2, window_size / 2)
-        xy = np.array(self.points)
-        for pt1, pt2 in zip(xy[:-1], xy[1:]):
-            self.__paint_rect_between_points(pt1, pt2, self.width_nm, self.color, ax)
+        self.add_shape_to_ax(ax)
         fig.show()
 
     def add_shape_to_ax(self, ax: plt.Axes, alpha: float = 1):
@@ -245,278 +444,3565 @@ class CIF_wire:
         ax: plt.Axes
             The axes object to add the wire geometry to
         """
-        xy = np.array(self.points)
-        for pt1, pt2 in zip(xy[:-1], xy[1:]):
-            self.__paint_rect_between_points(
-                pt1, pt2, self.width_nm, self.color, ax, alpha=alpha
-            )
-
+        _add_wires_to_ax(
+            ax, CIF_shape_arrays.from_shapes([self]), np.zeros(1, dtype=np.int64), self.color, alpha
+        )
         return None
 
-
-class CleWin_layer(object):
-    def __init__(
-        self,
-        layer_name: str,
-        layer_alias: str,
-        layer_index: int,
-        fill_color: CleWin_color,
-        border_color: CleWin_color,
+class CIF_shape_arrays:
+    def __init__(self):
+        """
+        Columnar storage of the shapes of a layer.
+        Rectangles are stored as rows of (x_size_nm, y_size_nm, x_center_nm, y_center_nm) in an (N, 4) int64 array.
+        Polygon and wire vertices are stored in flat (M, 2) int64 coordinate buffers, where the vertices of shape n
+        are points[offsets[n]:offsets[n + 1]]. The kind of every shape is kept in insertion order, so the layer is
+        serialized in the same order as the shapes were added.
+
+        Coordinates are stored as integer nanometers, truncated the same way as in get_cif_content.
+        Shapes added one at a time are buffered and moved into the arrays the next time the arrays are accessed.
+        Changes to existing shapes made through shift and the shape views are counted in _modification_count,
+        while adding shapes is not, so layers only serialize shapes added since their last export again.
+        """
+        self._kinds = np.zeros(0, dtype=np.uint8)
+        self._rectangles = np.zeros((0, 4), dtype=np.int64)
+        self._polygon_points = np.zeros((0, 2), dtype=np.int64)
+        self._polygon_offsets = np.zeros(1, dtype=np.int64)
+        self._wire_points = np.zeros((0, 2), dtype=np.int64)
+        self._wire_offsets = np.zeros(1, dtype=np.int64)
+        self._wire_widths = np.zeros(0, dtype=np.int64)
+        self._kind_indices = None
+        self._pending: List[CIF_rectangle | CIF_polygon | CIF_wire] = []
+        self._modification_count = 0
+
+    @classmethod
+    def from_arrays(
+        cls,
+        rectangles=None,
+        polygon_points=None,
+        polygon_offsets=None,
+        wire_points=None,
+        wire_offsets=None,
+        wire_widths=None,
+        kinds=None,
     ):
-        # needs documentation, what is this?
-        self.layer_name = layer_name
-        self.layer_alias = layer_alias
-        self.layer_index = layer_index
-        self.fill_color = fill_color
-        self.border_color = border_color
-        self.shapes: List[CIF_rectangle | CIF_polygon | CIF_wire] = []
+        """
+        Creates the storage directly from arrays. Arrays that are not given are empty.
 
-    def add_shape_to_layer(self, shape: CIF_rectangle | CIF_polygon | CIF_wire):
-        self.shapes.append(shape)
+        Args:
+        -----
+        rectangles: np.ndarray
+            (N, 4) array of (x_size_nm, y_size_nm, x_center_nm, y_center_nm)
+        polygon_points: np.ndarray
+            (M, 2) array with the vertices of all polygons
+        polygon_offsets: np.ndarray
+            (P + 1,) array where polygon n has the vertices polygon_points[polygon_offsets[n]:polygon_offsets[n + 1]]
+        wire_points: np.ndarray
+            (K, 2) array with the centerline points of all wires
+        wire_offsets: np.ndarray
+            (W + 1,) array where wire n has the points wire_points[wire_offsets[n]:wire_offsets[n + 1]]
+        wire_widths: np.ndarray
+            (W,) array with the width of each wire in nm
+        kinds: np.ndarray
+            The kind of each shape in insertion order. Defaults to all rectangles, then all polygons, then all wires.
+        """
+        shape_arrays = cls()
+        if rectangles is not None:
+            shape_arrays._rectangles = _as_int64_array(rectangles).reshape(-1, 4)
+        if polygon_points is not None:
+            shape_arrays._polygon_points = _as_int64_array(polygon_points).reshape(-1, 2)
+            shape_arrays._polygon_offsets = _as_int64_array(polygon_offsets)
+        if wire_points is not None:
+            shape_arrays._wire_points = _as_int64_array(wire_points).reshape(-1, 2)
+            shape_arrays._wire_offsets = _as_int64_array(wire_offsets)
+            shape_arrays._wire_widths = _as_int64_array(wire_widths)
+
+        counts = (
+            len(shape_arrays._rectangles),
+            len(shape_arrays._polygon_offsets) - 1,
+            len(shape_arrays._wire_widths),
+        )
+        if len(shape_arrays._wire_offsets) - 1 != counts[WIRE_KIND]:
+            raise ValueError("wire_offsets and wire_widths describe a different number of wires")
 
-    def get_cif_declaration(self):
-        fill_color_str = self.fill_color.format_color_for_CleWin()
-        border_color_str = self.border_color.format_color_for_CleWin()
+        if kinds is None:
+            kinds = np.repeat(
+                np.array([RECTANGLE_KIND, POLYGON_KIND, WIRE_KIND], dtype=np.uint8), counts
+            )
+        kinds = np.asarray(kinds, dtype=np.uint8)
+        if tuple(np.bincount(kinds, minlength=3)[:3]) != counts or len(kinds) != sum(counts):
+            raise ValueError("kinds does not match the number of shapes in the arrays")
+        shape_arrays._kinds = kinds
 
-        # CleWin added because of the way the cif file is parsed by CleWin??
-        cif_declaration = f"L {self.layer_alias}; (CleWin: {self.layer_index} {self.layer_name}/{fill_color_str} {border_color_str});\n"
+        return shape_arrays
 
-        return cif_declaration
+    @classmethod
+    def from_shapes(cls, shapes: Iterable):
+        """
+        Creates the storage from CIF_rectangle, CIF_polygon and CIF_wire objects
 
-    def get_cif_content(self):
+        Args:
+        -----
+        shapes: Iterable[CIF_rectangle | CIF_polygon | CIF_wire]
+            The shapes to store, in order
         """
-        Prints the content of the layer in the proper .CIF (Caltech Intermediate Form) format
+        kinds = []
+        rectangles = []
+        polygon_points = []
+        polygon_counts = []
+        wire_points = []
+        wire_counts = []
+        wire_widths = []
+        for shape in shapes:
+            if isinstance(shape, CIF_rectangle):
+                kinds.append(RECTANGLE_KIND)
+                rectangles.append(
+                    (
+                        int(shape.x_size_nm),
+                        int(shape.y_size_nm),
+                        int(shape.x_center_nm),
+                        int(shape.y_center_nm),
+                    )
+                )
+            elif isinstance(shape, CIF_polygon):
+                kinds.append(POLYGON_KIND)
+                points = _as_int64_array(shape.points).reshape(-1, 2)
+                polygon_points.append(points)
+                polygon_counts.append(len(points))
+            elif isinstance(shape, CIF_wire):
+                kinds.append(WIRE_KIND)
+                points = _as_int64_array(shape.points).reshape(-1, 2)
+                wire_points.append(points)
+                wire_counts.append(len(points))
+                wire_widths.append(int(shape.width_nm))
+            else:
+                raise TypeError(f"Unsupported shape type {type(shape).__name__}")
+
+        return cls.from_arrays(
+            rectangles=np.array(rectangles, dtype=np.int64).reshape(-1, 4),
+            polygon_points=_concatenate_points(polygon_points),
+            polygon_offsets=_offsets_from_counts(polygon_counts),
+            wire_points=_concatenate_points(wire_points),
+            wire_offsets=_offsets_from_counts(wire_counts),
+            wire_widths=np.array(wire_widths, dtype=np.int64),
+            kinds=np.array(kinds, dtype=np.uint8),
+        )
+
+    @classmethod
+    def from_rectangles(cls, sizes_nm, centers_nm, drop_degenerate: bool = False) -> "CIF_shape_arrays":
         """
-        # Initiate the layer using "L {layer_alias}";
-        cif_content = f"L {self.layer_alias};\n"
+        Creates rectangles from arrays, validated in bulk. Sizes and centers are rounded to whole nm.
+
+        Args:
+        -----
+        sizes_nm: np.ndarray
+            (N, 2) array of (x_size_nm, y_size_nm), or a single size for all rectangles
+        centers_nm: np.ndarray
+            (N, 2) array of (x_center_nm, y_center_nm), or a single center for all rectangles
+        drop_degenerate: bool
+            Whether to leave out rectangles without area, which otherwise raise a ValueError
+        """
+        sizes = _snapped_points(sizes_nm, "sizes_nm")
+        centers = _snapped_points(centers_nm, "centers_nm")
+        if len(sizes) != len(centers) and 1 not in (len(sizes), len(centers)):
+            raise ValueError(f"Got {len(sizes)} sizes for {len(centers)} centers")
+        sizes, centers = np.broadcast_arrays(sizes, centers)
+        is_kept = _checked_degenerate(np.any(sizes <= 0, axis=1), "rectangles without area", drop_degenerate)
+        return cls.from_arrays(rectangles=np.concatenate([sizes, centers], axis=1)[is_kept])
+
+    @classmethod
+    def from_polygons(cls, vertices_nm, offsets=None, drop_degenerate: bool = False) -> "CIF_shape_arrays":
+        """
+        Creates polygons from arrays, validated in bulk. Vertices are rounded to whole nm, repeated vertices and
+        a last vertex equal to the first are removed, and clockwise polygons are reversed to counter-clockwise
+        order, keeping their first vertex.
 
-        for shape in self.shapes:
-            cif_content += shape.get_cif_content()
+        Args:
+        -----
+        vertices_nm: np.ndarray
+            (M, 2) array with the vertices of all polygons, or a (P, K, 2) array of P polygons with K vertices each
+        offsets: np.ndarray
+            (P + 1,) array where polygon n has the vertices vertices_nm[offsets[n]:offsets[n + 1]].
+            Only used with (M, 2) vertices.
+        drop_degenerate: bool
+            Whether to leave out polygons with less than 3 vertices or without area,
+            which otherwise raise a ValueError
+        """
+        points, offsets = _snapped_ragged_points(vertices_nm, offsets, "vertices_nm")
+        points, offsets = _remove_repeated_points(points, offsets, closed=True)
+        counts = np.diff(offsets)
+        polygon_ids = np.repeat(np.arange(len(counts)), counts)
+        positions = np.arange(len(points)) - offsets[:-1][polygon_ids]
+
+        # Twice the signed area, relative to the first vertex so the terms stay small far from the origin
+        following = np.where(
+            positions == counts[polygon_ids] - 1, offsets[:-1][polygon_ids], np.arange(1, len(points) + 1)
+        )
+        relative = (points - points[offsets[:-1][polygon_ids]]).astype(np.float64)
+        terms = relative[:, 0] * relative[following, 1] - relative[:, 1] * relative[following, 0]
+        signed_areas = np.bincount(polygon_ids, weights=terms, minlength=len(counts))
+        is_kept = _checked_degenerate(
+            (counts < 3) | (signed_areas == 0), "polygons with less than 3 vertices or without area", drop_degenerate
+        )
 
-        return cif_content
+        is_clockwise = (signed_areas < 0)[polygon_ids]
+        reversed_positions = (counts[polygon_ids] - positions) % np.maximum(counts[polygon_ids], 1)
+        points = points[offsets[:-1][polygon_ids] + np.where(is_clockwise, reversed_positions, positions)]
+        points, offsets = _select_ragged(points, offsets, np.flatnonzero(is_kept))
+        return cls.from_arrays(polygon_points=points, polygon_offsets=offsets)
 
-    def deepcopy(self):
-        return copy.deepcopy(self)
+    @classmethod
+    def from_wires(cls, points_nm, offsets, widths_nm, drop_degenerate: bool = False) -> "CIF_shape_arrays":
+        """
+        Creates wires from arrays, validated in bulk. Points and widths are rounded to whole nm,
+        and repeated points are removed.
 
-    def shift(self, shift_x_nm, shift_y_nm):
-        for shape in self.shapes:
-            shape.shift(shift_x_nm, shift_y_nm)
+        Args:
+        -----
+        points_nm: np.ndarray
+            (K, 2) array with the centerline points of all wires, or a (W, K, 2) array of W wires with K points each
+        offsets: np.ndarray
+            (W + 1,) array where wire n has the points points_nm[offsets[n]:offsets[n + 1]], or None for
+            (W, K, 2) points
+        widths_nm: np.ndarray
+            (W,) array with the width of each wire, or a single width for all wires
+        drop_degenerate: bool
+            Whether to leave out wires with less than 2 points or without width, which otherwise raise a ValueError
+        """
+        points, offsets = _snapped_ragged_points(points_nm, offsets, "points_nm")
+        widths = _snapped_to_grid(widths_nm, "widths_nm")
+        if widths.ndim > 1 or widths.ndim == 1 and len(widths) not in (1, len(offsets) - 1):
+            raise ValueError(f"Got {widths.size} widths for {len(offsets) - 1} wires")
+        widths = np.broadcast_to(widths.reshape(-1), len(offsets) - 1)
+        points, offsets = _remove_repeated_points(points, offsets, closed=False)
+        is_kept = _checked_degenerate(
+            (np.diff(offsets) < 2) | (widths <= 0), "wires with less than 2 points or without width", drop_degenerate
+        )
+        points, offsets = _select_ragged(points, offsets, np.flatnonzero(is_kept))
+        return cls.from_arrays(wire_points=points, wire_offsets=offsets, wire_widths=widths[is_kept])
+
+    def _flush(self):
+        if self._pending:
+            pending = self._pending
+            self._pending = []
+            self.extend_arrays(CIF_shape_arrays.from_shapes(pending))
+
+    @property
+    def kinds(self) -> np.ndarray:
+        self._flush()
+        return self._kinds
+
+    @property
+    def rectangles(self) -> np.ndarray:
+        self._flush()
+        return self._rectangles
+
+    @property
+    def polygon_points(self) -> np.ndarray:
+        self._flush()
+        return self._polygon_points
+
+    @property
+    def polygon_offsets(self) -> np.ndarray:
+        self._flush()
+        return self._polygon_offsets
+
+    @property
+    def wire_points(self) -> np.ndarray:
+        self._flush()
+        return self._wire_points
+
+    @property
+    def wire_offsets(self) -> np.ndarray:
+        self._flush()
+        return self._wire_offsets
+
+    @property
+    def wire_widths(self) -> np.ndarray:
+        self._flush()
+        return self._wire_widths
+
+    def __len__(self):
+        return len(self._kinds) + len(self._pending)
+
+    def append(self, shape: CIF_rectangle | CIF_polygon | CIF_wire):
+        self._pending.append(shape)
+
+    def extend(self, shapes: Iterable):
+        self._pending.extend(shapes)
+
+    def copy(self) -> "CIF_shape_arrays":
+        """Returns an independent copy of the storage"""
+        self._flush()
+        return CIF_shape_arrays.from_arrays(
+            rectangles=self._rectangles.copy(),
+            polygon_points=self._polygon_points.copy(),
+            polygon_offsets=self._polygon_offsets.copy(),
+            wire_points=self._wire_points.copy(),
+            wire_offsets=self._wire_offsets.copy(),
+            wire_widths=self._wire_widths.copy(),
+            kinds=self._kinds.copy(),
+        )
+
+    @property
+    def nbytes(self) -> int:
+        """The number of bytes used by the arrays"""
+        self._flush()
+        return sum(
+            array.nbytes
+            for array in (
+                self._kinds,
+                self._rectangles,
+                self._polygon_points,
+                self._polygon_offsets,
+                self._wire_points,
+                self._wire_offsets,
+                self._wire_widths,
+            )
+        )
+
+    def set_read_only(self):
+        """Prevents the arrays from being modified in place, e.g. for geometry shared between several users"""
+        self._flush()
+        for array in (
+            self._kinds,
+            self._rectangles,
+            self._polygon_points,
+            self._polygon_offsets,
+            self._wire_points,
+            self._wire_offsets,
+            self._wire_widths,
+        ):
+            array.setflags(write=False)
+
+    @classmethod
+    def concatenate(cls, shape_arrays_list: List["CIF_shape_arrays"]) -> "CIF_shape_arrays":
+        """Returns the shapes of all the given storages in one new storage, keeping their order"""
+        shape_arrays_list = list(shape_arrays_list)
+        if not shape_arrays_list:
+            return cls()
+        return cls.from_arrays(
+            rectangles=np.concatenate([other.rectangles for other in shape_arrays_list]),
+            polygon_points=np.concatenate(
+                [other.polygon_points for other in shape_arrays_list]
+            ),
+            polygon_offsets=_concatenate_offsets(
+                [other.polygon_offsets for other in shape_arrays_list]
+            ),
+            wire_points=np.concatenate([other.wire_points for other in shape_arrays_list]),
+            wire_offsets=_concatenate_offsets(
+                [other.wire_offsets for other in shape_arrays_list]
+            ),
+            wire_widths=np.concatenate([other.wire_widths for other in shape_arrays_list]),
+            kinds=np.concatenate([other.kinds for other in shape_arrays_list]),
+        )
 
-    def plot_content(self, window_size: int = 10_000_000, ax=None):
+    def repeated(self, site_offsets) -> "CIF_shape_arrays":
         """
-        Plots the content of the layer in a matplotlib window
+        Returns a copy of all shapes for every site, shifted by the offset of the site.
+        The copies are generated in one go with NumPy broadcasting, and all shapes of the first site come first.
 
         Args:
         -----
-        window_size: int
-            The side-length of the total window in nm
-        ax: plt.Axes
-            The axes object to add the wire geometry to
+        site_offsets: np.ndarray
+            (S, 2) array with the (x, y) shift of every site in nm
         """
-        show = False
-        if ax is None:
-            fig, ax = plt.subplots()
-            show = True
-        ax.set_xlim(-window_size / 2, window_size / 2)
-        ax.set_ylim(-window_size / 2, window_size / 2)
-        for shape in self.shapes:
-            shape.add_shape_to_ax(ax=ax)
-        if show:
-            plt.show()
-        return fig, ax
+        self._flush()
+        site_offsets = _as_int64_array(site_offsets).reshape(-1, 2)
+        site_count = len(site_offsets)
+
+        rectangles = np.repeat(self._rectangles[None], site_count, axis=0)
+        rectangles[:, :, 2:] += site_offsets[:, None, :]
+
+        return CIF_shape_arrays.from_arrays(
+            rectangles=rectangles.reshape(-1, 4),
+            polygon_points=(self._polygon_points[None] + site_offsets[:, None, :]).reshape(-1, 2),
+            polygon_offsets=_repeat_offsets(self._polygon_offsets, site_count),
+            wire_points=(self._wire_points[None] + site_offsets[:, None, :]).reshape(-1, 2),
+            wire_offsets=_repeat_offsets(self._wire_offsets, site_count),
+            wire_widths=np.tile(self._wire_widths, site_count),
+            kinds=np.tile(self._kinds, site_count),
+        )
 
-      
-def write_to_cif(filename, layers: List[CleWin_layer]):
-    # Needs documentation
-    cif = "(1 unit = 0.001 micron);\n"
+    def extend_arrays(self, other: "CIF_shape_arrays"):
+        """Appends all shapes of another CIF_shape_arrays, keeping their order"""
+        self._flush()
+        self._rectangles = np.concatenate([self._rectangles, other.rectangles])
+        self._polygon_points = np.concatenate([self._polygon_points, other.polygon_points])
+        self._polygon_offsets = np.concatenate(
+            [self._polygon_offsets, other.polygon_offsets[1:] + self._polygon_offsets[-1]]
+        )
+        self._wire_points = np.concatenate([self._wire_points, other.wire_points])
+        self._wire_offsets = np.concatenate(
+            [self._wire_offsets, other.wire_offsets[1:] + self._wire_offsets[-1]]
+        )
+        self._wire_widths = np.concatenate([self._wire_widths, other.wire_widths])
+        self._kinds = np.concatenate([self._kinds, other.kinds])
+        self._kind_indices = None
+
+    def take(self, indices) -> "CIF_shape_arrays":
+        """Returns a new CIF_shape_arrays with the shapes at the given insertion indices, in the given order"""
+        indices = _as_int64_array(indices)
+        kinds = self.kinds[indices]
+        kind_indices = self.get_kind_indices()[indices]
+        rectangle_indices, polygon_indices, wire_indices = (
+            kind_indices[kinds == kind] for kind in (RECTANGLE_KIND, POLYGON_KIND, WIRE_KIND)
+        )
+        polygon_points, polygon_offsets = _select_ragged(
+            self._polygon_points, self._polygon_offsets, polygon_indices
+        )
+        wire_points, wire_offsets = _select_ragged(
+            self._wire_points, self._wire_offsets, wire_indices
+        )
+        return CIF_shape_arrays.from_arrays(
+            rectangles=self._rectangles[rectangle_indices],
+            polygon_points=polygon_points,
+            polygon_offsets=polygon_offsets,
+            wire_points=wire_points,
+            wire_offsets=wire_offsets,
+            wire_widths=self._wire_widths[wire_indices],
+            kinds=kinds,
+        )
 
-    cif += "(Layer names:);\n"
+    def get_kind_indices(self) -> np.ndarray:
+        """Returns, for every shape in insertion order, its index among the shapes of the same kind"""
+        self._flush()
+        if self._kind_indices is None or len(self._kind_indices) != len(self._kinds):
+            kind_indices = np.empty(len(self._kinds), dtype=np.int64)
+            for kind in (RECTANGLE_KIND, POLYGON_KIND, WIRE_KIND):
+                is_kind = self._kinds == kind
+                kind_indices[is_kind] = np.arange(np.count_nonzero(is_kind))
+            self._kind_indices = kind_indices
+        return self._kind_indices
+
+    def get_shape(self, index: int):
+        """Returns a CIF_rectangle, CIF_polygon or CIF_wire view on the shape with the given insertion index"""
+        kind = self.kinds[index]
+        kind_index = int(self.get_kind_indices()[index])
+        if kind == RECTANGLE_KIND:
+            return _CIF_rectangle_view(self, kind_index)
+        elif kind == POLYGON_KIND:
+            return _CIF_polygon_view(self, kind_index)
+        else:
+            return _CIF_wire_view(self, kind_index)
 
-    for layer in layers:
-        cif += layer.get_cif_declaration()
+    def shift(self, shift_x_nm, shift_y_nm):
+        """
+        Shifts all shapes. After a shift by a fraction of a nanometer, the coordinates are truncated to whole
+        nanometers like int(), as shape objects are when they are written.
+        """
+        self._flush()
+        self._modification_count += 1
+        shift = np.array([_as_shift(shift_x_nm), _as_shift(shift_y_nm)])
+        for points in (self._rectangles[:, 2:], self._polygon_points, self._wire_points):
+            np.add(points, shift, out=points, casting="unsafe")
+
+    def transformed(self, transformation: "CIF_transformation") -> "CIF_shape_arrays":
+        """Returns a new CIF_shape_arrays with all shapes transformed by the given transformation"""
+        self._flush()
+        rectangles = self._rectangles.copy()
+        rectangles[:, 2:] = transformation.apply_to_points(self._rectangles[:, 2:])
+        if transformation.rotation_deg % 180 != 0:
+            rectangles[:, :2] = self._rectangles[:, 1::-1]
+        return CIF_shape_arrays.from_arrays(
+            rectangles=rectangles,
+            polygon_points=transformation.apply_to_points(self._polygon_points),
+            polygon_offsets=self._polygon_offsets.copy(),
+            wire_points=transformation.apply_to_points(self._wire_points),
+            wire_offsets=self._wire_offsets.copy(),
+            wire_widths=self._wire_widths.copy(),
+            kinds=self._kinds.copy(),
+        )
 
-    # add .cif comment lol
-    cif += "(Top level:);\n"
+    def to_shapes(self) -> List[CIF_rectangle | CIF_polygon | CIF_wire]:
+        """Returns the shapes as independent CIF_rectangle, CIF_polygon and CIF_wire objects"""
+        self._flush()
+        with _gc_paused():
+            rectangles = [CIF_rectangle(*row) for row in self._rectangles.tolist()]
+            # The shapes get views into one copy of the points of all polygons and one of all wires
+            polygon_points = self._polygon_points.copy()
+            polygon_offsets = self._polygon_offsets.tolist()
+            polygons = [
+                _new_polygon(polygon_points[start:stop])
+                for start, stop in zip(polygon_offsets[:-1], polygon_offsets[1:])
+            ]
+            wire_points = self._wire_points.copy()
+            wire_offsets = self._wire_offsets.tolist()
+            wires = [
+                _new_wire(wire_points[start:stop], width)
+                for start, stop, width in zip(
+                    wire_offsets[:-1], wire_offsets[1:], self._wire_widths.tolist()
+                )
+            ]
+
+            if len(rectangles) == len(self._kinds):
+                return rectangles
+            shapes_by_kind = (iter(rectangles), iter(polygons), iter(wires))
+            return [next(shapes_by_kind[kind]) for kind in self._kinds.tolist()]
+
+    def get_bounding_box(self):
+        """
+        Returns the bounding box of all shapes as (x_min, y_min, x_max, y_max) in nm,
+        or None if there are no shapes. Wires are included with their width.
+        """
+        self._flush()
+        corners = []
+        if len(self._rectangles):
+            half_sizes = self._rectangles[:, :2] / 2
+            corners.append((self._rectangles[:, 2:] - half_sizes).min(axis=0))
+            corners.append((self._rectangles[:, 2:] + half_sizes).max(axis=0))
+        if len(self._polygon_points):
+            corners.append(self._polygon_points.min(axis=0))
+            corners.append(self._polygon_points.max(axis=0))
+        if len(self._wire_points):
+            half_widths = np.repeat(self._wire_widths, np.diff(self._wire_offsets))[:, None] / 2
+            corners.append((self._wire_points - half_widths).min(axis=0))
+            corners.append((self._wire_points + half_widths).max(axis=0))
+        if not corners:
+            return None
+        corners = np.array(corners, dtype=np.float64)
+        x_min, y_min = corners.min(axis=0).tolist()
+        x_max, y_max = corners.max(axis=0).tolist()
+        return (x_min, y_min, x_max, y_max)
+
+    def get_kind_bounding_boxes(self, kind: int) -> np.ndarray:
+        """
+        Returns the bounding boxes of all shapes of one kind as an (n, 4) float array of
+        (x_min, y_min, x_max, y_max) in nm. Wires are included with their width.
+        """
+        self._flush()
+        if kind == RECTANGLE_KIND:
+            half_sizes = self._rectangles[:, :2] / 2
+            return np.concatenate(
+                [self._rectangles[:, 2:] - half_sizes, self._rectangles[:, 2:] + half_sizes],
+                axis=1,
+            )
 
-    # Why is this aspect ratio chosen (1:10)? Erlend please explain
-    cif += "DS1 1 10;\n"
+        if kind == POLYGON_KIND:
+            points, offsets = self._polygon_points, self._polygon_offsets
+            margins = np.zeros(len(offsets) - 1)
+        else:
+            points, offsets = self._wire_points, self._wire_offsets
+            margins = self._wire_widths / 2
+        if len(offsets) == 1:
+            return np.zeros((0, 4))
+        if np.any(np.diff(offsets) == 0):
+            raise ValueError("Shapes without points have no bounding box")
+        starts = offsets[:-1]
+        lower = np.minimum.reduceat(points, starts, axis=0) - margins[:, None]
+        upper = np.maximum.reduceat(points, starts, axis=0) + margins[:, None]
+        return np.concatenate([lower, upper], axis=1)
+
+    def get_shape_bounding_boxes(self) -> np.ndarray:
+        """
+        Returns the bounding boxes of all shapes in insertion order as an (N, 4) float array of
+        (x_min, y_min, x_max, y_max) in nm
+        """
+        kinds = self.kinds
+        kind_indices = self.get_kind_indices()
+        boxes = np.empty((len(kinds), 4))
+        for kind in (RECTANGLE_KIND, POLYGON_KIND, WIRE_KIND):
+            is_kind = kinds == kind
+            if np.any(is_kind):
+                boxes[is_kind] = self.get_kind_bounding_boxes(kind)[kind_indices[is_kind]]
+        return boxes
+
+    def iter_cif_content(self, shapes_per_chunk: int = CIF_SHAPES_PER_CHUNK, start: int = 0):
+        """
+        Yields the shapes in the proper .CIF format, formatting runs of shapes of the same kind in bulk.
+        The output is identical to calling get_cif_content on the corresponding objects.
+        Serialization starts at the shape with insertion index start, and every yielded string after it
+        holds shapes_per_chunk shapes, except the last.
+        """
+        kinds = self.kinds
+        kind_indices = self.get_kind_indices()
+        for start in range(start, len(kinds), shapes_per_chunk):
+            stop = min(start + shapes_per_chunk, len(kinds))
+            run_starts = np.flatnonzero(np.diff(kinds[start:stop])) + 1 + start
+            run_bounds = [start, *run_starts.tolist(), stop]
+            chunk = []
+            for run_start, run_stop in zip(run_bounds[:-1], run_bounds[1:]):
+                first = int(kind_indices[run_start])
+                last = first + run_stop - run_start
+                kind = kinds[run_start]
+                if kind == RECTANGLE_KIND:
+                    chunk.append(self._format_rectangles(first, last))
+                elif kind == POLYGON_KIND:
+                    chunk.append(self._format_polygons(first, last))
+                else:
+                    chunk.append(self._format_wires(first, last))
+            yield "".join(chunk)
+
+    def _format_rectangles(self, first: int, last: int) -> str:
+        values = self._rectangles[first:last].ravel().tolist()
+        return ("B %d %d %d %d;\n" * (last - first)) % tuple(values)
+
+    def _format_polygons(self, first: int, last: int) -> str:
+        offsets = self._polygon_offsets[first : last + 1]
+        values = self._polygon_points[offsets[0] : offsets[-1]].ravel().tolist()
+        template = "".join(
+            ["P" + " %d %d" * count + ";\n" for count in np.diff(offsets).tolist()]
+        )
+        return template % tuple(values)
+
+    def _format_wires(self, first: int, last: int) -> str:
+        offsets = self._wire_offsets[first : last + 1]
+        counts = np.diff(offsets)
+        points = self._wire_points[offsets[0] : offsets[-1]]
+        # Interleave each width with the coordinates of its wire
+        values = np.empty(len(counts) + 2 * len(points), dtype=np.int64)
+        width_positions = 2 * (offsets[:-1] - offsets[0]) + np.arange(len(counts))
+        is_width = np.zeros(len(values), dtype=bool)
+        is_width[width_positions] = True
+        values[is_width] = self._wire_widths[first:last]
+        values[~is_width] = points.ravel()
+        template = "".join(
+            ["W %d" + " %d %d" * count + ";\n" for count in counts.tolist()]
+        )
+        return template % tuple(values.tolist())
 
-    # wtf is this ??
-    cif += "9 MainSymbol;\n"
 
-    for layer in layers:
-        cif += layer.get_cif_content()
+@contextmanager
+def _gc_paused():
+    """Pauses the cyclic garbage collector, which otherwise runs repeatedly while creating many shape objects"""
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
 
-    # mark cif function as done (Done Function, DF) and end file (End, E)
-    cif += "DF;\n"
-    cif += "C 1;\n"  # What is this??
-    cif += "E"
-
-    with open(file=f"{filename}.cif", mode="w") as file:
-        file.write(cif)
-
-
-def load_cif(filename):
-    # Needs documentation
-    with open(file=f"{filename}.cif", mode="r") as file:
-        cif = file.read()
-
-    # Upper and lower bound the string to find the relevant info
-    cif_relevant = cif.split("DF;")[0]
-    cif = cif_relevant.split("(Layer names:);\n")[1]
-    layer_info = cif.split("(Top level:);\n")[0]
-    shape_info = cif.split("(Top level:);\n")[1]
-
-    layers = []
-    # Exclude the first substring because it is not layer info
-    for layer_info_string in layer_info.split("L ")[1:]:
-        layer: CleWin_layer = layer_from_CleWin_string(layer_info_string)
-        layers.append(layer)
-
-    # Stuff that works, but I did not write
-    for layer_shapes_string in shape_info.split("L ")[1:]:
-        layer_alias = layer_shapes_string.split(";\n")[0]
-        shape_strings = layer_shapes_string.split(";\n")[1:-1]
-        shapes = shapes_from_string(shape_strings)
-        for layer in layers:
-            if layer_alias == layer.layer_alias:
-                for shape in shapes:
-                    layer.add_shape_to_layer(shape)
 
-    return layers
+def _as_int64_array(values) -> np.ndarray:
+    array = np.asarray(values)
+    if array.dtype != np.int64:
+        array = array.astype(np.int64)
+    return array
 
 
-def shapes_from_string(shape_strings):
-    # Needs documentation
-    shapes = []
+def _as_points(points) -> np.ndarray:
+    """
+    Returns a copy of the points as an (N, 2) array, which is int64 for integer coordinates and float64 otherwise,
+    so fractions of a nanometer are kept until the points are written
+    """
+    points = np.array(points)
+    dtype = np.int64 if points.dtype.kind in "biu" else np.float64
+    return points.astype(dtype, copy=False).reshape(-1, 2)
 
-    for i, shape_string in enumerate(shape_strings):
-        if shape_string[0] == "B":
-            values = shape_string.split(" ")[1:]
-            x_size = int(values[0])
-            y_size = int(values[1])
-            x_center = int(values[2])
-            y_center = int(values[3])
-            square = CIF_rectangle(
-                x_size_nm=x_size,
-                y_size_nm=y_size,
-                x_center_nm=x_center,
-                y_center_nm=y_center,
-            )
-            shapes.append(square)
-
-        elif shape_string[0] == "P":
-            value_strings = shape_string.split(" ")[1:]
-            values = []
-            for value_string in value_strings:
-                value_string = value_string.strip("\n")
-                values.append(int(value_string))
-
-            points = []
-            for x_coord, y_coord in zip(values[::2], values[1::2]):
-                point = [x_coord, y_coord]
-                points.append(point)
-
-            polygon = CIF_polygon(points=points)
-            shapes.append(polygon)
-
-        elif shape_string[0] == "W":
-            shape_string = shape_string[1:].strip(" ")
-            value_strings = shape_string.split(" ")
-            values = []
-            for value_string in value_strings:
-                value_string = value_string.strip("\n")
-                values.append(int(value_string))
-
-            width = values[0]
-            points = []
-            for x_coord, y_coord in zip(values[1::2], values[2::2]):
-                point = [x_coord, y_coord]
-                points.append(point)
-
-            wire = CIF_wire(points=points, width_nm=width)
-            shapes.append(wire)
 
-        else:
-            raise ValueError(
-                f"Unsupported shape encountered in shape number {i}:\n{shape_string}"
-            )
+def _truncated(points: np.ndarray) -> np.ndarray:
+    """Returns the points with coordinates truncated to whole nanometers like int(), as written in CIF"""
+    if points.dtype == np.int64:
+        return points
+    return points.astype(np.int64)
 
-    return shapes
 
+def _new_polygon(points: np.ndarray, color: str = "blue") -> CIF_polygon:
+    """Creates a CIF_polygon that takes an (N, 2) array as it is, without converting or copying it"""
+    polygon = CIF_polygon.__new__(CIF_polygon)
+    polygon._points = points
+    polygon.color = color
+    polygon._owner = None
+    return polygon
 
-def color_from_CleWin_string(color_string):
-    blue = int(f"0x{color_string[2:4]}", base=0)
-    green = int(f"0x{color_string[4:6]}", base=0)
-    red = int(f"0x{color_string[6:8]}", base=0)
 
-    return CleWin_color(red, green, blue)
+def _new_wire(points: np.ndarray, width_nm, color: str = "blue") -> CIF_wire:
+    """Creates a CIF_wire that takes an (N, 2) array as it is, without converting or copying it"""
+    wire = CIF_wire.__new__(CIF_wire)
+    wire._points = points
+    wire._width_nm = width_nm
+    wire.color = color
+    wire._owner = None
+    return wire
 
 
-def layer_from_CleWin_string(layer_string):
-    alias = layer_string.split(";")[0]
+def _concatenate_points(points: List[np.ndarray]) -> np.ndarray:
+    if not points:
+        return np.zeros((0, 2), dtype=np.int64)
+    return np.concatenate(points)
 
-    layer_string = layer_string.split(";")[1]
-    layer_string = layer_string.split("(")[1]
-    layer_string = layer_string.split(")")[0]
 
-    index = int(layer_string.split("/")[0].split(" ")[1])
-    name = " ".join(layer_string.split("/")[0].split(" ")[2:])
-    fill_color_string = layer_string.split("/")[1].split(" ")[0]
-    border_color_string = layer_string.split("/")[1].split(" ")[1]
-    fill_color = color_from_CleWin_string(fill_color_string)
-    border_color = color_from_CleWin_string(border_color_string)
+def _offsets_from_counts(counts) -> np.ndarray:
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return offsets
 
-    layer = CleWin_layer(
-        layer_name=name,
-        layer_alias=alias,
-        layer_index=index,
-        fill_color=fill_color,
-        border_color=border_color,
+
+def _concatenate_offsets(offsets_list: List[np.ndarray]) -> np.ndarray:
+    """Concatenates offset arrays of several coordinate buffers into offsets into the concatenated buffer"""
+    ends = np.cumsum([offsets[-1] for offsets in offsets_list])
+    starts = np.concatenate([[0], ends[:-1]])
+    return np.concatenate(
+        [np.zeros(1, dtype=np.int64)]
+        + [offsets[1:] + start for offsets, start in zip(offsets_list, starts)]
     )
 
-    return layer
 
+def _repeat_offsets(offsets: np.ndarray, count: int) -> np.ndarray:
+    """Returns the offsets of a coordinate buffer repeated count times"""
+    repeated = offsets[None, 1:] + (offsets[-1] * np.arange(count))[:, None]
+    return np.concatenate([np.zeros(1, dtype=np.int64), repeated.ravel()])
 
-def plotLayers(layers: List[CleWin_layer], window_size: int = 10_000_000, alpha=0.5):
-    """
-    Shows a preview of the cif objects for the different layers in a matplotlib window.
-    Note that the window size is in nm as with the rest of the library (for obvious reasons)
 
-    Also note that the the resulting layer will be one with alpha = 1. A lower alpha is used for the preview to
-    make it easier to see the different layers stacked. This has the unfortunate side effect of making wires look
-    like they are spotted and ugly, but this is not the case when printed. This is due to the way matplotlib handles
-    transparency and absolute sizing of shapes in the plot. A more thoughtful implementation of this function would
-    probably fix this, but it is not a priority.
+def _select_ragged(points: np.ndarray, offsets: np.ndarray, indices: np.ndarray):
+    """Returns the points and offsets of a subset of the shapes stored in a flat coordinate buffer"""
+    counts = np.diff(offsets)[indices]
+    point_indices = np.repeat(offsets[:-1][indices], counts) + (
+        np.arange(counts.sum()) - np.repeat(_offsets_from_counts(counts)[:-1], counts)
+    )
+    return points[point_indices], _offsets_from_counts(counts)
+
+
+def _snapped_to_grid(values, name: str) -> np.ndarray:
+    """Returns numeric values rounded to whole nm as a new int64 array"""
+    array = np.asarray(values)
+    if array.dtype.kind in "iu":
+        return array.astype(np.int64)
+    if array.dtype.kind != "f":
+        raise TypeError(f"{name} must be numbers, got an array of {array.dtype}")
+    if not np.all(np.isfinite(array)):
+        raise ValueError(f"{name} contains values that are not finite")
+    return np.rint(array).astype(np.int64)
+
+
+def _snapped_points(values, name: str) -> np.ndarray:
+    """Returns a single point or an array of points rounded to whole nm as an (N, 2) int64 array"""
+    points = _snapped_to_grid(values, name)
+    if points.ndim not in (1, 2) or points.shape[-1] != 2:
+        raise ValueError(f"{name} must be a point or an (N, 2) array of points, got shape {points.shape}")
+    return points.reshape(-1, 2)
+
+
+def _snapped_ragged_points(values, offsets, name: str):
+    """Returns the points of several shapes rounded to whole nm and their checked offsets"""
+    points = _snapped_to_grid(values, name)
+    if offsets is None:
+        if points.ndim != 3 or points.shape[2] != 2:
+            raise ValueError(f"{name} must be a (P, K, 2) array without offsets, got shape {points.shape}")
+        return points.reshape(-1, 2), points.shape[1] * np.arange(points.shape[0] + 1, dtype=np.int64)
+
+    if points.ndim != 2 or points.shape[1] != 2:
+        raise ValueError(f"{name} must be an (M, 2) array with offsets, got shape {points.shape}")
+    offsets = np.asarray(offsets)
+    if offsets.dtype.kind not in "iu":
+        raise TypeError(f"Offsets must be integers, got an array of {offsets.dtype}")
+    offsets = offsets.astype(np.int64)
+    if offsets.ndim != 1 or len(offsets) == 0 or offsets[0] != 0 or offsets[-1] != len(points) or np.any(
+        np.diff(offsets) < 0
+    ):
+        raise ValueError(f"Offsets must start at 0, never decrease and end at the number of points, {len(points)}")
+    return points, offsets
+
+
+def _checked_degenerate(is_degenerate: np.ndarray, description: str, drop_degenerate: bool) -> np.ndarray:
+    """Raises a ValueError for degenerate shapes unless they are dropped, and returns which shapes are kept"""
+    if not drop_degenerate and np.any(is_degenerate):
+        indices = np.flatnonzero(is_degenerate)
+        raise ValueError(f"Got {len(indices)} {description}, at indices {indices[:10].tolist()}")
+    return ~is_degenerate
+
+
+def _remove_repeated_points(points: np.ndarray, offsets: np.ndarray, closed: bool = True):
+    """
+    Drops points equal to the previous point of the same shape, and for closed shapes
+    a last point equal to the first one. Returns the remaining points and their offsets.
+    """
+    counts = np.diff(offsets)
+    shape_ids = np.repeat(np.arange(len(counts)), counts)
+    is_kept = np.ones(len(points), dtype=bool)
+    is_kept[1:] = np.any(points[1:] != points[:-1], axis=1) | (shape_ids[1:] != shape_ids[:-1])
+    if closed:
+        has_points = counts > 1
+        lasts, firsts = offsets[1:][has_points] - 1, offsets[:-1][has_points]
+        is_kept[lasts] &= np.any(points[lasts] != points[firsts], axis=1)
+    return points[is_kept], _offsets_from_counts(np.bincount(shape_ids[is_kept], minlength=len(counts)))
+
+
+def step_and_repeat_offsets(
+    pitch_x_nm: int,
+    pitch_y_nm: int,
+    count_x: int,
+    count_y: int,
+    skip_mask=None,
+    x_start_nm: int = 0,
+    y_start_nm: int = 0,
+) -> np.ndarray:
+    """
+    Returns the offsets of the sites of a rectangular array, row by row starting at the bottom left.
 
     Args:
     -----
-    layers: List[CleWin_layer]
-        The layers to plot
-    window_size: int
-        The side-length of the total window in nm
-    alpha: float
-        The alpha (transparency) value of the layers in the plot. Defaults to 0.5. The printed results will look like alpha = 1.
+    pitch_x_nm: int
+        The distance between columns in nm
+    pitch_y_nm: int
+        The distance between rows in nm
+    count_x: int
+        The number of columns
+    count_y: int
+        The number of rows
+    skip_mask: np.ndarray
+        Optional boolean array of shape (count_x, count_y). Sites where skip_mask[i, j] is True are left out.
+    x_start_nm: int
+        The x position of the first column in nm
+    y_start_nm: int
+        The y position of the first row in nm
 
     Returns:
     --------
-    fig: matplotlib.figure.Figure
-        The figure object of the plot
-    ax: matplotlib.axes.Axes
-        The axes object of the plot
+    site_offsets: np.ndarray
+        (S, 2) int64 array with the (x, y) position of every site
     """
-    fig, ax = plt.subplots()
-    ax.set_xlim(-window_size / 2, window_size / 2)
-    ax.set_ylim(-window_size / 2, window_size / 2)
+    columns, rows = np.meshgrid(np.arange(count_x), np.arange(count_y), indexing="xy")
+    site_offsets = np.stack(
+        [
+            int(x_start_nm) + columns.ravel() * int(pitch_x_nm),
+            int(y_start_nm) + rows.ravel() * int(pitch_y_nm),
+        ],
+        axis=1,
+    ).astype(np.int64)
+    if skip_mask is not None:
+        skip_mask = np.asarray(skip_mask, dtype=bool)
+        if skip_mask.shape != (count_x, count_y):
+            raise ValueError(
+                f"skip_mask must have shape {(count_x, count_y)}, got {skip_mask.shape}"
+            )
+        site_offsets = site_offsets[~skip_mask[columns.ravel(), rows.ravel()]]
+    return site_offsets
 
-    ax.set_aspect("equal", "box")
-    # May want to reconsider plotting in nm -> um
-    ax.set_xlabel("x (nm)")
-    ax.set_ylabel("y (nm)")
-    for layer in layers:
-        color = layer.fill_color.format_color_hex_rgb()
-        for shape in layer.shapes:
-            shape.color = color
-            shape.add_shape_to_ax(ax=ax, alpha=alpha)
+
+def _rectangle_column_property(column: int):
+    def getter(self):
+        return self._shape_arrays.rectangles[self._index, column]
+
+    def setter(self, value):
+        self._shape_arrays.rectangles[self._index, column] = value
+        self._shape_arrays._modification_count += 1
+        _count_shape_edit(self)
+
+    return property(getter, setter)
+
+
+class _CIF_rectangle_view(CIF_rectangle):
+    """A CIF_rectangle backed by a row of a CIF_shape_arrays. Changes are written to the arrays."""
+
+    __slots__ = ("_shape_arrays", "_index")
+
+    # The slots of CIF_rectangle are replaced by the columns, so its methods read and write the arrays
+    _x_size_nm = x_size_nm = _rectangle_column_property(0)
+    _y_size_nm = y_size_nm = _rectangle_column_property(1)
+    _x_center_nm = x_center_nm = _rectangle_column_property(2)
+    _y_center_nm = y_center_nm = _rectangle_column_property(3)
+
+    def __init__(self, shape_arrays: CIF_shape_arrays, index: int, color: str = "blue"):
+        self._shape_arrays = shape_arrays
+        self._index = index
+        self.color = color
+        self._owner = None
+
+    def get_cif_content(self):
+        return "B %d %d %d %d;\n" % tuple(self._shape_arrays.rectangles[self._index].tolist())
+
+    def deepcopy(self):
+        return CIF_rectangle(
+            x_size_nm=int(self.x_size_nm),
+            y_size_nm=int(self.y_size_nm),
+            x_center_nm=int(self.x_center_nm),
+            y_center_nm=int(self.y_center_nm),
+            color=self.color,
+        )
+
+
+class _CIF_polygon_view(CIF_polygon):
+    """A CIF_polygon whose points are a view into a CIF_shape_arrays. Changes are written to the arrays."""
+
+    __slots__ = ("_shape_arrays", "_index")
+
+    def __init__(self, shape_arrays: CIF_shape_arrays, index: int, color: str = "blue"):
+        self._shape_arrays = shape_arrays
+        self._index = index
+        self.color = color
+        self._owner = None
+
+    # Replaces the slot of CIF_polygon, so its methods read and write the arrays
+    @property
+    def _points(self) -> np.ndarray:
+        offsets = self._shape_arrays.polygon_offsets
+        return self._shape_arrays.polygon_points[offsets[self._index] : offsets[self._index + 1]]
+
+    @_points.setter
+    def _points(self, points):
+        view = self._points
+        points = _as_int64_array(points).reshape(-1, 2)
+        if len(points) != len(view):
+            raise ValueError("The number of vertices of an array-backed polygon cannot be changed")
+        view[:] = points
+        self._shape_arrays._modification_count += 1
+        _count_shape_edit(self)
+
+    def deepcopy(self):
+        return _new_polygon(np.array(self.points), self.color)
+
+
+class _CIF_wire_view(CIF_wire):
+    """A CIF_wire whose points are a view into a CIF_shape_arrays. Changes are written to the arrays."""
+
+    __slots__ = ("_shape_arrays", "_index")
+
+    def __init__(self, shape_arrays: CIF_shape_arrays, index: int, color: str = "blue"):
+        self._shape_arrays = shape_arrays
+        self._index = index
+        self.color = color
+        self._owner = None
+
+    # Replaces the slot of CIF_wire, so its methods read and write the arrays
+    @property
+    def _points(self) -> np.ndarray:
+        offsets = self._shape_arrays.wire_offsets
+        return self._shape_arrays.wire_points[offsets[self._index] : offsets[self._index + 1]]
+
+    @_points.setter
+    def _points(self, points):
+        view = self._points
+        points = _as_int64_array(points).reshape(-1, 2)
+        if len(points) != len(view):
+            raise ValueError("The number of points of an array-backed wire cannot be changed")
+        view[:] = points
+        self._shape_arrays._modification_count += 1
+        _count_shape_edit(self)
+
+    @property
+    def _width_nm(self):
+        return self._shape_arrays.wire_widths[self._index]
+
+    @_width_nm.setter
+    def _width_nm(self, width_nm):
+        self._shape_arrays.wire_widths[self._index] = width_nm
+        self._shape_arrays._modification_count += 1
+        _count_shape_edit(self)
+
+    def deepcopy(self):
+        return _new_wire(np.array(self.points), int(self.width_nm), self.color)
+
+
+class CIF_shape_list_view(Sequence):
+    def __init__(self, shape_arrays: CIF_shape_arrays):
+        """
+        A list-like view on the shapes of a CIF_shape_arrays.
+        Indexing returns CIF_rectangle, CIF_polygon and CIF_wire objects that read and write the arrays,
+        and append and extend add shapes to the arrays.
+        """
+        self.shape_arrays = shape_arrays
+
+    def __len__(self):
+        return len(self.shape_arrays)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.shape_arrays.get_shape(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("shape index out of range")
+        return self.shape_arrays.get_shape(index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.shape_arrays.get_shape(index)
+
+    def append(self, shape: CIF_rectangle | CIF_polygon | CIF_wire):
+        self.shape_arrays.append(shape)
+
+    def extend(self, shapes: Iterable):
+        self.shape_arrays.extend(shapes)
+
+
+class _CIF_tracked_shape_list(list):
+    """
+    The shapes of an object-backed layer. Appending and extending add shapes, and every other change to the list
+    and every change to the geometry of a shape it holds is counted in _modification_count, so the layer knows
+    which of its serialized shapes are still valid.
+    """
+
+    def __init__(self, shapes: Iterable = ()):
+        super().__init__()
+        self._edits = _CIF_edit_counter()
+        self.extend(shapes)
+
+    def __reduce__(self):
+        # Copies and pickles keep sharing one counter with the shapes they hold
+        return (_restore_tracked_shape_list, (list(self), self._edits))
+
+    @property
+    def _modification_count(self) -> int:
+        return self._edits.count
+
+    def _modified(self):
+        self._edits.count += 1
+
+    def _own(self, shapes: list) -> list:
+        counter = self._edits
+        for shape in shapes:
+            if getattr(shape, "_owner", counter) is None:
+                shape._owner = counter
+            else:
+                _add_shape_owner(shape, counter)
+        return shapes
+
+    def append(self, shape):
+        list.append(self, shape)
+        if getattr(shape, "_owner", self._edits) is None:
+            shape._owner = self._edits
+        else:
+            _add_shape_owner(shape, self._edits)
+
+    def extend(self, shapes: Iterable):
+        super().extend(self._own(list(shapes)))
+
+    def __iadd__(self, shapes):
+        self.extend(shapes)
+        return self
+
+    def __setitem__(self, index, value):
+        self._modified()
+        if isinstance(index, slice):
+            value = self._own(list(value))
+        else:
+            _add_shape_owner(value, self._edits)
+        super().__setitem__(index, value)
+
+    def __delitem__(self, index):
+        self._modified()
+        super().__delitem__(index)
+
+    def __imul__(self, count):
+        self._modified()
+        return super().__imul__(count)
+
+    def insert(self, index, shape):
+        self._modified()
+        _add_shape_owner(shape, self._edits)
+        super().insert(index, shape)
+
+    def pop(self, index=-1):
+        self._modified()
+        return super().pop(index)
+
+    def remove(self, shape):
+        self._modified()
+        super().remove(shape)
+
+    def clear(self):
+        self._modified()
+        super().clear()
+
+    def sort(self, *args, **kwargs):
+        self._modified()
+        super().sort(*args, **kwargs)
+
+    def reverse(self):
+        self._modified()
+        super().reverse()
+
+
+def _restore_tracked_shape_list(shapes: list, edits: _CIF_edit_counter) -> _CIF_tracked_shape_list:
+    shape_list = _CIF_tracked_shape_list()
+    shape_list._edits = edits
+    shape_list.extend(shapes)
+    return shape_list
+
+
+class _CIF_content_cache:
+    def __init__(self, storage, transformation: "CIF_transformation", shapes_per_chunk: int):
+        """
+        The CIF text of the shapes of a layer, in chunks of shapes_per_chunk shapes starting at the first shape.
+        It stays valid while shapes are only added to storage, which is the CIF_shape_arrays or the shape list
+        of the layer, and the transformation of the layer is not replaced. Changes to the shapes in storage
+        are counted in its _modification_count.
+        """
+        self.storage = storage
+        self.transformation = transformation
+        self.modification_count = storage._modification_count
+        self.shapes_per_chunk = shapes_per_chunk
+        self.chunks: List[str] = []
+        self.characters = 0
+
+    def is_valid_for(self, storage, transformation: "CIF_transformation", shapes_per_chunk: int) -> bool:
+        return (
+            self.storage is storage
+            and self.transformation is transformation
+            and self.modification_count == storage._modification_count
+            and self.shapes_per_chunk == shapes_per_chunk
+            and len(storage) >= len(self.chunks) * shapes_per_chunk
+        )
+
+
+class CIF_spatial_index:
+    def __init__(self, boxes: np.ndarray = None, cell_size_nm: float = None):
+        """
+        A uniform grid over the bounding boxes of shapes, answering window, nearest-neighbour and overlap
+        queries without scanning all shapes. Shapes are identified by their insertion index.
+
+        Boxes added after the grid is built are kept in an unsorted tail that is searched linearly, and the grid
+        is rebuilt when the tail grows large. Shifts are stored as an offset, so shifting does not touch the grid.
+
+        Args:
+        -----
+        boxes: np.ndarray
+            (N, 4) array of (x_min, y_min, x_max, y_max) in nm
+        cell_size_nm: float
+            The side-length of a grid cell. Defaults to a size based on the number and size of the boxes.
+        """
+        self._boxes = np.zeros((0, 4))
+        self._bounds = np.array([np.inf, np.inf, -np.inf, -np.inf])
+        self._offset = np.zeros(2)
+        self._cell_size_nm = cell_size_nm
+        if boxes is not None:
+            self._append(boxes)
+        self._build()
+
+    def __len__(self):
+        return len(self._boxes)
+
+    def add_boxes(self, boxes: np.ndarray):
+        """Adds the bounding boxes of new shapes, which get the next insertion indices"""
+        self._append(boxes)
+        if len(self._boxes) - self._indexed_count > max(1024, self._indexed_count // 8):
+            self._build()
+
+    def _append(self, boxes: np.ndarray):
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4) - np.tile(self._offset, 2)
+        if len(boxes):
+            self._boxes = np.concatenate([self._boxes, boxes])
+            self._bounds = np.concatenate(
+                [
+                    np.minimum(self._bounds[:2], boxes[:, :2].min(axis=0)),
+                    np.maximum(self._bounds[2:], boxes[:, 2:].max(axis=0)),
+                ]
+            )
+
+    def shift(self, shift_x_nm, shift_y_nm):
+        self._offset = self._offset + [shift_x_nm, shift_y_nm]
+
+    def get_boxes(self) -> np.ndarray:
+        """Returns the bounding boxes of all shapes, including the shift"""
+        return self._boxes + np.tile(self._offset, 2)
+
+    def query_window(self, window) -> np.ndarray:
+        """
+        Returns the sorted insertion indices of all shapes whose bounding box intersects or touches the window
+
+        Args:
+        -----
+        window: Tuple[float, float, float, float]
+            The window as (x_min, y_min, x_max, y_max) in nm
+        """
+        return self._query(np.asarray(window, dtype=np.float64) - np.tile(self._offset, 2))
+
+    def _query(self, window: np.ndarray) -> np.ndarray:
+        """Window query in the coordinates of the stored boxes, i.e. without the shift"""
+        candidates = [self._large, np.arange(self._indexed_count, len(self._boxes))]
+
+        column_range, row_range = self._get_cell_ranges(window)
+        cell_count = (column_range[1] - column_range[0] + 1) * (row_range[1] - row_range[0] + 1)
+        if cell_count > self._columns * self._rows // 4:
+            candidates.append(np.arange(self._indexed_count))
+        elif cell_count > 0:
+            for row in range(row_range[0], row_range[1] + 1):
+                first_cell = row * self._columns + column_range[0]
+                last_cell = row * self._columns + column_range[1]
+                candidates.append(
+                    self._cell_shapes[self._cell_starts[first_cell] : self._cell_starts[last_cell + 1]]
+                )
+
+        candidates = np.unique(np.concatenate(candidates))
+        boxes = self._boxes[candidates]
+        is_inside = (
+            (boxes[:, 0] <= window[2])
+            & (boxes[:, 2] >= window[0])
+            & (boxes[:, 1] <= window[3])
+            & (boxes[:, 3] >= window[1])
+        )
+        return candidates[is_inside]
+
+    def nearest(self, x_nm: float, y_nm: float, count: int = 1) -> np.ndarray:
+        """
+        Returns the insertion indices of the count shapes whose bounding boxes are closest to a point,
+        sorted by distance. Shapes containing the point have distance 0.
+        """
+        count = min(count, len(self._boxes))
+        if count == 0:
+            return np.zeros(0, dtype=np.int64)
+        x_nm, y_nm = x_nm - self._offset[0], y_nm - self._offset[1]
+        radius = self._cell_size
+        # Beyond this radius the search window contains all shapes
+        extent = np.abs(self._bounds - [x_nm, y_nm, x_nm, y_nm]).max() * 2
+        while True:
+            candidates = self._query(np.array([x_nm - radius, y_nm - radius, x_nm + radius, y_nm + radius]))
+            if len(candidates) >= count or radius > extent:
+                distances = _box_distances(self._boxes[candidates], x_nm, y_nm)
+                order = np.argsort(distances, kind="stable")[:count]
+                # Shapes outside the searched window are further away than the radius
+                if len(order) == count and distances[order[-1]] <= radius:
+                    return candidates[order]
+                if radius > extent:
+                    return candidates[order]
+            radius *= 2
+
+    def get_overlapping_pairs(self) -> np.ndarray:
+        """
+        Returns all pairs of shapes whose bounding boxes overlap with a positive area,
+        as a sorted (K, 2) array of insertion indices (i, j) with i < j
+        """
+        self._build()
+        boxes = self._boxes
+
+        # Pairs of shapes sharing a grid cell. A pair is only kept in the cell containing the
+        # lower left corner of the intersection of the boxes, so every pair is found once.
+        cell_counts = np.diff(self._cell_starts)
+        positions = np.arange(len(self._cell_shapes)) - np.repeat(self._cell_starts[:-1], cell_counts)
+        partner_counts = np.repeat(cell_counts, cell_counts) - positions - 1
+        first = np.repeat(np.arange(len(self._cell_shapes)), partner_counts)
+        second = first + 1 + (
+            np.arange(partner_counts.sum()) - np.repeat(_offsets_from_counts(partner_counts)[:-1], partner_counts)
+        )
+        cells = np.repeat(np.repeat(np.arange(len(cell_counts)), cell_counts), partner_counts)
+        pairs = [self._filter_overlapping(self._cell_shapes[first], self._cell_shapes[second], cells)]
+
+        # Pairs with shapes that are too large for the grid
+        is_large = np.zeros(len(boxes), dtype=bool)
+        is_large[self._large] = True
+        for shape in self._large.tolist():
+            partners = self._query(boxes[shape])
+            partners = partners[~is_large[partners] | (partners > shape)]
+            partners = partners[partners != shape]
+            pairs.append(self._filter_overlapping(np.full(len(partners), shape), partners))
+
+        pairs = np.concatenate(pairs)
+        pairs.sort(axis=1)
+        pairs = pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+        return pairs
+
+    def _filter_overlapping(self, first: np.ndarray, second: np.ndarray, cells: np.ndarray = None):
+        first_boxes, second_boxes = self._boxes[first], self._boxes[second]
+        lower = np.maximum(first_boxes[:, :2], second_boxes[:, :2])
+        upper = np.minimum(first_boxes[:, 2:], second_boxes[:, 2:])
+        is_overlapping = np.all(upper > lower, axis=1)
+        if cells is not None:
+            columns, rows = self._get_cells(lower)
+            is_overlapping &= rows * self._columns + columns == cells
+        return np.stack([first[is_overlapping], second[is_overlapping]], axis=1)
+
+    def _build(self):
+        boxes = self._boxes
+        self._indexed_count = len(boxes)
+        count = max(len(boxes), 1)
+        if len(boxes):
+            self._origin = boxes[:, :2].min(axis=0)
+            extent = boxes[:, 2:].max(axis=0) - self._origin
+        else:
+            self._origin = np.zeros(2)
+            extent = np.zeros(2)
+
+        cell_size = self._cell_size_nm
+        if cell_size is None:
+            sizes = np.maximum(boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1])
+            typical_size = np.median(sizes) if len(boxes) else 0
+            cell_size = max(typical_size, np.sqrt(extent[0] * extent[1] / count), 1)
+            # Limit the number of cells for very elongated layouts
+            while np.prod(np.floor(extent / cell_size) + 1) > 4 * count + 16:
+                cell_size *= 2
+        self._cell_size = float(cell_size)
+        self._columns, self._rows = (np.floor(extent / cell_size) + 1).astype(np.int64).tolist()
+
+        first_columns, first_rows = self._get_cells(boxes[:, :2])
+        last_columns, last_rows = self._get_cells(boxes[:, 2:])
+        widths = last_columns - first_columns + 1
+        heights = last_rows - first_rows + 1
+        # Shapes spanning many cells are searched linearly instead of being copied into every cell
+        is_large = widths * heights > 16
+        self._large = np.flatnonzero(is_large)
+        shapes = np.flatnonzero(~is_large)
+        widths, heights = widths[shapes], heights[shapes]
+        counts = widths * heights
+
+        entry_shapes = np.repeat(shapes, counts)
+        local = np.arange(counts.sum()) - np.repeat(_offsets_from_counts(counts)[:-1], counts)
+        entry_widths = np.repeat(widths, counts)
+        entry_cells = (first_rows[entry_shapes] + local // entry_widths) * self._columns + (
+            first_columns[entry_shapes] + local % entry_widths
+        )
+        order = np.argsort(entry_cells, kind="stable")
+        self._cell_shapes = entry_shapes[order]
+        self._cell_starts = np.searchsorted(
+            entry_cells[order], np.arange(self._columns * self._rows + 1)
+        )
+
+    def _get_cells(self, points: np.ndarray):
+        cells = np.floor((points - self._origin) / self._cell_size)
+        columns = np.clip(cells[:, 0], 0, self._columns - 1).astype(np.int64)
+        rows = np.clip(cells[:, 1], 0, self._rows - 1).astype(np.int64)
+        return columns, rows
+
+    def _get_cell_ranges(self, window: np.ndarray):
+        """Returns the inclusive column and row ranges of the cells overlapping a window, which may be empty"""
+        lower = np.floor((window[:2] - self._origin) / self._cell_size)
+        upper = np.floor((window[2:] - self._origin) / self._cell_size)
+        lower = np.maximum(lower, 0).astype(np.int64)
+        upper = np.minimum(upper, [self._columns - 1, self._rows - 1]).astype(np.int64)
+        if np.any(upper < lower):
+            return (0, -1), (0, -1)
+        return (lower[0], upper[0]), (lower[1], upper[1])
+
+
+def _box_distances(boxes: np.ndarray, x_nm: float, y_nm: float) -> np.ndarray:
+    """Returns the distance from a point to each box, which is 0 for boxes containing the point"""
+    dx = np.maximum(np.maximum(boxes[:, 0] - x_nm, x_nm - boxes[:, 2]), 0)
+    dy = np.maximum(np.maximum(boxes[:, 1] - y_nm, y_nm - boxes[:, 3]), 0)
+    return np.hypot(dx, dy)
+
+
+class CleWin_layer(object):
+    def __init__(
+        self,
+        layer_name: str,
+        layer_alias: str,
+        layer_index: int,
+        fill_color: CleWin_color,
+        border_color: CleWin_color,
+        array_backed: bool = False,
+    ):
+        # needs documentation, what is this?
+        self.layer_name = layer_name
+        self.layer_alias = layer_alias
+        self.layer_index = layer_index
+        self.fill_color = fill_color
+        self.border_color = border_color
+        # Array-backed layers keep their shapes in a CIF_shape_arrays, and shapes is a view on it
+        self.shape_arrays: CIF_shape_arrays | None = (
+            CIF_shape_arrays() if array_backed else None
+        )
+        # The stored shapes of an array-backed layer are mirrored, rotated and shifted by the transformation
+        # to give the layout, which is applied in bulk when the shapes are needed, see transform
+        self.transformation = CIF_transformation()
+        self._spatial_index: CIF_spatial_index | None = None
+        # The storage and its _modification_count that the spatial index describes, see _is_spatial_index_current
+        self._spatial_index_storage = None
+        self._spatial_index_modification_count = 0
+        self._cif_cache: _CIF_content_cache | None = None
+        # The statistics of the shapes, kept up to date by CleWin_statistics.get_layer_statistics
+        self._statistics_cache = None
+        # Shapes of an object-backed layer that were loaded in bulk and have no shape objects yet,
+        # see _convert_to_object_backed
+        self._unconverted_shape_arrays: CIF_shape_arrays | None = None
+        self.shapes: List[CIF_rectangle | CIF_polygon | CIF_wire] = []
+
+    @property
+    def array_backed(self) -> bool:
+        return self.shape_arrays is not None
+
+    @property
+    def shapes(self):
+        self.apply_transformation()
+        if self.array_backed:
+            return CIF_shape_list_view(self.shape_arrays)
+        return self._shapes
+
+    @shapes.setter
+    def shapes(self, shapes):
+        if self.array_backed:
+            self.shape_arrays = CIF_shape_arrays.from_shapes(shapes)
+        else:
+            self._shape_list = _CIF_tracked_shape_list(shapes)
+        self._unconverted_shape_arrays = None
+        self.transformation = CIF_transformation()
+        self._spatial_index = None
+        self._cif_cache = None
+        self._statistics_cache = None
+
+    def __getstate__(self):
+        # The CIF text is cheap to rebuild compared to sending it to another process
+        state = self.__dict__.copy()
+        state["_cif_cache"] = None
+        return state
+
+    def get_shape_arrays(self) -> CIF_shape_arrays:
+        """
+        Returns the shapes of the layer in columnar form. For array-backed layers without a pending transformation
+        this is the storage of the layer itself, otherwise it is a new CIF_shape_arrays.
+        """
+        return self._transformed(self._get_stored_shape_arrays())
+
+    def get_shape_count(self) -> int:
+        """Returns the number of shapes in the layer, without applying a pending transformation"""
+        return len(self._get_storage())
+
+    @property
+    def _shapes(self) -> _CIF_tracked_shape_list:
+        """The shape list of an object-backed layer, creating the shape objects of loaded shapes on first use"""
+        if self._unconverted_shape_arrays is not None:
+            is_index_current = self._is_spatial_index_current()
+            shape_arrays = self._unconverted_shape_arrays
+            self._unconverted_shape_arrays = None
+            self._shape_list = _CIF_tracked_shape_list(shape_arrays.to_shapes())
+            if is_index_current:
+                self._mark_spatial_index_current()
+        return self._shape_list
+
+    def _get_storage(self):
+        """Returns the CIF_shape_arrays or the shape list with the shapes of the layer"""
+        if self.array_backed:
+            return self.shape_arrays
+        if self._unconverted_shape_arrays is not None:
+            return self._unconverted_shape_arrays
+        return self._shapes
+
+    def _get_stored_shape_arrays(self, start: int = 0, stop: int = None) -> CIF_shape_arrays:
+        """Returns the shapes with indices start to stop in columnar form, before the transformation"""
+        storage = self._get_storage()
+        if not isinstance(storage, CIF_shape_arrays):
+            return CIF_shape_arrays.from_shapes(storage[start:stop])
+        shape_count = len(storage)
+        stop = shape_count if stop is None else min(stop, shape_count)
+        if start == 0 and stop == shape_count:
+            return storage
+        return storage.take(np.arange(start, stop))
+
+    def _transformed(self, shape_arrays: CIF_shape_arrays) -> CIF_shape_arrays:
+        if self.transformation.is_identity():
+            return shape_arrays
+        return shape_arrays.transformed(self.transformation)
+
+    def as_array_backed(self) -> "CleWin_layer":
+        """Returns an array-backed copy of the layer"""
+        layer = self.empty_copy()
+        layer.shape_arrays = CIF_shape_arrays()
+        layer.shape_arrays.extend_arrays(self.get_shape_arrays())
+        return layer
+
+    def empty_copy(self) -> "CleWin_layer":
+        """Returns a layer with the same name, alias, index, colors and storage mode, but without shapes"""
+        return CleWin_layer(
+            layer_name=self.layer_name,
+            layer_alias=self.layer_alias,
+            layer_index=self.layer_index,
+            fill_color=copy.deepcopy(self.fill_color),
+            border_color=copy.deepcopy(self.border_color),
+            array_backed=self.array_backed,
+        )
+
+    def add_shape_to_layer(self, shape: CIF_rectangle | CIF_polygon | CIF_wire):
+        if self.shape_arrays is None and self._unconverted_shape_arrays is None:
+            # Object-backed layers have no pending transformation
+            self._shape_list.append(shape)
+            return
+        if not self.transformation.is_whole():
+            # The shape could not be stored in whole nanometers before a shift by a fraction of a nanometer
+            self.apply_transformation()
+        # Array-backed layers copy the shape into their arrays, in the coordinates before the transformation
+        if not self.transformation.is_identity():
+            shape = shape.deepcopy()
+            shape.transform(self.transformation.inverse())
+        if self.array_backed:
+            self.shape_arrays.append(shape)
+        else:
+            self._shapes.append(shape)
+
+    def add_step_and_repeat(
+        self,
+        shapes,
+        pitch_x_nm: int,
+        pitch_y_nm: int,
+        count_x: int,
+        count_y: int,
+        skip_mask=None,
+        x_start_nm: int = 0,
+        y_start_nm: int = 0,
+    ):
+        """
+        Adds an array of copies of a group of shapes to the layer. All copies are generated in bulk,
+        see step_and_repeat_offsets for the arguments describing the array.
+
+        Args:
+        -----
+        shapes: List[CIF_rectangle | CIF_polygon | CIF_wire] | CIF_shape_arrays | CleWin_layer
+            The shapes of one site, positioned relative to the site
+        """
+        if isinstance(shapes, CleWin_layer):
+            shape_arrays = shapes.get_shape_arrays()
+        elif isinstance(shapes, CIF_shape_arrays):
+            shape_arrays = shapes
+        else:
+            shape_arrays = CIF_shape_arrays.from_shapes(shapes)
+
+        site_offsets = step_and_repeat_offsets(
+            pitch_x_nm=pitch_x_nm,
+            pitch_y_nm=pitch_y_nm,
+            count_x=count_x,
+            count_y=count_y,
+            skip_mask=skip_mask,
+            x_start_nm=x_start_nm,
+            y_start_nm=y_start_nm,
+        )
+        self.add_shape_arrays_to_layer(shape_arrays.repeated(site_offsets))
+
+    def add_shape_arrays_to_layer(self, shape_arrays: CIF_shape_arrays):
+        """Adds all shapes of a CIF_shape_arrays to the layer"""
+        if not self.transformation.is_identity():
+            shape_arrays = shape_arrays.transformed(self.transformation.inverse())
+        if self.array_backed:
+            self.shape_arrays.extend_arrays(shape_arrays)
+        elif self._unconverted_shape_arrays is not None:
+            self._unconverted_shape_arrays.extend_arrays(shape_arrays)
+        else:
+            self._shapes.extend(shape_arrays.to_shapes())
+
+    def add_rectangles(self, sizes_nm, centers_nm, drop_degenerate: bool = False):
+        """Adds rectangles from arrays of sizes and centers, see CIF_shape_arrays.from_rectangles"""
+        self.add_shape_arrays_to_layer(CIF_shape_arrays.from_rectangles(sizes_nm, centers_nm, drop_degenerate))
+
+    def add_polygons(self, vertices_nm, offsets=None, drop_degenerate: bool = False):
+        """Adds polygons from an array of vertices, see CIF_shape_arrays.from_polygons"""
+        self.add_shape_arrays_to_layer(CIF_shape_arrays.from_polygons(vertices_nm, offsets, drop_degenerate))
+
+    def add_wires(self, points_nm, offsets, widths_nm, drop_degenerate: bool = False):
+        """Adds wires from arrays of points and widths, see CIF_shape_arrays.from_wires"""
+        self.add_shape_arrays_to_layer(CIF_shape_arrays.from_wires(points_nm, offsets, widths_nm, drop_degenerate))
+
+    def get_cif_declaration(self):
+        fill_color_str = self.fill_color.format_color_for_CleWin()
+        border_color_str = self.border_color.format_color_for_CleWin()
+
+        # CleWin added because of the way the cif file is parsed by CleWin??
+        cif_declaration = f"L {self.layer_alias}; (CleWin: {self.layer_index} {self.layer_name}/{fill_color_str} {border_color_str});\n"
+
+        return cif_declaration
+
+    def get_cif_content(self):
+        """
+        Prints the content of the layer in the proper .CIF (Caltech Intermediate Form) format
+        """
+        return "".join(self.iter_cif_content())
+
+    def iter_cif_content(self, shapes_per_chunk: int = CIF_SHAPES_PER_CHUNK):
+        """
+        Yields the content of the layer in the proper .CIF format as a sequence of strings.
+        Joining the yielded strings gives the same result as get_cif_content.
+
+        The text of every complete chunk is kept with the layer, up to CIF_LAYER_CACHE_MAX_CHARACTERS characters,
+        and reused by the next export as long as shapes have only been added. Adding shapes with
+        add_shape_to_layer, add_shape_arrays_to_layer or by appending to shapes only serializes the new shapes.
+        Transforming the layer, assigning or removing shapes and changing the sizes, positions, points or widths
+        of shapes, directly or with shift and transform, serialize the layer again, including changes made in
+        place to the points array of a shape. Call invalidate_cif_cache after changing the arrays of an array-backed
+        layer directly.
+
+        Args:
+        -----
+        shapes_per_chunk: int
+            The number of shapes serialized into each yielded string
+        """
+        # Initiate the layer using "L {layer_alias}";
+        yield f"L {self.layer_alias};\n"
+
+        storage = self._get_storage()
+        cache = self._cif_cache
+        if cache is None or not cache.is_valid_for(storage, self.transformation, shapes_per_chunk):
+            cache = _CIF_content_cache(storage, self.transformation, shapes_per_chunk)
+            self._cif_cache = cache
+        yield from cache.chunks
+
+        shape_count = len(storage)
+        start = len(cache.chunks) * shapes_per_chunk
+        if not self.transformation.is_identity():
+            # The stored shapes are left as they are, each chunk is transformed on its own
+            chunks = (
+                "".join(
+                    self._get_stored_shape_arrays(first, first + shapes_per_chunk)
+                    .transformed(self.transformation)
+                    .iter_cif_content(shapes_per_chunk)
+                )
+                for first in range(start, shape_count, shapes_per_chunk)
+            )
+        elif isinstance(storage, CIF_shape_arrays):
+            chunks = storage.iter_cif_content(shapes_per_chunk, start)
+        else:
+            chunks = (
+                "".join([shape.get_cif_content() for shape in storage[first : first + shapes_per_chunk]])
+                for first in range(start, shape_count, shapes_per_chunk)
+            )
+        is_caching = True
+        for first, chunk in zip(range(start, shape_count, shapes_per_chunk), chunks):
+            yield chunk
+            # Only complete chunks are kept, and none after the first one that is not
+            is_caching = (
+                is_caching
+                and first + shapes_per_chunk <= shape_count
+                and cache.characters + len(chunk) <= CIF_LAYER_CACHE_MAX_CHARACTERS
+            )
+            if is_caching:
+                cache.chunks.append(chunk)
+                cache.characters += len(chunk)
+
+    def invalidate_cif_cache(self):
+        self._cif_cache = None
+
+    def invalidate_statistics(self):
+        self._statistics_cache = None
+
+    def deepcopy(self):
+        """Returns an independent copy of the layer, cloning shape objects directly or copying the arrays"""
+        layer = self.empty_copy()
+        # Transformations are never changed in place, so the copy can share it
+        layer.transformation = self.transformation
+        if self.array_backed:
+            layer.shape_arrays = self.shape_arrays.copy()
+        elif self._unconverted_shape_arrays is not None:
+            layer._unconverted_shape_arrays = self._unconverted_shape_arrays.copy()
+        else:
+            with _gc_paused():
+                layer._shape_list = _CIF_tracked_shape_list([shape.deepcopy() for shape in self._shapes])
+        return layer
+
+    def transform(self, transformation: "CIF_transformation"):
+        """
+        Mirrors, rotates and shifts all shapes of the layer, see CIF_transformation.
+
+        The shape objects of an object-backed layer are transformed right away, so references to them that are
+        held elsewhere stay the shapes of the layer. Only on an array-backed layer is the transformation
+        pending: it is composed with the pending one, which takes constant time, and applied in bulk to the
+        shapes that are exported, drawn or queried, and to the stored shapes by apply_transformation or on
+        access to shapes.
+
+        Shifts by fractions of a nanometer are kept with every storage, and coordinates are truncated to whole
+        nanometers like int() when they are written. Shape objects keep the fractions in their coordinates and
+        array-backed layers in the pending transformation, until apply_transformation stores the coordinates
+        as whole nanometers.
+        """
+        is_index_current = self._is_spatial_index_current()
+        if self.array_backed:
+            self.transformation = self.transformation.compose(transformation)
+        elif self._unconverted_shape_arrays is not None and transformation.is_whole():
+            # There are no shape objects yet that could be referenced elsewhere
+            self._unconverted_shape_arrays = self._unconverted_shape_arrays.transformed(transformation)
+        else:
+            self._transform_shape_objects(transformation)
+        if is_index_current and transformation.rotation_deg == 0 and not transformation.mirror_x:
+            self._spatial_index.shift(transformation.x_shift_nm, transformation.y_shift_nm)
+            self._mark_spatial_index_current()
+        else:
+            self._spatial_index = None
+
+    def _transform_shape_objects(self, transformation: "CIF_transformation"):
+        # The shapes are changed directly and the layer counts one edit for all of them. Only shapes that are
+        # also held by other shape lists count their edit themselves, so those lists see it as well.
+        shape_list = self._shapes
+        counter = shape_list._edits
+        if transformation.rotation_deg == 0 and not transformation.mirror_x:
+            shift_x_nm, shift_y_nm = transformation.x_shift_nm, transformation.y_shift_nm
+            for shape in shape_list:
+                shape._shift_slots(shift_x_nm, shift_y_nm)
+                if shape._owner is not counter:
+                    _count_shape_edit(shape)
+        else:
+            for shape in shape_list:
+                shape._transform_slots(transformation)
+                if shape._owner is not counter:
+                    _count_shape_edit(shape)
+        counter.count += 1
+
+    def shift(self, shift_x_nm, shift_y_nm):
+        """
+        Shifts all shapes of the layer, see transform. Shifts by fractions of a nanometer are kept with every
+        storage and truncated when the layer is written.
+        """
+        self.transform(CIF_transformation(x_shift_nm=shift_x_nm, y_shift_nm=shift_y_nm))
+
+    def rotate(self, rotation_deg: int):
+        """Rotates all shapes of the layer counterclockwise around the origin by a multiple of 90 degrees"""
+        self.transform(CIF_transformation(rotation_deg=rotation_deg))
+
+    def mirror_x(self):
+        """Mirrors all shapes of the layer in the x direction, i.e. x -> -x"""
+        self.transform(CIF_transformation(mirror_x=True))
+
+    def apply_transformation(self):
+        """
+        Applies the pending transformation of an array-backed layer to the stored shapes,
+        which then keep the layout coordinates, truncated to whole nanometers as when they are written
+        """
+        if self.transformation.is_identity():
+            return
+        is_index_current = self._is_spatial_index_current()
+        transformation = self.transformation
+        self.transformation = CIF_transformation()
+        if self.array_backed:
+            self.shape_arrays = self.shape_arrays.transformed(transformation)
+        else:
+            self._transform_shape_objects(transformation)
+        # The layout only stays the same if no coordinates were truncated
+        if is_index_current and transformation.is_whole():
+            self._mark_spatial_index_current()
+        else:
+            self._spatial_index = None
+
+    def get_spatial_index(self) -> CIF_spatial_index:
+        """
+        Returns the spatial index of the layer. The index is built on first use and kept up to date when shapes
+        are added with add_shape_to_layer or add_shape_arrays_to_layer and when the layer is shifted.
+        Any other change to the shapes, counted like for the CIF text kept by iter_cif_content, builds it again.
+        """
+        if not self._is_spatial_index_current():
+            self._spatial_index = CIF_spatial_index(self._get_shape_bounding_boxes(0))
+        elif len(self._spatial_index) < self.get_shape_count():
+            self._spatial_index.add_boxes(self._get_shape_bounding_boxes(len(self._spatial_index)))
+        self._mark_spatial_index_current()
+        return self._spatial_index
+
+    def invalidate_spatial_index(self):
+        self._spatial_index = None
+
+    def _is_spatial_index_current(self) -> bool:
+        """Whether the spatial index describes the stored shapes, apart from shapes added since it was updated"""
+        storage = self._get_storage()
+        return (
+            self._spatial_index is not None
+            and self._spatial_index_storage is storage
+            and self._spatial_index_modification_count == storage._modification_count
+            and len(self._spatial_index) <= len(storage)
+        )
+
+    def _mark_spatial_index_current(self):
+        storage = self._get_storage()
+        self._spatial_index_storage = storage
+        self._spatial_index_modification_count = storage._modification_count
+
+    def _get_shape_bounding_boxes(self, start: int) -> np.ndarray:
+        boxes = self._get_stored_shape_arrays(start).get_shape_bounding_boxes()
+        if self.transformation.is_identity():
+            return boxes
+        return self.transformation.apply_to_boxes(boxes)
+
+    def get_shape_indices_in_window(self, window) -> np.ndarray:
+        """
+        Returns the sorted indices of all shapes whose bounding box intersects or touches the window
+
+        Args:
+        -----
+        window: Tuple[float, float, float, float]
+            The window as (x_min, y_min, x_max, y_max) in nm
+        """
+        return self.get_spatial_index().query_window(window)
+
+    def get_shapes_in_window(self, window) -> List[CIF_rectangle | CIF_polygon | CIF_wire]:
+        """Returns all shapes whose bounding box intersects or touches the window, in insertion order"""
+        shapes = self.shapes
+        return [shapes[index] for index in self.get_shape_indices_in_window(window).tolist()]
+
+    def get_window_copy(self, window) -> "CleWin_layer":
+        """
+        Returns a copy of the layer with only the shapes whose bounding box intersects or touches the window,
+        e.g. to export a region of a large layout. Shapes are copied whole and not clipped to the window.
+        """
+        indices = self.get_shape_indices_in_window(window)
+        layer = self.empty_copy()
+        if self.array_backed:
+            layer.add_shape_arrays_to_layer(self._transformed(self.shape_arrays.take(indices)))
+        else:
+            shapes = self.shapes
+            layer.shapes = [shapes[index].deepcopy() for index in indices.tolist()]
+        return layer
+
+    def get_nearest_shape_indices(self, x_nm: float, y_nm: float, count: int = 1) -> np.ndarray:
+        """Returns the indices of the count shapes whose bounding boxes are closest to a point, closest first"""
+        return self.get_spatial_index().nearest(x_nm, y_nm, count)
+
+    def get_overlapping_shape_pairs(self) -> np.ndarray:
+        """
+        Returns all pairs of shapes whose bounding boxes overlap with a positive area,
+        as a sorted (K, 2) array of shape indices (i, j) with i < j
+        """
+        return self.get_spatial_index().get_overlapping_pairs()
+
+    def get_bounding_box(self):
+        """
+        Returns the bounding box of all shapes in the layer as (x_min, y_min, x_max, y_max) in nm,
+        or None if the layer is empty
+        """
+        bounding_box = self._get_stored_shape_arrays().get_bounding_box()
+        if bounding_box is None or self.transformation.is_identity():
+            return bounding_box
+        return tuple(self.transformation.apply_to_boxes(bounding_box)[0].tolist())
+
+    def plot_content(
+        self, window_size: int = 10_000_000, ax=None, min_feature_px: float = None
+    ):
+        """
+        Plots the content of the layer in a matplotlib window.
+        Shapes are drawn with one collection per shape type, and shapes outside the window are skipped.
+
+        Args:
+        -----
+        window_size: int
+            The side-length of the total window in nm
+        ax: plt.Axes
+            The axes object to add the wire geometry to
+        min_feature_px: float
+            If given, shapes smaller than this number of pixels in both directions are not drawn
+        """
+        show = False
+        if ax is None:
+            fig, ax = plt.subplots()
+            show = True
+        ax.set_xlim(-window_size / 2, window_size / 2)
+        ax.set_ylim(-window_size / 2, window_size / 2)
+        window = (-window_size / 2, -window_size / 2, window_size / 2, window_size / 2)
+        if self.array_backed:
+            colors = "blue"
+            shape_arrays = self.shape_arrays
+            # Only draw the shapes in the window if the layer is already indexed
+            if self._spatial_index is not None:
+                shape_arrays = shape_arrays.take(self.get_shape_indices_in_window(window))
+            shape_arrays = self._transformed(shape_arrays)
+        else:
+            storage = self._get_storage()
+            # Loaded shapes without shape objects yet have the default color
+            colors = "blue" if isinstance(storage, CIF_shape_arrays) else [shape.color for shape in storage]
+            shape_arrays = self.get_shape_arrays()
+        add_shape_arrays_to_ax(
+            ax=ax,
+            shape_arrays=shape_arrays,
+            color=colors,
+            window=window,
+            min_feature_nm=_min_feature_nm(ax, window_size, min_feature_px),
+        )
+        if show:
+            plt.show()
+        return ax.figure, ax
+
+
+def add_shape_arrays_to_ax(
+    ax: plt.Axes,
+    shape_arrays: CIF_shape_arrays,
+    color="blue",
+    alpha: float = 1,
+    window=None,
+    min_feature_nm: float = 0,
+):
+    """
+    Adds shapes to a matplotlib axes object using one collection per shape type.
+    The geometry of all shapes is built in bulk, which is much faster than adding one patch per shape.
+
+    Args:
+    -----
+    ax: plt.Axes
+        The axes object to add the shapes to
+    shape_arrays: CIF_shape_arrays
+        The shapes to draw
+    color: str | Sequence[str]
+        One color for all shapes, or one color per shape in insertion order
+    alpha: float
+        The alpha (transparency) value of the shapes
+    window: Tuple[float, float, float, float]
+        If given, only shapes overlapping (x_min, y_min, x_max, y_max) are drawn
+    min_feature_nm: float
+        Shapes whose bounding box is smaller than this in both directions are not drawn
+    """
+    kinds = shape_arrays.kinds
+    kind_indices = shape_arrays.get_kind_indices()
+    is_drawn = np.ones(len(kinds), dtype=bool)
+    if window is not None or min_feature_nm > 0:
+        boxes = shape_arrays.get_shape_bounding_boxes()
+        if window is not None:
+            x_min, y_min, x_max, y_max = window
+            is_drawn &= (boxes[:, 2] >= x_min) & (boxes[:, 0] <= x_max)
+            is_drawn &= (boxes[:, 3] >= y_min) & (boxes[:, 1] <= y_max)
+        if min_feature_nm > 0:
+            is_drawn &= np.maximum(boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1]) >= min_feature_nm
+
+    for kind in (RECTANGLE_KIND, POLYGON_KIND, WIRE_KIND):
+        is_selected = is_drawn & (kinds == kind)
+        if not np.any(is_selected):
+            continue
+        selected = kind_indices[is_selected]
+        if isinstance(color, str):
+            colors = color
+        else:
+            colors = [color[index] for index in np.flatnonzero(is_selected).tolist()]
+
+        if kind == RECTANGLE_KIND:
+            ax.add_collection(
+                PolyCollection(
+                    _rectangle_corners(shape_arrays.rectangles[selected]),
+                    facecolors=colors,
+                    edgecolors="none",
+                    alpha=alpha,
+                )
+            )
+        elif kind == POLYGON_KIND:
+            offsets = shape_arrays.polygon_offsets
+            points = shape_arrays.polygon_points
+            ax.add_collection(
+                PolyCollection(
+                    [points[offsets[index] : offsets[index + 1]] for index in selected.tolist()],
+                    closed=True,
+                    facecolors=colors,
+                    edgecolors=colors,
+                    alpha=alpha,
+                )
+            )
+        else:
+            _add_wires_to_ax(ax, shape_arrays, selected, colors, alpha)
+
+
+def _rectangle_corners(rectangles: np.ndarray) -> np.ndarray:
+    """Returns the corners of (x_size, y_size, x_center, y_center) rectangles as an (n, 4, 2) array"""
+    lower = rectangles[:, 2:] - rectangles[:, :2] / 2
+    upper = rectangles[:, 2:] + rectangles[:, :2] / 2
+    return np.stack(
+        [
+            lower,
+            np.stack([upper[:, 0], lower[:, 1]], axis=1),
+            upper,
+            np.stack([lower[:, 0], upper[:, 1]], axis=1),
+        ],
+        axis=1,
+    )
+
+
+def _add_wires_to_ax(ax: plt.Axes, shape_arrays: CIF_shape_arrays, selected, colors, alpha):
+    """Draws wires as one quadrilateral per segment and one circle per point, like CIF_wire.add_shape_to_ax"""
+    offsets = shape_arrays.wire_offsets
+    counts = np.diff(offsets)[selected]
+    point_indices = np.repeat(offsets[selected], counts) + (
+        np.arange(counts.sum()) - np.repeat(_offsets_from_counts(counts)[:-1], counts)
+    )
+    points = shape_arrays.wire_points[point_indices].astype(np.float64)
+    point_widths = np.repeat(shape_arrays.wire_widths[selected], counts).astype(np.float64)
+    if not isinstance(colors, str):
+        point_colors = np.repeat(np.array(colors, dtype=object), counts)
+
+    # A segment starts at every point except the last point of each wire
+    is_segment_start = np.ones(len(points), dtype=bool)
+    is_segment_start[_offsets_from_counts(counts)[1:] - 1] = False
+    starts = np.flatnonzero(is_segment_start)
+    vectors = points[starts + 1] - points[starts]
+    lengths = np.linalg.norm(vectors, axis=1)
+    normals = np.zeros_like(vectors)
+    nonzero = lengths > 0
+    normals[nonzero] = (
+        np.stack([-vectors[nonzero, 1], vectors[nonzero, 0]], axis=1)
+        / lengths[nonzero, None]
+        * point_widths[starts][nonzero, None]
+        / 2
+    )
+    quads = np.stack(
+        [
+            points[starts] - normals,
+            points[starts + 1] - normals,
+            points[starts + 1] + normals,
+            points[starts] + normals,
+        ],
+        axis=1,
+    )
+    ax.add_collection(
+        PolyCollection(
+            quads,
+            facecolors=colors if isinstance(colors, str) else list(point_colors[starts]),
+            edgecolors="none",
+            alpha=alpha,
+        )
+    )
+    ax.add_collection(
+        EllipseCollection(
+            widths=point_widths,
+            heights=point_widths,
+            angles=0,
+            units="xy",
+            offsets=points,
+            offset_transform=ax.transData,
+            facecolors=colors if isinstance(colors, str) else list(point_colors),
+            edgecolors="none",
+            alpha=alpha,
+        )
+    )
+
+
+def _min_feature_nm(ax: plt.Axes, window_size: int, min_feature_px: float = None) -> float:
+    """Converts a feature size in pixels of the axes to nm"""
+    if min_feature_px is None:
+        return 0
+    pixels = ax.get_window_extent().width
+    return min_feature_px * window_size / pixels
+
+
+class CIF_transformation:
+    def __init__(
+        self,
+        x_shift_nm: int = 0,
+        y_shift_nm: int = 0,
+        rotation_deg: int = 0,
+        mirror_x: bool = False,
+    ):
+        """
+        A transformation used when placing a symbol.
+        Points are first mirrored in the x direction (x -> -x) if mirror_x is set, then rotated counterclockwise
+        by rotation_deg around the origin and finally shifted by (x_shift_nm, y_shift_nm).
+        Shifts by fractions of a nanometer are kept, so they add up when transformations are composed,
+        and coordinates are truncated to whole nanometers when they are written.
+
+        Args:
+        -----
+        x_shift_nm: float
+            The shift in the x direction in nanometers
+        y_shift_nm: float
+            The shift in the y direction in nanometers
+        rotation_deg: int
+            The counterclockwise rotation in degrees. Must be a multiple of 90.
+        mirror_x: bool
+            Whether to mirror in the x direction before rotating
+        """
+        if rotation_deg % 90 != 0:
+            raise ValueError("Only rotations by multiples of 90 degrees are supported")
+
+        self.x_shift_nm = _as_shift(x_shift_nm)
+        self.y_shift_nm = _as_shift(y_shift_nm)
+        self.rotation_deg = int(rotation_deg) % 360
+        self.mirror_x = bool(mirror_x)
+        # The rows of matrix as tuples, for transforming single points without NumPy
+        cos, sin = _QUARTER_TURN_DIRECTIONS[self.rotation_deg // 90]
+        mirror = -1 if self.mirror_x else 1
+        self._matrix_rows = ((mirror * cos, -sin), (mirror * sin, cos))
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """The 2x2 integer matrix of the mirroring and rotation"""
+        return np.array(self._matrix_rows, dtype=np.int64)
+
+    @property
+    def translation(self) -> np.ndarray:
+        """The shift as an int64 array, or as a float64 array for shifts by fractions of a nanometer"""
+        dtype = np.int64 if self.is_whole() else np.float64
+        return np.array([self.x_shift_nm, self.y_shift_nm], dtype=dtype)
+
+    @classmethod
+    def from_matrix(cls, matrix, translation) -> "CIF_transformation":
+        """Creates the transformation from a 2x2 integer matrix and a translation in nm"""
+        matrix = np.asarray(matrix, dtype=np.int64)
+        mirror_x = bool(round(np.linalg.det(matrix)) < 0)
+        rotation_column = matrix[:, 0] * (-1 if mirror_x else 1)
+        direction = (int(rotation_column[0]), int(rotation_column[1]))
+        if direction not in _QUARTER_TURN_DIRECTIONS:
+            raise ValueError("Only rotations by multiples of 90 degrees are supported")
+        transformation = cls(
+            x_shift_nm=translation[0],
+            y_shift_nm=translation[1],
+            rotation_deg=90 * _QUARTER_TURN_DIRECTIONS.index(direction),
+            mirror_x=mirror_x,
+        )
+        if not np.array_equal(transformation.matrix, matrix):
+            raise ValueError(
+                "The matrix is not a rotation by a multiple of 90 degrees with optional mirroring"
+            )
+        return transformation
+
+    def compose(self, other: "CIF_transformation") -> "CIF_transformation":
+        """Returns the transformation that applies this transformation first and then other"""
+        return CIF_transformation.from_matrix(
+            other.matrix @ self.matrix,
+            other.matrix @ self.translation + other.translation,
+        )
+
+    def is_whole(self) -> bool:
+        """Whether the shift is by whole nanometers"""
+        return isinstance(self.x_shift_nm, int) and isinstance(self.y_shift_nm, int)
+
+    def is_identity(self) -> bool:
+        return (
+            self.x_shift_nm == 0
+            and self.y_shift_nm == 0
+            and self.rotation_deg == 0
+            and not self.mirror_x
+        )
+
+    def inverse(self) -> "CIF_transformation":
+        """Returns the transformation that undoes this one"""
+        inverse_matrix = self.matrix.T
+        return CIF_transformation.from_matrix(inverse_matrix, -(inverse_matrix @ self.translation))
+
+    def apply_to_points(self, points) -> np.ndarray:
+        """Transforms an (N, 2) array of points, giving float64 points for shifts by fractions of a nanometer"""
+        points = _as_int64_array(points).reshape(-1, 2)
+        return points @ self.matrix.T + self.translation
+
+    def apply_to_boxes(self, boxes) -> np.ndarray:
+        """Transforms an (N, 4) array of (x_min, y_min, x_max, y_max) boxes, which may have half nanometers"""
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        first_corners = boxes[:, :2] @ self.matrix.T
+        second_corners = boxes[:, 2:] @ self.matrix.T
+        return np.concatenate(
+            [
+                np.minimum(first_corners, second_corners) + self.translation,
+                np.maximum(first_corners, second_corners) + self.translation,
+            ],
+            axis=1,
+        )
+
+    def get_cif_content(self) -> str:
+        """Returns the transformation in the format used in CIF calls, e.g. " M X R 0 1 T 1000 2000" """
+        cif_content = ""
+        if self.mirror_x:
+            cif_content += " M X"
+        if self.rotation_deg != 0:
+            cos, sin = _QUARTER_TURN_DIRECTIONS[self.rotation_deg // 90]
+            cif_content += f" R {cos} {sin}"
+        if self.x_shift_nm != 0 or self.y_shift_nm != 0:
+            cif_content += f" T {int(self.x_shift_nm)} {int(self.y_shift_nm)}"
+        return cif_content
+
+
+def _as_shift(shift_nm) -> int | float:
+    """Returns a shift as an int if it is a whole number of nanometers, and as a float otherwise"""
+    if isinstance(shift_nm, (int, np.integer)):
+        return int(shift_nm)
+    shift_nm = float(shift_nm)
+    return int(shift_nm) if shift_nm.is_integer() else shift_nm
+
+
+# (cos, sin) of rotations by 0, 90, 180 and 270 degrees
+_QUARTER_TURN_DIRECTIONS = [(1, 0), (0, 1), (-1, 0), (0, -1)]
+
+
+class CIF_symbol:
+    def __init__(self, symbol_name: str, layers: List[CleWin_layer] = None):
+        """
+        A symbol (cell) that is defined once in the .CIF file and placed any number of times using calls.
+        The shapes of the symbol are given as layers, which are matched to the layers of the file by their alias.
+        Symbols can themselves contain calls to other symbols.
+
+        Args:
+        -----
+        symbol_name: str
+            The name of the symbol as shown in CleWin
+        layers: List[CleWin_layer]
+            The layers with the shapes of the symbol
+        """
+        self.symbol_name = symbol_name
+        self.layers: List[CleWin_layer] = [] if layers is None else layers
+        self.calls: List[CIF_symbol_call] = []
+        # The row symbols of place_array by (count_x, pitch_x_nm), so equal arrays share one definition
+        self._row_symbols: Dict[Tuple[int, int], CIF_symbol] = {}
+
+    def get_layer(self, layer_alias: str) -> CleWin_layer | None:
+        for layer in self.layers:
+            if layer.layer_alias == layer_alias:
+                return layer
+        return None
+
+    def place(
+        self,
+        x_shift_nm: int = 0,
+        y_shift_nm: int = 0,
+        rotation_deg: int = 0,
+        mirror_x: bool = False,
+    ) -> "CIF_symbol_call":
+        """
+        Returns a call that places the symbol. See CIF_transformation for the meaning of the arguments.
+        """
+        return CIF_symbol_call(
+            symbol=self,
+            transformation=CIF_transformation(
+                x_shift_nm=x_shift_nm,
+                y_shift_nm=y_shift_nm,
+                rotation_deg=rotation_deg,
+                mirror_x=mirror_x,
+            ),
+        )
+
+    def add_call(self, call: "CIF_symbol_call"):
+        """Places another symbol inside this symbol"""
+        self.calls.append(call)
+
+    def place_array(
+        self,
+        pitch_x_nm: int,
+        pitch_y_nm: int,
+        count_x: int,
+        count_y: int,
+        skip_mask=None,
+        x_start_nm: int = 0,
+        y_start_nm: int = 0,
+    ) -> List["CIF_symbol_call"]:
+        """
+        Returns calls that place the symbol on every site of a rectangular array,
+        see step_and_repeat_offsets for the arguments.
+        Without a skip_mask the array is written compactly as one row symbol with count_x calls
+        placed count_y times, otherwise the symbol is placed once per remaining site.
+        The row symbol is named after the symbol, count_x and pitch_x_nm, and is reused by later arrays
+        with the same columns.
+        """
+        if skip_mask is not None:
+            site_offsets = step_and_repeat_offsets(
+                pitch_x_nm=pitch_x_nm,
+                pitch_y_nm=pitch_y_nm,
+                count_x=count_x,
+                count_y=count_y,
+                skip_mask=skip_mask,
+                x_start_nm=x_start_nm,
+                y_start_nm=y_start_nm,
+            )
+            return [self.place(x_shift_nm=x, y_shift_nm=y) for x, y in site_offsets.tolist()]
+
+        row_key = (int(count_x), int(pitch_x_nm))
+        row = self._row_symbols.get(row_key)
+        if row is None:
+            row = CIF_symbol(symbol_name=f"{self.symbol_name}_row_{row_key[0]}x{row_key[1]}")
+            for column in range(count_x):
+                row.add_call(self.place(x_shift_nm=column * int(pitch_x_nm)))
+            self._row_symbols[row_key] = row
+        return [
+            row.place(
+                x_shift_nm=int(x_start_nm),
+                y_shift_nm=int(y_start_nm) + line * int(pitch_y_nm),
+            )
+            for line in range(count_y)
+        ]
+
+    def get_flattened_shape_arrays(
+        self, transformation: CIF_transformation = None
+    ) -> Dict[str, CIF_shape_arrays]:
+        """
+        Returns the shapes of the symbol and of all symbols it calls, transformed and collected per layer alias
+        """
+        if transformation is None:
+            transformation = CIF_transformation()
+
+        parts: Dict[str, List[CIF_shape_arrays]] = {}
+        for layer in self.layers:
+            parts.setdefault(layer.layer_alias, []).append(
+                layer.get_shape_arrays().transformed(transformation)
+            )
+        for layer_alias, shape_arrays in _flatten_calls(self.calls, transformation).items():
+            parts.setdefault(layer_alias, []).append(shape_arrays)
+
+        return {
+            layer_alias: CIF_shape_arrays.concatenate(shape_arrays_list)
+            for layer_alias, shape_arrays_list in parts.items()
+        }
+
+
+def _flatten_calls(
+    calls: List["CIF_symbol_call"], transformation: CIF_transformation
+) -> Dict[str, CIF_shape_arrays]:
+    """
+    Flattens calls placed with the given transformation. Calls that place the same symbol with the same
+    orientation are flattened once and repeated for all their positions in bulk.
+    """
+    positions_by_placement: Dict[tuple, list] = {}
+    for call in calls:
+        placement = call.transformation.compose(transformation)
+        key = (id(call.symbol), placement.rotation_deg, placement.mirror_x)
+        positions_by_placement.setdefault(key, [call.symbol, placement, []])[2].append(
+            (placement.x_shift_nm, placement.y_shift_nm)
+        )
+
+    parts: Dict[str, List[CIF_shape_arrays]] = {}
+    for symbol, placement, positions in positions_by_placement.values():
+        orientation = CIF_transformation(
+            rotation_deg=placement.rotation_deg, mirror_x=placement.mirror_x
+        )
+        for layer_alias, shape_arrays in symbol.get_flattened_shape_arrays(
+            orientation
+        ).items():
+            parts.setdefault(layer_alias, []).append(shape_arrays.repeated(positions))
+
+    return {
+        layer_alias: CIF_shape_arrays.concatenate(shape_arrays_list)
+        for layer_alias, shape_arrays_list in parts.items()
+    }
+
+
+class CIF_symbol_call:
+    def __init__(self, symbol: CIF_symbol, transformation: CIF_transformation = None):
+        """
+        A placement of a symbol, written as "C n T x y;" in the .CIF file
+
+        Args:
+        -----
+        symbol: CIF_symbol
+            The placed symbol
+        transformation: CIF_transformation
+            How the symbol is placed. Defaults to no transformation.
+        """
+        self.symbol = symbol
+        self.transformation = (
+            CIF_transformation() if transformation is None else transformation
+        )
+
+    def get_cif_content(self, symbol_number: int) -> str:
+        return f"C {symbol_number}{self.transformation.get_cif_content()};\n"
+
+
+def flatten_symbol_calls(layers: List[CleWin_layer], calls: List[CIF_symbol_call]):
+    """
+    Adds the shapes placed by the calls to the layers with the matching alias.
+    Shapes on layers that are not in layers are dropped.
+
+    Args:
+    -----
+    layers: List[CleWin_layer]
+        The layers to add the shapes to
+    calls: List[CIF_symbol_call]
+        The calls to flatten
+    """
+    layers_by_alias = {layer.layer_alias: layer for layer in layers}
+    for layer_alias, shape_arrays in _flatten_calls(calls, CIF_transformation()).items():
+        if layer_alias in layers_by_alias:
+            layers_by_alias[layer_alias].add_shape_arrays_to_layer(shape_arrays)
+
+
+def _collect_called_symbols(symbol: CIF_symbol, symbols: Dict[int, CIF_symbol]):
+    for call in symbol.calls:
+        if id(call.symbol) not in symbols:
+            symbols[id(call.symbol)] = call.symbol
+            _collect_called_symbols(call.symbol, symbols)
+
+
+def _number_symbols(calls: List[CIF_symbol_call]) -> Dict[int, int]:
+    """Numbers every symbol reachable from the calls, starting at 2 since 1 is the main symbol"""
+    symbol_numbers: Dict[int, int] = {}
+    symbols_to_visit = [call.symbol for call in reversed(calls)]
+    while symbols_to_visit:
+        symbol = symbols_to_visit.pop()
+        if id(symbol) in symbol_numbers:
+            continue
+        symbol_numbers[id(symbol)] = len(symbol_numbers) + 2
+        symbols_to_visit.extend(call.symbol for call in reversed(symbol.calls))
+    return symbol_numbers
+
+      
+def write_to_cif(
+    filename,
+    layers: List[CleWin_layer],
+    calls: List[CIF_symbol_call] = None,
+    compression: str = None,
+    compression_level: int = None,
+):
+    """
+    Writes the layers to the file {filename}.cif.
+    The file is written layer by layer and shape by shape through a buffered file handle,
+    so the whole file is never held in memory as one string. Layers reuse the text of shapes that are unchanged
+    since their last export, see CleWin_layer.iter_cif_content.
+
+    A filename ending in one of CIF_COMPRESSED_EXTENSIONS, e.g. "mask.cif.gz", is written compressed.
+    Compression runs in a background thread while the next block of text is serialized.
+
+    Args:
+    -----
+    filename: str
+        The path of the file without the .cif extension, or with a compressed extension
+    layers: List[CleWin_layer]
+        The layers to write
+    calls: List[CIF_symbol_call]
+        Symbols placed in the main symbol. Every symbol is defined once in the file.
+    compression: str
+        One of "gzip", "bz2", "xz" and "zstd" to add its extension to filename and compress the file
+    compression_level: int
+        The compression level, by default from CIF_DEFAULT_COMPRESSION_LEVELS
+    """
+    path = get_cif_path(filename, compression)
+    with _file_report("write_to_cif", filename):
+        with _open_cif_to_write(path, compression_level) as file:
+            write_cif_to_file(file=file, layers=layers, calls=calls)
+            with phase("write"):
+                file.flush()
+
+
+def get_cif_path(filename, compression: str = None) -> str:
+    """
+    Returns the path of a CIF file from its path without the .cif extension, as taken by write_to_cif and load_cif.
+    Paths that end in one of CIF_COMPRESSED_EXTENSIONS are returned as they are.
+
+    Args:
+    -----
+    filename: str
+        The path of the file without the .cif extension, or with a compressed extension
+    compression: str
+        One of "gzip", "bz2", "xz" and "zstd" to add the extension of that compression instead of .cif
+    """
+    if compression is not None:
+        if compression not in CIF_COMPRESSED_EXTENSIONS:
+            raise ValueError(
+                f"Unknown compression {compression}, expected one of {', '.join(CIF_COMPRESSED_EXTENSIONS)}"
+            )
+        return f"{filename}{CIF_COMPRESSED_EXTENSIONS[compression]}"
+    if _get_compression(filename) is not None:
+        return str(filename)
+    return f"{filename}.cif"
+
+
+def _get_compression(path) -> str | None:
+    for compression, extension in CIF_COMPRESSED_EXTENSIONS.items():
+        if str(path).endswith(extension):
+            return compression
+    return None
+
+
+def _open_compressed(path, compression: str, mode: str, compression_level: int = None):
+    """Opens a compressed file as a binary file handle, with mode "rb" or "wb" """
+    if mode == "wb" and compression_level is None:
+        compression_level = CIF_DEFAULT_COMPRESSION_LEVELS[compression]
+    if compression == "gzip":
+        if mode == "rb":
+            return gzip.GzipFile(path, mode)
+        # Without a timestamp the same layout always gives the same file
+        return gzip.GzipFile(path, mode, compresslevel=compression_level, mtime=0)
+    if compression == "bz2":
+        return bz2.BZ2File(path, mode) if mode == "rb" else bz2.BZ2File(path, mode, compresslevel=compression_level)
+    if compression == "xz":
+        return lzma.LZMAFile(path, mode) if mode == "rb" else lzma.LZMAFile(path, mode, preset=compression_level)
+    if zstandard is None:
+        raise ValueError(f"Reading and writing {path} needs the zstandard package")
+    if mode == "rb":
+        return zstandard.open(path, mode)
+    return zstandard.open(path, mode, cctx=zstandard.ZstdCompressor(level=compression_level))
+
+
+def _open_cif_to_write(path, compression_level: int = None):
+    compression = _get_compression(path)
+    if compression is None:
+        return open(file=path, mode="w", buffering=CIF_WRITE_BUFFER_SIZE)
+    return _Compressing_writer(_open_compressed(path, compression, "wb", compression_level))
+
+
+def _open_cif_to_read(path):
+    compression = _get_compression(path)
+    if compression is None:
+        return open(file=path, mode="r")
+    return _Decompressing_reader(_open_compressed(path, compression, "rb"))
+
+
+class _Compressing_writer:
+    def __init__(self, file, buffer_size: int = CIF_WRITE_BUFFER_SIZE):
+        """
+        A text file handle that writes to a binary compressed file in a background thread.
+        Written text is collected into blocks of about buffer_size characters, and the thread encodes and compresses
+        one block while the next one is serialized. Errors of the thread are raised by the next write, flush or close.
+        """
+        self.file = file
+        self.buffer_size = buffer_size
+        self._texts: List[str] = []
+        self._size = 0
+        self._error: BaseException | None = None
+        self._blocks = queue.Queue(maxsize=CIF_COMPRESSION_QUEUE_BLOCKS)
+        self._thread = threading.Thread(target=self._compress_blocks, daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, text: str) -> int:
+        self._texts.append(text)
+        self._size += len(text)
+        if self._size >= self.buffer_size:
+            self._put_buffered_text()
+        return len(text)
+
+    def writelines(self, texts: Iterable[str]):
+        for text in texts:
+            self.write(text)
+
+    def flush(self):
+        """Waits until all text written so far is compressed and flushes the compressed file"""
+        self._put_buffered_text()
+        self._blocks.join()
+        self._raise_error()
+        self.file.flush()
+
+    def close(self):
+        try:
+            self._put_buffered_text()
+            self._blocks.put(None)
+            self._thread.join()
+            self._raise_error()
+        finally:
+            self.file.close()
+
+    def _put_buffered_text(self):
+        self._raise_error()
+        if self._texts:
+            self._blocks.put("".join(self._texts))
+            self._texts = []
+            self._size = 0
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def _compress_blocks(self):
+        while True:
+            block = self._blocks.get()
+            try:
+                if block is None:
+                    return
+                # After an error the remaining blocks are dropped, so writing never blocks
+                if self._error is None:
+                    self.file.write(block.encode())
+            except BaseException as error:
+                self._error = error
+            finally:
+                self._blocks.task_done()
+
+
+class _Decompressing_reader:
+    def __init__(self, file, block_size: int = CIF_READ_CHUNK_SIZE):
+        """
+        A binary file handle that reads from a compressed file in a background thread, so the next block is
+        decompressed while the previous one is parsed. Errors of the thread are raised by read.
+        """
+        self.file = file
+        self._block = b""
+        self._position = 0
+        self._is_done = False
+        self._is_closed = False
+        self._blocks = queue.Queue(maxsize=CIF_COMPRESSION_QUEUE_BLOCKS)
+        self._thread = threading.Thread(target=self._decompress_blocks, args=(block_size,), daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            return b"".join(iter(lambda: self.read(CIF_READ_CHUNK_SIZE), b""))
+        if self._position == len(self._block) and not self._is_done:
+            self._block = self._next_block()
+            self._position = 0
+        data = self._block[self._position : self._position + size]
+        self._position += len(data)
+        return data
+
+    def close(self):
+        self._is_closed = True
+        self._thread.join()
+        self.file.close()
+
+    def _next_block(self) -> bytes:
+        block = self._blocks.get()
+        if isinstance(block, BaseException):
+            self._is_done = True
+            raise block
+        if not block:
+            self._is_done = True
+        return block
+
+    def _decompress_blocks(self, block_size: int):
+        try:
+            while not self._is_closed:
+                block = self.file.read(block_size)
+                self._put(block)
+                if not block:
+                    return
+        except BaseException as error:
+            self._put(error)
+
+    def _put(self, item):
+        # Waits for room in the queue, unless the reader is closed before the file is read to the end
+        while not self._is_closed:
+            try:
+                self._blocks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+
+def write_cif_to_file(
+    file, layers: List[CleWin_layer], calls: List[CIF_symbol_call] = None
+):
+    """
+    Streams the layers in the proper .CIF format to an open text file handle.
+    The output is identical to the file written by write_to_cif.
+
+    Args:
+    -----
+    file: TextIO
+        A file handle opened for writing text
+    layers: List[CleWin_layer]
+        The layers to write
+    calls: List[CIF_symbol_call]
+        Symbols placed in the main symbol
+    """
+    report = get_active_report()
+    if report is not None:
+        file = _Instrumented_writer(file, report)
+    calls = [] if calls is None else calls
+    symbol_numbers = _number_symbols(calls)
+    symbols = {id(call.symbol): call.symbol for call in calls}
+    for symbol in list(symbols.values()):
+        _collect_called_symbols(symbol, symbols)
+
+    file.write("(1 unit = 0.001 micron);\n")
+
+    file.write("(Layer names:);\n")
+
+    file.writelines(layer.get_cif_declaration() for layer in layers)
+
+    for symbol_id, symbol_number in symbol_numbers.items():
+        symbol = symbols[symbol_id]
+        file.write(f"DS{symbol_number} 1 10;\n")
+        file.write(f"9 {symbol.symbol_name};\n")
+        for layer in symbol.layers:
+            _write_layer_content(file, layer)
+        file.writelines(
+            call.get_cif_content(symbol_numbers[id(call.symbol)]) for call in symbol.calls
+        )
+        file.write("DF;\n")
+
+    # add .cif comment lol
+    file.write("(Top level:);\n")
+
+    # Why is this aspect ratio chosen (1:10)? Erlend please explain
+    file.write("DS1 1 10;\n")
+
+    # wtf is this ??
+    file.write("9 MainSymbol;\n")
+
+    for layer in layers:
+        _write_layer_content(file, layer)
+
+    file.writelines(call.get_cif_content(symbol_numbers[id(call.symbol)]) for call in calls)
+
+    # mark cif function as done (Done Function, DF) and end file (End, E)
+    file.write("DF;\n")
+    file.write("C 1;\n")  # What is this??
+    file.write("E")
+
+
+def _write_layer_content(file, layer: CleWin_layer):
+    if not isinstance(file, _Instrumented_writer):
+        file.writelines(layer.iter_cif_content())
+        return
+    file.layer_alias = layer.layer_alias
+    file.writelines(layer.iter_cif_content())
+    file.layer_alias = None
+    file.report.add_layer(
+        layer.layer_alias, shapes_written=layer.get_shape_count(), vertices_written=_count_vertices(layer)
+    )
+
+
+class _Instrumented_writer:
+    def __init__(self, file, report):
+        """
+        Wraps a text file handle while instrumentation is enabled. Building the text and writing it are recorded as
+        separate phases, and the characters written are counted for the layer being written, if any.
+        """
+        self.file = file
+        self.report = report
+        self.layer_alias: str | None = None
+
+    def write(self, text: str):
+        with phase("write"):
+            self.file.write(text)
+        if self.layer_alias is None:
+            self.report.add("bytes_written", len(text))
+        else:
+            self.report.add_layer(self.layer_alias, bytes_written=len(text))
+
+    def writelines(self, texts: Iterable[str]):
+        texts = iter(texts)
+        while True:
+            with phase("serialize"):
+                text = next(texts, None)
+            if text is None:
+                return
+            self.write(text)
+
+
+def _count_vertices(layer: CleWin_layer) -> int:
+    """Returns the number of polygon and wire points of a layer"""
+    storage = layer._get_storage()
+    if isinstance(storage, CIF_shape_arrays):
+        return len(storage.polygon_points) + len(storage.wire_points)
+    return sum(len(shape.points) for shape in storage if not isinstance(shape, CIF_rectangle))
+
+
+def _record_loaded_layers(layers: List[CleWin_layer]):
+    report = get_active_report()
+    if report is None:
+        return
+    for layer in layers:
+        report.add_layer(layer.layer_alias, shapes_read=layer.get_shape_count(), vertices_read=_count_vertices(layer))
+
+
+def load_cif(filename, array_backed: bool = False, processes: int = 1):
+    """
+    Loads the layers of the file {filename}.cif.
+    Symbols placed with calls are flattened into the layers.
+
+    Args:
+    -----
+    filename: str
+        The path of the file without the .cif extension, or with a compressed extension, see write_to_cif
+    array_backed: bool
+        Whether the returned layers store their shapes in a CIF_shape_arrays
+    processes: int
+        The number of processes that parse the file. With more than one process, an uncompressed file is split
+        into parts of CIF_PARALLEL_RANGE_SIZE bytes at statement boundaries, which are parsed in parallel and
+        merged in order. Compressed files are always parsed in one process.
+
+    Returns:
+    --------
+    layers: List[CleWin_layer]
+        The layers declared in the file with all their shapes
+    """
+    with _file_report("load_cif", filename):
+        with phase("parse"):
+            layers, calls = _parse_cif_path(get_cif_path(filename), array_backed, processes)
+        with phase("flatten"):
+            flatten_symbol_calls(layers, calls)
+        _record_loaded_layers(layers)
+        return layers
+
+
+def load_cif_from_file(file, array_backed: bool = False):
+    """
+    Loads the layers from an open .CIF file. The file is parsed in a single pass over blocks of
+    CIF_READ_CHUNK_SIZE characters, so the text of the file is never held in memory as a whole.
+    Symbols placed with calls are flattened into the layers.
+
+    Args:
+    -----
+    file: TextIO | BinaryIO | mmap.mmap
+        Any object with a read(size) method returning str or bytes
+    array_backed: bool
+        Whether the returned layers store their shapes in a CIF_shape_arrays
+
+    Returns:
+    --------
+    layers: List[CleWin_layer]
+        The layers declared in the file with all their shapes
+    """
+    with phase("parse"):
+        layers, calls = _CIF_parser(array_backed=array_backed).parse(file)
+    with phase("flatten"):
+        flatten_symbol_calls(layers, calls)
+    _record_loaded_layers(layers)
+    return layers
+
+
+def load_cif_with_symbols(filename, array_backed: bool = False, processes: int = 1):
+    """
+    Loads the file {filename}.cif while keeping its symbol hierarchy.
+
+    Args:
+    -----
+    filename: str
+        The path of the file without the .cif extension, or with a compressed extension, see write_to_cif
+    array_backed: bool
+        Whether the returned layers store their shapes in a CIF_shape_arrays
+    processes: int
+        The number of processes that parse the file, see load_cif
+
+    Returns:
+    --------
+    layers: List[CleWin_layer]
+        The layers declared in the file with the shapes of the main symbol
+    calls: List[CIF_symbol_call]
+        The symbols placed in the main symbol
+    """
+    with _file_report("load_cif", filename):
+        with phase("parse"):
+            layers, calls = _parse_cif_path(get_cif_path(filename), array_backed, processes)
+        _record_loaded_layers(layers)
+    return layers, calls
+
+
+def _parse_cif_path(path, array_backed: bool, processes: int):
+    parser = _CIF_parser(array_backed=array_backed)
+    if processes > 1 and _get_compression(path) is None:
+        return parser.parse_in_parallel(path, processes)
+    with _open_cif_to_read(path) as file:
+        return parser.parse(file)
+
+
+def iter_cif_shape_arrays(file, chunk_size: int = CIF_READ_CHUNK_SIZE):
+    """
+    Parses an open .CIF file incrementally and yields its shapes in batches, using memory independent of the file size.
+
+    Args:
+    -----
+    file: TextIO | BinaryIO | mmap.mmap
+        Any object with a read(size) method returning str or bytes
+    chunk_size: int
+        The number of characters read at a time
+
+    Yields:
+    -------
+    symbol_number: int | None
+        The number of the symbol the shapes are defined in, or None for shapes outside any symbol
+    layer_alias: str
+        The alias of the layer of the shapes
+    shape_arrays: CIF_shape_arrays
+        The shapes, in the order they appear in the file
+    """
+    yield from _CIF_parser().iter_shape_arrays(file, chunk_size)
+
+
+def iter_cif_shapes(file, chunk_size: int = CIF_READ_CHUNK_SIZE):
+    """
+    Parses an open .CIF file incrementally and yields its shapes one by one.
+    See iter_cif_shape_arrays for the arguments.
+
+    Yields:
+    -------
+    symbol_number: int | None
+        The number of the symbol the shape is defined in, or None for shapes outside any symbol
+    layer_alias: str
+        The alias of the layer of the shape
+    shape: CIF_rectangle | CIF_polygon | CIF_wire
+        The shape
+    """
+    for symbol_number, layer_alias, shape_arrays in iter_cif_shape_arrays(
+        file, chunk_size
+    ):
+        for shape in shape_arrays.to_shapes():
+            yield symbol_number, layer_alias, shape
+
+
+class CIF_load_cache:
+    def __init__(self, max_entries: int = 64, max_bytes: int = 256 * 2**20):
+        """
+        A least recently used cache of parsed .CIF files, for library parts that are placed many times.
+        Files are identified by their absolute path, modification time and size, so a changed file is parsed again.
+        The geometry is kept once in read-only array-backed layers, and every load returns independent copies of it.
+
+        Args:
+        -----
+        max_entries: int
+            The maximum number of files kept in the cache
+        max_bytes: int
+            The maximum total size of the cached geometry arrays in bytes
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._nbytes = 0
+
+    def load_cif(self, filename, array_backed: bool = False) -> List[CleWin_layer]:
+        """
+        Same as load_cif, but the file is only parsed the first time it is loaded
+
+        Args:
+        -----
+        filename: str
+            The path of the file without the .cif extension
+        array_backed: bool
+            Whether the returned layers store their shapes in a CIF_shape_arrays
+        """
+        layers = []
+        for cached_layer in self._get_cached_layers(filename):
+            layer = cached_layer.empty_copy()
+            layer.shape_arrays = cached_layer.shape_arrays.copy()
+            if not array_backed:
+                _convert_to_object_backed(layer)
+            layers.append(layer)
+        return layers
+
+    def load_symbol(self, filename, symbol_name: str = None) -> CIF_symbol:
+        """
+        Returns a symbol with new layers of the file, which share the cached geometry without copying it.
+        Placing the symbol with CIF_symbol.place costs the same no matter how large the file is.
+        The stored shapes of the layers are read-only, but the layers can be transformed and extended.
+
+        Args:
+        -----
+        filename: str
+            The path of the file without the .cif extension
+        symbol_name: str
+            The name of the symbol. Defaults to the name of the file.
+        """
+        if symbol_name is None:
+            symbol_name = os.path.basename(filename)
+        layers = []
+        for cached_layer in self._get_cached_layers(filename):
+            # A new storage over the cached read-only arrays, so shifting the layer or adding shapes to it
+            # leaves the cached layer as it is
+            layer = cached_layer.empty_copy()
+            layer.shape_arrays = CIF_shape_arrays.from_arrays(
+                **{name: getattr(cached_layer.shape_arrays, name) for name in CIF_SHAPE_ARRAY_NAMES}
+            )
+            layers.append(layer)
+        return CIF_symbol(symbol_name=symbol_name, layers=layers)
+
+    def clear(self):
+        self._entries.clear()
+        self._nbytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def nbytes(self) -> int:
+        """The total size of the cached geometry arrays in bytes"""
+        return self._nbytes
+
+    def _get_cached_layers(self, filename) -> List[CleWin_layer]:
+        path = os.path.abspath(get_cif_path(filename))
+        stat = os.stat(path)
+        key = (path, stat.st_mtime_ns, stat.st_size)
+
+        if key in self._entries:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+        self.misses += 1
+        layers = load_cif(filename, array_backed=True)
+        nbytes = 0
+        for layer in layers:
+            layer.shape_arrays.set_read_only()
+            nbytes += layer.shape_arrays.nbytes
+
+        # Drop older versions of the same file before adding the new one
+        for old_key in [old_key for old_key in self._entries if old_key[0] == path]:
+            self._nbytes -= self._entries.pop(old_key)[1]
+        self._entries[key] = (layers, nbytes)
+        self._nbytes += nbytes
+        while self._entries and (
+            len(self._entries) > self.max_entries or self._nbytes > self.max_bytes
+        ):
+            self._nbytes -= self._entries.popitem(last=False)[1][1]
+        return layers
+
+
+# The cache used by load_cif_cached
+default_cif_load_cache = CIF_load_cache()
+
+
+def load_cif_cached(filename, array_backed: bool = False) -> List[CleWin_layer]:
+    """
+    Same as load_cif, but files are parsed once and kept in default_cif_load_cache.
+    Every call returns independent layers that can be shifted and modified freely.
+
+    Args:
+    -----
+    filename: str
+        The path of the file without the .cif extension
+    array_backed: bool
+        Whether the returned layers store their shapes in a CIF_shape_arrays
+    """
+    return default_cif_load_cache.load_cif(filename, array_backed=array_backed)
+
+
+def _iter_cif_blocks(file, chunk_size: int):
+    """Reads the file in chunks and yields blocks of text that end at a statement boundary"""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    report = get_active_report()
+    carry = ""
+    while True:
+        with phase("read"):
+            data = file.read(chunk_size)
+            chunk = decoder.decode(data) if isinstance(data, bytes) else data
+        if not data:
+            break
+        if report is not None:
+            report.add("bytes_read", len(data))
+        text = carry + chunk
+        end = _find_block_end(text)
+        carry = text[end:]
+        if end > 0:
+            yield text[:end]
+    if carry.strip():
+        yield carry
+
+
+def _find_block_end(text: str) -> int:
+    """Returns the index after the last semicolon that is not inside a comment, or 0 if there is none"""
+    end = text.rfind(";")
+    while end >= 0 and text.count("(", 0, end) != text.count(")", 0, end):
+        end = text.rfind(";", 0, end)
+    return end + 1
+
+
+# A statement is either a comment in parentheses (which may contain one level of nested parentheses)
+# or everything up to the next semicolon
+_CIF_STATEMENT_PATTERN = re.compile(r"\s*(\((?:[^()]|\([^()]*\))*\)|[^;()]+)\s*;?")
+
+
+def _split_cif_statements(block: str) -> List[str]:
+    if "(" not in block:
+        return [statement for statement in map(str.strip, block.split(";")) if statement]
+    return [
+        statement
+        for statement in (
+            match.group(1).strip() for match in _CIF_STATEMENT_PATTERN.finditer(block)
+        )
+        if statement
+    ]
+
+
+def _parse_integers(text: str) -> np.ndarray | None:
+    """Parses whitespace separated integers, returns None if the text contains anything else"""
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", DeprecationWarning)
+        try:
+            return np.fromstring(text, dtype=np.int64, sep=" ")
+        except (ValueError, DeprecationWarning):
+            return None
+
+
+class _CIF_parser:
+    def __init__(self, array_backed: bool = False):
+        """
+        Builds layers, symbols and calls from the statements of a .CIF file.
+        Shapes are collected in array-backed layers while parsing and converted to objects at the end
+        unless array_backed is set.
+        """
+        self.array_backed = array_backed
+        self.layers: Dict[str, CleWin_layer] = {}
+        self.symbols: Dict[int, CIF_symbol] = {}
+        self.top_level_calls: List[CIF_symbol_call] = []
+        self.current_symbol_number: int | None = None
+        self.current_layer_alias: str | None = None
+        self.scale = 1
+        self.ended = False
+
+    def parse(self, file, chunk_size: int = CIF_READ_CHUNK_SIZE):
+        self._add_shape_runs(self.iter_shape_arrays(file, chunk_size))
+        return self.get_layers_and_calls()
+
+    def parse_in_parallel(self, path, processes: int, range_size: int = None):
+        """
+        Parses an uncompressed file in byte ranges of about range_size bytes in a process pool, see _get_cif_ranges.
+        The range size defaults to CIF_PARALLEL_RANGE_SIZE.
+        The workers only split and parse the text, and the statements and shapes they return are applied here in
+        file order, so the result is the same as for parse.
+        """
+        ranges = _get_cif_ranges(path, range_size)
+        report = get_active_report()
+        if report is not None:
+            report.add("bytes_read", ranges[-1][1])
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            range_items = executor.map(
+                _parse_cif_range,
+                [path] * len(ranges),
+                [start for start, _ in ranges],
+                [end for _, end in ranges],
+            )
+            self._add_shape_runs(
+                shape_run for items in range_items for shape_run in self._apply_items(items)
+            )
+        return self.get_layers_and_calls()
+
+    def iter_shape_arrays(self, file, chunk_size: int = CIF_READ_CHUNK_SIZE):
+        """Parses the file and yields (symbol_number, layer_alias, shape_arrays) for every run of shapes"""
+        for block in _iter_cif_blocks(file, chunk_size):
+            if self.ended:
+                return
+            yield from self._apply_items(_parse_cif_block(block))
+
+    def _apply_items(self, items: List):
+        """
+        Applies the statements of a block parsed by _parse_cif_block, and yields its runs of shapes
+        scaled and with the symbol and layer they belong to
+        """
+        for item in items:
+            if self.ended:
+                return
+            if isinstance(item, str):
+                self.parse_statement(item)
+            elif self.current_layer_alias is None:
+                raise ValueError("Shape encountered before any layer was selected")
+            else:
+                yield self.current_symbol_number, self.current_layer_alias, _scaled_shape_arrays(
+                    item, self.scale
+                )
+
+    def _add_shape_runs(self, shape_runs):
+        """
+        Adds runs of shapes to their layers. The runs of every layer are concatenated once at the end,
+        so files that switch between layers or shape kinds often still load in linear time.
+        """
+        runs: Dict[Tuple[int | None, str], Tuple[CleWin_layer, List[CIF_shape_arrays]]] = {}
+        for symbol_number, layer_alias, shape_arrays in shape_runs:
+            key = (symbol_number, layer_alias)
+            if key not in runs:
+                runs[key] = (self._get_layer(symbol_number, layer_alias), [])
+            runs[key][1].append(shape_arrays)
+        for layer, shape_arrays_list in runs.values():
+            layer.add_shape_arrays_to_layer(CIF_shape_arrays.concatenate(shape_arrays_list))
+
+    def parse_statement(self, statement: str):
+        """Parses a statement that is not a shape"""
+        command = statement[0]
+
+        if command == "(":
+            # Comments are only meaningful as CleWin layer declarations, "L L0; (CleWin: ...);"
+            if statement.startswith("(CleWin:") and self.current_symbol_number is None:
+                layer = layer_from_CleWin_string(f"{self.current_layer_alias};{statement}")
+                layer.shape_arrays = CIF_shape_arrays()
+                self.layers[layer.layer_alias] = layer
+        elif command == "L":
+            self.current_layer_alias = statement[1:].strip()
+        elif statement.startswith("DS"):
+            values = statement[2:].split()
+            self.current_symbol_number = int(values[0])
+            self._get_symbol(self.current_symbol_number)
+            # DS n a b scales the coordinates of the symbol by a/b in units of 0.01 micron
+            if len(values) == 3:
+                self.scale = 10 * int(values[1]) / int(values[2])
+            else:
+                self.scale = 10
+            self.current_layer_alias = None
+        elif statement.startswith("DF"):
+            self.current_symbol_number = None
+            self.current_layer_alias = None
+            self.scale = 1
+        elif command == "C":
+            call = self._call_from_statement(statement)
+            if self.current_symbol_number is None:
+                self.top_level_calls.append(call)
+            else:
+                self._get_symbol(self.current_symbol_number).add_call(call)
+        elif command == "9" and self.current_symbol_number is not None:
+            self._get_symbol(self.current_symbol_number).symbol_name = statement[1:].strip()
+        elif command == "E":
+            self.ended = True
+        elif command.isdigit():
+            # Other user extensions are not used by this library
+            pass
+        else:
+            raise ValueError(f"Unsupported statement encountered:\n{statement}")
+
+    def _get_symbol(self, symbol_number: int) -> CIF_symbol:
+        if symbol_number not in self.symbols:
+            self.symbols[symbol_number] = CIF_symbol(symbol_name=f"Symbol{symbol_number}")
+        return self.symbols[symbol_number]
+
+    def _get_declared_layer(self, layer_alias: str) -> CleWin_layer:
+        if layer_alias not in self.layers:
+            # Layers used without a CleWin declaration get a default name and color
+            self.layers[layer_alias] = CleWin_layer(
+                layer_name=layer_alias,
+                layer_alias=layer_alias,
+                layer_index=len(self.layers),
+                fill_color=CleWin_color(128, 128, 128),
+                border_color=CleWin_color(128, 128, 128),
+                array_backed=True,
+            )
+        return self.layers[layer_alias]
+
+    def _get_layer(self, symbol_number: int | None, layer_alias: str) -> CleWin_layer:
+        declared_layer = self._get_declared_layer(layer_alias)
+        if symbol_number is None:
+            return declared_layer
+        symbol = self._get_symbol(symbol_number)
+        layer = symbol.get_layer(layer_alias)
+        if layer is None:
+            layer = declared_layer.empty_copy()
+            symbol.layers.append(layer)
+        return layer
+
+    def _call_from_statement(self, statement: str) -> CIF_symbol_call:
+        tokens = statement[1:].split()
+        symbol = self._get_symbol(int(tokens[0]))
+        scale = self.scale
+        matrix = np.eye(2, dtype=np.int64)
+        translation = np.zeros(2, dtype=np.int64)
+        n = 1
+        while n < len(tokens):
+            if tokens[n] == "T":
+                step = np.eye(2, dtype=np.int64)
+                shift = np.array(
+                    [round(int(tokens[n + 1]) * scale), round(int(tokens[n + 2]) * scale)],
+                    dtype=np.int64,
+                )
+                n += 3
+            elif tokens[n] == "M":
+                step = np.diag([-1, 1] if tokens[n + 1] == "X" else [1, -1]).astype(np.int64)
+                shift = np.zeros(2, dtype=np.int64)
+                n += 2
+            elif tokens[n] == "R":
+                direction = np.sign([int(tokens[n + 1]), int(tokens[n + 2])]).astype(np.int64)
+                if np.count_nonzero(direction) != 1:
+                    raise ValueError(
+                        f"Only rotations by multiples of 90 degrees are supported:\n{statement}"
+                    )
+                step = np.array(
+                    [[direction[0], -direction[1]], [direction[1], direction[0]]], dtype=np.int64
+                )
+                shift = np.zeros(2, dtype=np.int64)
+                n += 3
+            else:
+                raise ValueError(f"Unsupported call transformation:\n{statement}")
+            matrix = step @ matrix
+            translation = step @ translation + shift
+        return CIF_symbol_call(
+            symbol=symbol,
+            transformation=CIF_transformation.from_matrix(matrix, translation),
+        )
+
+    def get_layers_and_calls(self):
+        """
+        Returns the declared layers with the shapes of the symbols called at the top level,
+        and the calls made from those symbols
+        """
+        layers = list(self.layers.values())
+        calls = []
+        for top_level_call in self.top_level_calls:
+            transformation = top_level_call.transformation
+            for symbol_layer in top_level_call.symbol.layers:
+                shape_arrays = symbol_layer.shape_arrays
+                if not transformation.is_identity():
+                    shape_arrays = shape_arrays.transformed(transformation)
+                self.layers[symbol_layer.layer_alias].shape_arrays.extend_arrays(
+                    shape_arrays
+                )
+            for call in top_level_call.symbol.calls:
+                calls.append(
+                    CIF_symbol_call(
+                        symbol=call.symbol,
+                        transformation=call.transformation.compose(transformation),
+                    )
+                )
+
+        if not self.array_backed:
+            with phase("convert"):
+                for layer in layers:
+                    _convert_to_object_backed(layer)
+                for symbol in self.symbols.values():
+                    for layer in symbol.layers:
+                        _convert_to_object_backed(layer)
+        return layers, calls
+
+
+def _parse_cif_block(block: str) -> List:
+    """
+    Splits a block of statements into the statements that are not shapes, as strings, and runs of consecutive
+    shapes of any kind, as unscaled CIF_shape_arrays. The order of the block is kept.
+    """
+    # Most of a flattened mask is long runs of boxes on one layer, which are parsed in one go
+    if (
+        "(" not in block
+        and not any(command in block for command in "LPWDCE")
+        and block.count("B") == block.count(";")
+    ):
+        rectangles = _rectangles_from_text(block.replace("B", " ").replace(";", " "), block.count(";"))
+        if rectangles is not None:
+            return [rectangles]
+
+    items = []
+    run: List[str] = []
+    for statement in _split_cif_statements(block):
+        if statement[0] in "BPW":
+            run.append(statement)
+            continue
+        if run:
+            items.append(_shapes_from_run(run))
+            run = []
+        items.append(statement)
+    if run:
+        items.append(_shapes_from_run(run))
+    return items
+
+
+def _parse_cif_range(path, start: int, end: int) -> List:
+    """Parses the bytes start..end of a file with _parse_cif_block, in a worker process"""
+    with open(path, "rb") as file:
+        file.seek(start)
+        return _parse_cif_block(file.read(end - start).decode("utf-8"))
+
+
+# A semicolon at the end of a line followed by a shape or layer statement
+_CIF_RANGE_BOUNDARY_PATTERN = re.compile(rb";[ \t\r]*\n\s*[BPWL]")
+
+
+def _get_cif_ranges(path, range_size: int = None) -> List[Tuple[int, int]]:
+    """
+    Splits a file into byte ranges of about range_size bytes, by default CIF_PARALLEL_RANGE_SIZE,
+    that can be parsed independently.
+    Every range after the first starts right after a semicolon at the end of a line that is followed by a shape
+    or layer statement, which is never inside a comment in files written by write_to_cif.
+    Files without such line breaks are returned as a single range.
+    """
+    if range_size is None:
+        range_size = CIF_PARALLEL_RANGE_SIZE
+    size = os.path.getsize(path)
+    starts = [0]
+    with open(path, "rb") as file:
+        position = range_size
+        while position < size:
+            file.seek(position)
+            window = file.read(1 << 16)
+            match = _CIF_RANGE_BOUNDARY_PATTERN.search(window)
+            if match is not None:
+                starts.append(position + match.start() + 1)
+                position = starts[-1] + range_size
+            elif len(window) < 1 << 16:
+                break
+            else:
+                # Keep a boundary that straddles the end of the window
+                position += len(window) - 64
+    return list(zip(starts, starts[1:] + [size]))
+
+
+def _shapes_from_run(run: List[str]) -> CIF_shape_arrays:
+    """Parses consecutive B, P and W statements without scaling, keeping their order"""
+    commands = "".join(statement[0] for statement in run)
+    shape_arrays = None
+    if commands.count("B") == len(run):
+        shape_arrays = _rectangles_from_text(" ".join(run).replace("B", " "), len(run))
+    elif commands.count("P") == len(run):
+        shape_arrays = _polygons_from_run(run)
+    elif commands.count("W") == len(run):
+        shape_arrays = _wires_from_run(run)
+    else:
+        kinds = np.frombuffer(commands.encode(), dtype=np.uint8)
+        kinds = np.select(
+            [kinds == ord("B"), kinds == ord("P")], [RECTANGLE_KIND, POLYGON_KIND], WIRE_KIND
+        ).astype(np.uint8)
+        rectangles = _rectangles_from_text(
+            " ".join(statement for statement in run if statement[0] == "B").replace("B", " "),
+            commands.count("B"),
+        )
+        polygons = _polygons_from_run([statement for statement in run if statement[0] == "P"])
+        wires = _wires_from_run([statement for statement in run if statement[0] == "W"])
+        if rectangles is not None and polygons is not None and wires is not None:
+            shape_arrays = CIF_shape_arrays.from_arrays(
+                rectangles=rectangles.rectangles,
+                polygon_points=polygons.polygon_points,
+                polygon_offsets=polygons.polygon_offsets,
+                wire_points=wires.wire_points,
+                wire_offsets=wires.wire_offsets,
+                wire_widths=wires.wire_widths,
+                kinds=kinds,
+            )
+
+    if shape_arrays is None:
+        # Fall back to parsing statement by statement, e.g. for boxes with a direction
+        shape_arrays = CIF_shape_arrays.from_shapes([_shape_from_statement(statement) for statement in run])
+    return shape_arrays
+
+
+def _rectangles_from_text(text: str, count: int) -> CIF_shape_arrays | None:
+    values = _parse_integers(text)
+    if values is None or len(values) != 4 * count:
+        return None
+    return CIF_shape_arrays.from_arrays(rectangles=values)
+
+
+def _polygons_from_run(run: List[str]) -> CIF_shape_arrays | None:
+    value_counts = [len(statement.split()) - 1 for statement in run]
+    values = _parse_integers(" ".join(run).replace("P", " "))
+    if values is None or len(values) != sum(value_counts):
+        return None
+    for statement, value_count in zip(run, value_counts):
+        if value_count % 2 != 0:
+            raise ValueError(f"Polygon with an odd number of coordinates:\n{statement}")
+    return CIF_shape_arrays.from_arrays(
+        polygon_points=values,
+        polygon_offsets=_offsets_from_counts(np.array(value_counts, dtype=np.int64) // 2),
+    )
+
+
+def _wires_from_run(run: List[str]) -> CIF_shape_arrays | None:
+    value_counts = np.array([len(statement.split()) - 1 for statement in run], dtype=np.int64)
+    values = _parse_integers(" ".join(run).replace("W", " "))
+    if values is None or len(values) != value_counts.sum():
+        return None
+    for statement, value_count in zip(run, value_counts.tolist()):
+        if value_count % 2 != 1:
+            raise ValueError(f"Wire with an odd number of coordinates:\n{statement}")
+    # The first value of every statement is the width, the rest are coordinates
+    width_positions = _offsets_from_counts(value_counts)[:-1]
+    is_width = np.zeros(len(values), dtype=bool)
+    is_width[width_positions] = True
+    return CIF_shape_arrays.from_arrays(
+        wire_points=values[~is_width],
+        wire_offsets=_offsets_from_counts((value_counts - 1) // 2),
+        wire_widths=values[is_width],
+    )
+
+
+def _scaled_shape_arrays(shape_arrays: CIF_shape_arrays, scale: float) -> CIF_shape_arrays:
+    """Returns the shapes with all values multiplied by the scale of a symbol and rounded to whole nm"""
+    if scale == 1:
+        return shape_arrays
+
+    def scaled(values):
+        return np.round(values * scale).astype(np.int64)
+
+    return CIF_shape_arrays.from_arrays(
+        rectangles=scaled(shape_arrays.rectangles),
+        polygon_points=scaled(shape_arrays.polygon_points),
+        polygon_offsets=shape_arrays.polygon_offsets,
+        wire_points=scaled(shape_arrays.wire_points),
+        wire_offsets=shape_arrays.wire_offsets,
+        wire_widths=scaled(shape_arrays.wire_widths),
+        kinds=shape_arrays.kinds,
+    )
+
+
+def _convert_to_object_backed(layer: CleWin_layer):
+    """
+    Makes an array-backed layer object-backed. The shape objects are only created when the shapes are first
+    accessed, so layers that are loaded and then written, queried or analysed keep working on the arrays.
+    """
+    shape_arrays = layer.get_shape_arrays()
+    layer.shape_arrays = None
+    layer.shapes = []
+    layer._unconverted_shape_arrays = shape_arrays
+
+
+def _shape_from_statement(statement: str, scale: float = 1):
+    """Creates a shape from a B, P or W statement without the trailing semicolon"""
+    values = [int(value) for value in statement[1:].replace(",", " ").split()]
+    if scale != 1:
+        values = [round(value * scale) for value in values]
+
+    if statement[0] == "B":
+        x_size, y_size, x_center, y_center = values[:4]
+        # Boxes may have a direction, only directions along the axes are supported
+        if len(values) == 6 and values[4] == 0:
+            x_size, y_size = y_size, x_size
+        elif len(values) == 6 and values[5] != 0:
+            raise ValueError(f"Only boxes along the axes are supported:\n{statement}")
+        return CIF_rectangle(
+            x_size_nm=x_size,
+            y_size_nm=y_size,
+            x_center_nm=x_center,
+            y_center_nm=y_center,
+        )
+    elif statement[0] == "P":
+        points = [[x, y] for x, y in zip(values[::2], values[1::2])]
+        return CIF_polygon(points=points)
+    else:
+        points = [[x, y] for x, y in zip(values[1::2], values[2::2])]
+        return CIF_wire(points=points, width_nm=values[0])
+
+
+def shapes_from_string(shape_strings):
+    """
+    Creates shapes from B, P and W statements without their trailing semicolons
+
+    Args:
+    -----
+    shape_strings: List[str]
+        The statements, e.g. "B 20000 4000 111000 -70500"
+
+    Returns:
+    --------
+    shapes: List[CIF_rectangle | CIF_polygon | CIF_wire]
+        The shapes in the same order as the statements
+    """
+    shapes = []
+
+    for i, shape_string in enumerate(shape_strings):
+        shape_string = shape_string.strip()
+        if not shape_string or shape_string[0] not in "BPW":
+            raise ValueError(
+                f"Unsupported shape encountered in shape number {i}:\n{shape_string}"
+            )
+        shapes.append(_shape_from_statement(shape_string))
+
+    return shapes
+
+
+def color_from_CleWin_string(color_string):
+    blue = int(f"0x{color_string[2:4]}", base=0)
+    green = int(f"0x{color_string[4:6]}", base=0)
+    red = int(f"0x{color_string[6:8]}", base=0)
+
+    return CleWin_color(red, green, blue)
+
+
+def layer_from_CleWin_string(layer_string):
+    alias = layer_string.split(";")[0]
+
+    layer_string = layer_string.split(";")[1]
+    layer_string = layer_string.split("(")[1]
+    layer_string = layer_string.split(")")[0]
+
+    index = int(layer_string.split("/")[0].split(" ")[1])
+    name = " ".join(layer_string.split("/")[0].split(" ")[2:])
+    fill_color_string = layer_string.split("/")[1].split(" ")[0]
+    border_color_string = layer_string.split("/")[1].split(" ")[1]
+    fill_color = color_from_CleWin_string(fill_color_string)
+    border_color = color_from_CleWin_string(border_color_string)
+
+    layer = CleWin_layer(
+        layer_name=name,
+        layer_alias=alias,
+        layer_index=index,
+        fill_color=fill_color,
+        border_color=border_color,
+    )
+
+    return layer
+
+
+def plotLayers(
+    layers: List[CleWin_layer],
+    window_size: int = 10_000_000,
+    alpha=0.5,
+    min_feature_px: float = None,
+):
+    """
+    Shows a preview of the cif objects for the different layers in a matplotlib window.
+    Note that the window size is in nm as with the rest of the library (for obvious reasons)
+
+    Also note that the the resulting layer will be one with alpha = 1. A lower alpha is used for the preview to
+    make it easier to see the different layers stacked. This has the unfortunate side effect of making wires look
+    like they are spotted and ugly, but this is not the case when printed. This is due to the way matplotlib handles
+    transparency and absolute sizing of shapes in the plot. A more thoughtful implementation of this function would
+    probably fix this, but it is not a priority.
+
+    Args:
+    -----
+    layers: List[CleWin_layer]
+        The layers to plot
+    window_size: int
+        The side-length of the total window in nm
+    alpha: float
+        The alpha (transparency) value of the layers in the plot. Defaults to 0.5. The printed results will look like alpha = 1.
+    min_feature_px: float
+        Level of detail. If given, shapes smaller than this number of pixels in both directions are not drawn.
+
+    Each layer is drawn with one collection per shape type and shapes outside the window are skipped,
+    so large layouts can be previewed interactively.
+
+    Returns:
+    --------
+    fig: matplotlib.figure.Figure
+        The figure object of the plot
+    ax: matplotlib.axes.Axes
+        The axes object of the plot
+    """
+    fig, ax = plt.subplots()
+    ax.set_xlim(-window_size / 2, window_size / 2)
+    ax.set_ylim(-window_size / 2, window_size / 2)
+
+    ax.set_aspect("equal", "box")
+    # May want to reconsider plotting in nm -> um
+    ax.set_xlabel("x (nm)")
+    ax.set_ylabel("y (nm)")
+    window = (-window_size / 2, -window_size / 2, window_size / 2, window_size / 2)
+    min_feature_nm = _min_feature_nm(ax, window_size, min_feature_px)
+    for layer in layers:
+        add_shape_arrays_to_ax(
+            ax=ax,
+            shape_arrays=layer.get_shape_arrays(),
+            color=layer.fill_color.format_color_hex_rgb(),
+            alpha=alpha,
+            window=window,
+            min_feature_nm=min_feature_nm,
+        )
     plt.show()
     return fig, ax
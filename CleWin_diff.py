@@ -0,0 +1,491 @@
+from typing import List, Tuple
+import numpy as np
+
+from CleWin_cif_creator import (
+    CleWin_layer,
+    CIF_shape_arrays,
+    RECTANGLE_KIND,
+    POLYGON_KIND,
+    WIRE_KIND,
+    load_cif,
+    _offsets_from_counts,
+    _remove_repeated_points,
+)
+from CleWin_rasterizer import iter_raster_tiles
+
+# The largest number of differing pixels whose location is kept per layer in raster mode
+DIFF_MAX_RASTER_LOCATIONS = 1 << 16
+
+# Constants of the splitmix64 mixing function used to hash shapes
+_MIX_MULTIPLIERS = (np.uint64(0xBF58476D1CE4E5B9), np.uint64(0x94D049BB133111EB))
+_MIX_SHIFTS = (np.uint64(30), np.uint64(27), np.uint64(31))
+_HASH_INCREMENT = np.uint64(0x9E3779B97F4A7C15)
+
+
+class CIF_layer_difference:
+    def __init__(
+        self,
+        layer_alias: str,
+        removed_indices: np.ndarray = None,
+        added_indices: np.ndarray = None,
+        changed_indices: np.ndarray = None,
+        removed_shapes: CIF_shape_arrays = None,
+        added_shapes: CIF_shape_arrays = None,
+        removed_locations: np.ndarray = None,
+        added_locations: np.ndarray = None,
+        changed_locations: np.ndarray = None,
+        differing_pixel_count: int = None,
+        differing_pixel_locations: np.ndarray = None,
+        pixel_size_nm: float = None,
+    ):
+        """
+        The difference of one layer between an old and a new layout, see compare_layouts.
+        In shapes mode, the pixel attributes are None, and in raster mode the shape attributes are None.
+
+        Args:
+        -----
+        layer_alias: str
+            The alias of the compared layer
+        removed_indices: np.ndarray
+            The indices of the shapes of the old layer without an equal or changed shape in the new layer
+        added_indices: np.ndarray
+            The indices of the shapes of the new layer without an equal or changed shape in the old layer
+        changed_indices: np.ndarray
+            (K, 2) array of (old index, new index) of shapes that differ but have the same bounding box center
+            and are both closed shapes or both wires
+        removed_shapes, added_shapes: CIF_shape_arrays
+            The removed and added shapes
+        removed_locations, added_locations, changed_locations: np.ndarray
+            (n, 2) float arrays with the bounding box centers of the removed, added and changed shapes in nm
+        differing_pixel_count: int
+            The number of pixels that are covered in only one of the layouts
+        differing_pixel_locations: np.ndarray
+            (n, 2) float array with the centers of the first DIFF_MAX_RASTER_LOCATIONS differing pixels in nm
+        pixel_size_nm: float
+            The side-length of a pixel in nm
+        """
+        self.layer_alias = layer_alias
+        self.removed_indices = removed_indices
+        self.added_indices = added_indices
+        self.changed_indices = changed_indices
+        self.removed_shapes = removed_shapes
+        self.added_shapes = added_shapes
+        self.removed_locations = removed_locations
+        self.added_locations = added_locations
+        self.changed_locations = changed_locations
+        self.differing_pixel_count = differing_pixel_count
+        self.differing_pixel_locations = differing_pixel_locations
+        self.pixel_size_nm = pixel_size_nm
+
+    @property
+    def is_identical(self) -> bool:
+        if self.differing_pixel_count is not None:
+            return self.differing_pixel_count == 0
+        return len(self.removed_indices) == 0 and len(self.added_indices) == 0 and len(self.changed_indices) == 0
+
+    @property
+    def differing_area_nm2(self) -> float | None:
+        if self.differing_pixel_count is None:
+            return None
+        return self.differing_pixel_count * self.pixel_size_nm**2
+
+    def __repr__(self):
+        if self.differing_pixel_count is not None:
+            return (
+                f"CIF_layer_difference({self.layer_alias}: {self.differing_pixel_count} differing pixels "
+                f"of {self.pixel_size_nm:g} nm)"
+            )
+        return (
+            f"CIF_layer_difference({self.layer_alias}: {len(self.added_indices)} added, "
+            f"{len(self.removed_indices)} removed, {len(self.changed_indices)} changed)"
+        )
+
+
+def compare_layouts(
+    old_layout: str | List[CleWin_layer],
+    new_layout: str | List[CleWin_layer],
+    mode: str = "shapes",
+    pixel_size_nm: float = None,
+    polygon_samples: int = 1,
+    tile_size_px: int = 2048,
+) -> List[CIF_layer_difference]:
+    """
+    Compares two layouts layer by layer, where layers are matched by their alias.
+
+    In "shapes" mode, every shape is brought into a canonical form and hashed, and the two layers are compared
+    as multisets of hashes, so the order of the shapes does not matter. Closed shapes are compared as polygons
+    in counter-clockwise order starting at their lowest-left vertex, without repeated or collinear vertices,
+    so a rectangle equals a polygon with the same corners. Wires are compared without repeated or straight-through
+    points and in the direction starting at their lower-left end.
+    Removed and added shapes with the same bounding box center are reported as changed.
+
+    In "raster" mode, both layers are rasterized tile by tile and the pixels with more than half coverage are
+    compared, which is independent of how the geometry is split into shapes, up to the pixel size.
+
+    Args:
+    -----
+    old_layout, new_layout: str | List[CleWin_layer]
+        The layers, or the path of a CIF file as for load_cif
+    mode: str
+        "shapes" or "raster"
+    pixel_size_nm: float
+        The side-length of a pixel in nm, required in raster mode
+    polygon_samples: int
+        The number of samples per pixel in each direction for polygons and wires in raster mode
+    tile_size_px: int
+        The side-length of the tiles used for rasterization, in pixels
+
+    Returns:
+    --------
+    differences: List[CIF_layer_difference]
+        A difference for every layer alias of the old layout, followed by those only in the new layout
+    """
+    if mode not in ("shapes", "raster"):
+        raise ValueError(f"Unknown comparison mode {mode}, use 'shapes' or 'raster'")
+    if mode == "raster" and (pixel_size_nm is None or pixel_size_nm <= 0):
+        raise ValueError("Raster comparison requires a positive pixel_size_nm")
+
+    old_layers = _get_layers_by_alias(old_layout)
+    new_layers = _get_layers_by_alias(new_layout)
+    aliases = list(old_layers) + [alias for alias in new_layers if alias not in old_layers]
+
+    differences = []
+    for alias in aliases:
+        old_arrays = _get_shape_arrays(old_layers.get(alias))
+        new_arrays = _get_shape_arrays(new_layers.get(alias))
+        if mode == "shapes":
+            differences.append(_compare_shapes(alias, old_arrays, new_arrays))
+        else:
+            differences.append(
+                _compare_rasters(alias, old_arrays, new_arrays, pixel_size_nm, polygon_samples, tile_size_px)
+            )
+    return differences
+
+
+def get_shape_hashes(shape_arrays: CIF_shape_arrays) -> np.ndarray:
+    """
+    Returns a uint64 hash of the canonical form of every shape in insertion order, see compare_layouts.
+    Equal hashes mean equal geometry up to the representation of the shape, barring 64-bit hash collisions.
+    """
+    kinds = shape_arrays.kinds
+    kind_indices = shape_arrays.get_kind_indices()
+    hashes = np.empty(len(kinds), dtype=np.uint64)
+
+    rectangles = shape_arrays.rectangles
+    closed_points = np.concatenate([_rectangle_polygon_points(rectangles), 2 * shape_arrays.polygon_points])
+    closed_offsets = np.concatenate(
+        [4 * np.arange(len(rectangles)), 4 * len(rectangles) + shape_arrays.polygon_offsets]
+    )
+    closed_hashes = _hash_point_sequences(
+        *_canonical_polygons(closed_points, closed_offsets), np.uint64(POLYGON_KIND)
+    )
+    is_rectangle = kinds == RECTANGLE_KIND
+    hashes[is_rectangle] = closed_hashes[kind_indices[is_rectangle]]
+    is_polygon = kinds == POLYGON_KIND
+    hashes[is_polygon] = closed_hashes[len(rectangles) + kind_indices[is_polygon]]
+
+    wire_points, wire_offsets = _canonical_wires(2 * shape_arrays.wire_points, shape_arrays.wire_offsets)
+    wire_hashes = _hash_point_sequences(
+        wire_points, wire_offsets, _mix(shape_arrays.wire_widths.view(np.uint64) + np.uint64(WIRE_KIND))
+    )
+    is_wire = kinds == WIRE_KIND
+    hashes[is_wire] = wire_hashes[kind_indices[is_wire]]
+    return hashes
+
+
+def _get_layers_by_alias(layout):
+    if isinstance(layout, str):
+        layout = load_cif(layout, array_backed=True)
+    layers = {}
+    for layer in layout:
+        if layer.layer_alias in layers:
+            raise ValueError(f"The layer alias {layer.layer_alias} is used more than once")
+        layers[layer.layer_alias] = layer
+    return layers
+
+
+def _get_shape_arrays(layer: CleWin_layer | None) -> CIF_shape_arrays:
+    return CIF_shape_arrays() if layer is None else layer.get_shape_arrays()
+
+
+def _compare_shapes(alias: str, old_arrays: CIF_shape_arrays, new_arrays: CIF_shape_arrays):
+    old_hashes = get_shape_hashes(old_arrays)
+    new_hashes = get_shape_hashes(new_arrays)
+    removed = _get_unmatched(old_hashes, new_hashes)
+    added = _get_unmatched(new_hashes, old_hashes)
+
+    old_centers = _get_centers(old_arrays, removed)
+    new_centers = _get_centers(new_arrays, added)
+    removed_keys = _location_keys(old_arrays, removed, old_centers)
+    added_keys = _location_keys(new_arrays, added, new_centers)
+    changed_removed, changed_added = _match_keys(removed_keys, added_keys)
+
+    is_removed = np.ones(len(removed), dtype=bool)
+    is_removed[changed_removed] = False
+    is_added = np.ones(len(added), dtype=bool)
+    is_added[changed_added] = False
+    removed_indices = removed[is_removed]
+    added_indices = added[is_added]
+    return CIF_layer_difference(
+        layer_alias=alias,
+        removed_indices=removed_indices,
+        added_indices=added_indices,
+        changed_indices=np.stack([removed[changed_removed], added[changed_added]], axis=1),
+        removed_shapes=old_arrays.take(removed_indices),
+        added_shapes=new_arrays.take(added_indices),
+        removed_locations=old_centers[is_removed] / 2,
+        added_locations=new_centers[is_added] / 2,
+        changed_locations=old_centers[changed_removed] / 2,
+    )
+
+
+def _compare_rasters(
+    alias: str,
+    old_arrays: CIF_shape_arrays,
+    new_arrays: CIF_shape_arrays,
+    pixel_size_nm: float,
+    polygon_samples: int,
+    tile_size_px: int,
+):
+    boxes = [box for box in (old_arrays.get_bounding_box(), new_arrays.get_bounding_box()) if box is not None]
+    differing_pixel_count = 0
+    locations = [np.zeros((0, 2))]
+    located_count = 0
+    if boxes:
+        window = (
+            min(box[0] for box in boxes),
+            min(box[1] for box in boxes),
+            max(box[2] for box in boxes),
+            max(box[3] for box in boxes),
+        )
+        old_tiles = iter_raster_tiles(
+            _as_layer(old_arrays), pixel_size_nm, window, tile_size_px, polygon_samples
+        )
+        new_tiles = iter_raster_tiles(
+            _as_layer(new_arrays), pixel_size_nm, window, tile_size_px, polygon_samples
+        )
+        for (column, row, old_coverage), (_, _, new_coverage) in zip(old_tiles, new_tiles):
+            rows, columns = np.nonzero((old_coverage > 0.5) != (new_coverage > 0.5))
+            differing_pixel_count += len(rows)
+            kept = min(len(rows), DIFF_MAX_RASTER_LOCATIONS - located_count)
+            if kept > 0:
+                locations.append(
+                    np.stack(
+                        [
+                            window[0] + (column + columns[:kept] + 0.5) * pixel_size_nm,
+                            window[1] + (row + rows[:kept] + 0.5) * pixel_size_nm,
+                        ],
+                        axis=1,
+                    )
+                )
+                located_count += kept
+    return CIF_layer_difference(
+        layer_alias=alias,
+        differing_pixel_count=differing_pixel_count,
+        differing_pixel_locations=np.concatenate(locations),
+        pixel_size_nm=pixel_size_nm,
+    )
+
+
+def _as_layer(shape_arrays: CIF_shape_arrays) -> CleWin_layer:
+    layer = CleWin_layer("", "", 0, None, None, array_backed=True)
+    layer.shape_arrays = shape_arrays
+    return layer
+
+
+def _get_unmatched(hashes: np.ndarray, other_hashes: np.ndarray) -> np.ndarray:
+    """
+    Returns the sorted indices of the hashes that have no counterpart in other_hashes,
+    where a hash occurring n times in other_hashes matches its first n occurrences in hashes
+    """
+    order = np.argsort(hashes, kind="stable")
+    sorted_hashes = hashes[order]
+    ranks = np.arange(len(hashes)) - np.searchsorted(sorted_hashes, sorted_hashes, side="left")
+    sorted_other = np.sort(other_hashes)
+    other_counts = np.searchsorted(sorted_other, sorted_hashes, side="right") - np.searchsorted(
+        sorted_other, sorted_hashes, side="left"
+    )
+    return np.sort(order[ranks >= other_counts])
+
+
+def _match_keys(keys: np.ndarray, other_keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Pairs up equal keys one to one in order of occurrence.
+    Returns the positions of the paired keys in keys and in other_keys.
+    """
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    ranks = np.arange(len(keys)) - np.searchsorted(sorted_keys, sorted_keys, side="left")
+    other_order = np.argsort(other_keys, kind="stable")
+    sorted_other = other_keys[other_order]
+    first = np.searchsorted(sorted_other, sorted_keys, side="left")
+    last = np.searchsorted(sorted_other, sorted_keys, side="right")
+    is_paired = first + ranks < last
+    return order[is_paired], other_order[first[is_paired] + ranks[is_paired]]
+
+
+def _get_centers(shape_arrays: CIF_shape_arrays, indices: np.ndarray) -> np.ndarray:
+    """Returns twice the bounding box centers of the shapes as an (n, 2) int64 array"""
+    if len(indices) == 0:
+        return np.zeros((0, 2), dtype=np.int64)
+    boxes = shape_arrays.get_shape_bounding_boxes()[indices]
+    return np.rint(boxes[:, :2] + boxes[:, 2:]).astype(np.int64)
+
+
+def _location_keys(shape_arrays: CIF_shape_arrays, indices: np.ndarray, centers: np.ndarray) -> np.ndarray:
+    is_wire = (shape_arrays.kinds[indices] == WIRE_KIND).astype(np.uint64)
+    return _mix(_mix(_mix(is_wire) + centers[:, 0].view(np.uint64)) + centers[:, 1].view(np.uint64))
+
+
+def _rectangle_polygon_points(rectangles: np.ndarray) -> np.ndarray:
+    """Returns twice the corners of the rectangles in counter-clockwise order from the lower left corner"""
+    sizes, centers = rectangles[:, :2], 2 * rectangles[:, 2:]
+    lower, upper = centers - sizes, centers + sizes
+    corners = np.stack(
+        [
+            lower,
+            np.stack([upper[:, 0], lower[:, 1]], axis=1),
+            upper,
+            np.stack([lower[:, 0], upper[:, 1]], axis=1),
+        ],
+        axis=1,
+    )
+    return corners.reshape(-1, 2)
+
+
+def _canonical_polygons(points: np.ndarray, offsets: np.ndarray):
+    """
+    Removes repeated and collinear vertices, orients the polygons counter-clockwise and lets
+    them start at their lowest-left vertex. Returns the new points and offsets.
+    """
+    points, offsets = _remove_repeated_points(points, offsets, closed=True)
+    while True:
+        previous, following = _neighbor_indices(offsets, closed=True)
+        is_collinear = _cross(points - points[previous], points[following] - points) == 0
+        # Polygons without area keep their points, so they are not reduced to nothing
+        counts = np.diff(offsets)
+        shape_ids = np.repeat(np.arange(len(counts)), counts)
+        remaining = counts - np.bincount(shape_ids[is_collinear], minlength=len(counts))
+        is_collinear &= (remaining >= 3)[shape_ids]
+        if not np.any(is_collinear):
+            break
+        points, offsets = _remove_repeated_points(
+            points[~is_collinear],
+            _offsets_from_counts(np.bincount(shape_ids[~is_collinear], minlength=len(counts))),
+            closed=True,
+        )
+
+    counts = np.diff(offsets)
+    starts = offsets[:-1]
+    shape_ids = np.repeat(np.arange(len(counts)), counts)
+    positions = np.arange(len(points)) - starts[shape_ids]
+
+    # Twice the signed area relative to the first vertex, which is negative for clockwise polygons
+    _, following = _neighbor_indices(offsets, closed=True)
+    relative = (points - points[starts[shape_ids]]).astype(np.float64)
+    area_terms = _cross(relative, relative[following])
+    signed_areas = np.bincount(shape_ids, weights=area_terms, minlength=len(counts))
+    is_clockwise = (signed_areas < 0)[shape_ids]
+    positions = np.where(is_clockwise, counts[shape_ids] - 1 - positions, positions)
+    points = points[starts[shape_ids] + positions]
+
+    # Start at the lowest-left vertex, using the following vertex to break ties of repeated vertices
+    _, following = _neighbor_indices(offsets, closed=True)
+    has_points = counts > 0
+    is_first = np.ones(len(points), dtype=bool)
+    for values in (points[:, 0], points[:, 1], points[following, 0], points[following, 1]):
+        values = np.where(is_first, values, np.iinfo(np.int64).max)
+        is_first &= values == _group_minimum(values, offsets, has_points)[shape_ids]
+    positions = np.arange(len(points)) - starts[shape_ids]
+    first_positions = _group_minimum(np.where(is_first, positions, len(points)), offsets, has_points)
+    rotated = (positions + first_positions[shape_ids]) % np.maximum(counts[shape_ids], 1)
+    return points[starts[shape_ids] + rotated], offsets
+
+
+def _canonical_wires(points: np.ndarray, offsets: np.ndarray):
+    """
+    Removes repeated points and points where a wire continues straight on, and lets every wire
+    run from its lower-left end. Returns the new points and offsets.
+    """
+    points, offsets = _remove_repeated_points(points, offsets, closed=False)
+    while True:
+        previous, following = _neighbor_indices(offsets, closed=False)
+        incoming, outgoing = points - points[previous], points[following] - points
+        is_straight = (
+            (_cross(incoming, outgoing) == 0)
+            & (np.sum(incoming * outgoing, axis=1) > 0)
+            & (previous != np.arange(len(points)))
+            & (following != np.arange(len(points)))
+        )
+        if not np.any(is_straight):
+            break
+        counts = np.diff(offsets)
+        shape_ids = np.repeat(np.arange(len(counts)), counts)
+        points = points[~is_straight]
+        offsets = _offsets_from_counts(np.bincount(shape_ids[~is_straight], minlength=len(counts)))
+
+    counts = np.diff(offsets)
+    starts = offsets[:-1]
+    shape_ids = np.repeat(np.arange(len(counts)), counts)
+    positions = np.arange(len(points)) - starts[shape_ids]
+    has_points = counts > 0
+    firsts, lasts = points[starts[has_points]], points[offsets[1:][has_points] - 1]
+    is_reversed = np.zeros(len(counts), dtype=bool)
+    is_reversed[has_points] = (lasts[:, 0] < firsts[:, 0]) | (
+        (lasts[:, 0] == firsts[:, 0]) & (lasts[:, 1] < firsts[:, 1])
+    )
+    positions = np.where(is_reversed[shape_ids], counts[shape_ids] - 1 - positions, positions)
+    return points[starts[shape_ids] + positions], offsets
+
+
+def _group_minimum(values: np.ndarray, offsets: np.ndarray, has_points: np.ndarray) -> np.ndarray:
+    """Returns the minimum of values[offsets[n]:offsets[n + 1]] for every shape n, and 0 for shapes without points"""
+    minimums = np.zeros(len(has_points), dtype=values.dtype)
+    if np.any(has_points):
+        minimums[has_points] = np.minimum.reduceat(values, offsets[:-1][has_points])
+    return minimums
+
+
+def _neighbor_indices(offsets: np.ndarray, closed: bool):
+    """
+    Returns the index of the previous and the following point of every point. For closed shapes, the first and
+    last points are neighbors, for open shapes the end points are their own neighbors on the outside.
+    """
+    counts = np.diff(offsets)
+    shape_ids = np.repeat(np.arange(len(counts)), counts)
+    indices = np.arange(offsets[-1])
+    starts, ends = offsets[:-1][shape_ids], offsets[1:][shape_ids] - 1
+    previous, following = indices - 1, indices + 1
+    is_first, is_last = indices == starts, indices == ends
+    previous[is_first] = ends[is_first] if closed else indices[is_first]
+    following[is_last] = starts[is_last] if closed else indices[is_last]
+    return previous, following
+
+
+def _cross(u: np.ndarray, v: np.ndarray) -> np.ndarray:
+    return u[:, 0] * v[:, 1] - u[:, 1] * v[:, 0]
+
+
+def _mix(values: np.ndarray) -> np.ndarray:
+    """The splitmix64 finalizer, which maps uint64 values to well-distributed uint64 values"""
+    values = values ^ (values >> _MIX_SHIFTS[0])
+    values = values * _MIX_MULTIPLIERS[0]
+    values = values ^ (values >> _MIX_SHIFTS[1])
+    values = values * _MIX_MULTIPLIERS[1]
+    return values ^ (values >> _MIX_SHIFTS[2])
+
+
+def _hash_point_sequences(points: np.ndarray, offsets: np.ndarray, seeds) -> np.ndarray:
+    """
+    Hashes every point sequence points[offsets[n]:offsets[n + 1]] together with its seed.
+    Every point is hashed with its position, and the sum of the point hashes is mixed with the seed and count.
+    """
+    counts = np.diff(offsets)
+    shape_ids = np.repeat(np.arange(len(counts)), counts)
+    positions = (np.arange(len(points)) - offsets[:-1][shape_ids]).astype(np.uint64)
+    coordinates = np.ascontiguousarray(points, dtype=np.int64).view(np.uint64)
+    with np.errstate(over="ignore"):
+        point_hashes = _mix(_mix(_mix(coordinates[:, 0] + _HASH_INCREMENT) + coordinates[:, 1]) + positions)
+        sums = np.concatenate([np.zeros(1, dtype=np.uint64), np.cumsum(point_hashes, dtype=np.uint64)])
+        sequence_sums = sums[offsets[1:]] - sums[offsets[:-1]]
+        return _mix(_mix(sequence_sums + seeds) + counts.astype(np.uint64))
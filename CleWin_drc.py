@@ -0,0 +1,653 @@
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
+import numpy as np
+
+from CleWin_cif_creator import (
+    CleWin_layer,
+    CIF_shape_arrays,
+    CIF_spatial_index,
+    RECTANGLE_KIND,
+    POLYGON_KIND,
+    WIRE_KIND,
+    _offsets_from_counts,
+    _rectangle_corners,
+)
+
+# The number of segment pairs compared at a time, which bounds the memory use of a check
+DRC_SEGMENT_PAIRS_PER_CHUNK = 1 << 22
+
+# Polygons with more vertices only compare pairs of edges that are close to each other in their width check
+DRC_ALL_EDGE_PAIRS_MAX_VERTICES = 64
+
+
+class DRC_violation:
+    def __init__(
+        self,
+        rule: str,
+        layer_alias: str,
+        x_nm: float,
+        y_nm: float,
+        value_nm: float | None,
+        limit_nm: float,
+        shape_indices: Tuple[int, ...],
+        other_layer_alias: str = None,
+    ):
+        """
+        A design rule violation.
+
+        Args:
+        -----
+        rule: str
+            "min_width", "min_spacing" or "enclosure"
+        layer_alias: str
+            The alias of the layer with the violating shapes. For enclosure, this is the enclosed layer.
+        x_nm, y_nm: float
+            The location of the violation
+        value_nm: float | None
+            The measured width, spacing or enclosure. None if no shape of the enclosing layer contains the shape.
+        limit_nm: float
+            The limit of the rule
+        shape_indices: Tuple[int, ...]
+            The indices of the violating shapes in their layers
+        other_layer_alias: str
+            For enclosure, the alias of the enclosing layer
+        """
+        self.rule = rule
+        self.layer_alias = layer_alias
+        self.x_nm = x_nm
+        self.y_nm = y_nm
+        self.value_nm = value_nm
+        self.limit_nm = limit_nm
+        self.shape_indices = shape_indices
+        self.other_layer_alias = other_layer_alias
+
+    def __repr__(self):
+        layers = self.layer_alias
+        if self.other_layer_alias is not None:
+            layers = f"{layers} in {self.other_layer_alias}"
+        return (
+            f"DRC_violation({self.rule} on {layers} at ({self.x_nm:g}, {self.y_nm:g}): "
+            f"{self.value_nm} < {self.limit_nm}, shapes {self.shape_indices})"
+        )
+
+
+def run_drc(
+    layers: List[CleWin_layer],
+    min_widths: Dict[str, float] = None,
+    min_spacings: Dict[str, float] = None,
+    enclosures: Dict[Tuple[str, str], float] = None,
+    processes: int = 1,
+) -> List[DRC_violation]:
+    """
+    Runs a set of design rules on layers.
+
+    Args:
+    -----
+    layers: List[CleWin_layer]
+        The layers to check
+    min_widths: Dict[str, float]
+        The minimum width in nm per layer alias
+    min_spacings: Dict[str, float]
+        The minimum spacing in nm per layer alias
+    enclosures: Dict[Tuple[str, str], float]
+        The minimum enclosure in nm per (inner layer alias, outer layer alias),
+        e.g. {("L1", "L0"): 2000} for metalization on L1 inside etch on L0
+    processes: int
+        The number of worker processes used for spacing and enclosure checks
+
+    Returns:
+    --------
+    violations: List[DRC_violation]
+        All violations, ordered by rule
+    """
+    layers_by_alias = {layer.layer_alias: layer for layer in layers}
+    violations = []
+    for alias, min_width_nm in (min_widths or {}).items():
+        violations.extend(check_min_width(layers_by_alias[alias], min_width_nm))
+    for alias, min_spacing_nm in (min_spacings or {}).items():
+        violations.extend(
+            check_min_spacing(layers_by_alias[alias], min_spacing_nm, processes=processes)
+        )
+    for (inner_alias, outer_alias), enclosure_nm in (enclosures or {}).items():
+        violations.extend(
+            check_enclosure(
+                layers_by_alias[inner_alias],
+                layers_by_alias[outer_alias],
+                enclosure_nm,
+                processes=processes,
+            )
+        )
+    return violations
+
+
+def check_min_width(layer: CleWin_layer, min_width_nm: float) -> List[DRC_violation]:
+    """
+    Finds shapes narrower than min_width_nm. Rectangles are checked by their smallest side and wires by
+    their width. For polygons, the width is the smallest distance between two non-adjacent edges that face
+    each other across the inside of the polygon.
+    """
+    shape_arrays = layer.get_shape_arrays()
+    kinds = shape_arrays.kinds
+    violations = []
+
+    rectangles = shape_arrays.rectangles
+    widths = rectangles[:, :2].min(axis=1)
+    for kind_index in np.flatnonzero(widths < min_width_nm).tolist():
+        x_size, y_size, x_center, y_center = rectangles[kind_index].tolist()
+        violations.append((kind_index, RECTANGLE_KIND, x_center, y_center, min(x_size, y_size)))
+
+    wire_widths = shape_arrays.wire_widths
+    wire_points, wire_offsets = shape_arrays.wire_points, shape_arrays.wire_offsets
+    for kind_index in np.flatnonzero(wire_widths < min_width_nm).tolist():
+        x, y = wire_points[wire_offsets[kind_index]].tolist()
+        violations.append((kind_index, WIRE_KIND, x, y, wire_widths[kind_index].item()))
+
+    for kind_index, x, y, width in _polygon_widths(
+        shape_arrays.polygon_points, shape_arrays.polygon_offsets, min_width_nm
+    ):
+        violations.append((kind_index, POLYGON_KIND, x, y, width))
+
+    # Report the shapes by their index in the layer
+    shape_indices = {
+        kind: np.flatnonzero(kinds == kind) for kind in (RECTANGLE_KIND, POLYGON_KIND, WIRE_KIND)
+    }
+    return [
+        DRC_violation(
+            rule="min_width",
+            layer_alias=layer.layer_alias,
+            x_nm=x,
+            y_nm=y,
+            value_nm=width,
+            limit_nm=min_width_nm,
+            shape_indices=(int(shape_indices[kind][kind_index]),),
+        )
+        for kind_index, kind, x, y, width in violations
+    ]
+
+
+def check_min_spacing(
+    layer: CleWin_layer, min_spacing_nm: float, processes: int = 1
+) -> List[DRC_violation]:
+    """
+    Finds pairs of shapes in a layer that are closer than min_spacing_nm. Shapes that touch, overlap or
+    contain each other form one structure and are not checked against each other.
+    Candidate pairs are found with a spatial index over the bounding boxes grown by half the spacing,
+    and the distances between their edges are computed in bulk.
+
+    Args:
+    -----
+    layer: CleWin_layer
+        The layer to check
+    min_spacing_nm: float
+        The minimum distance between shapes in nm
+    processes: int
+        The number of worker processes. Candidate pairs are split into region tiles that are checked in parallel.
+    """
+    shape_arrays = layer.get_shape_arrays()
+    boxes = shape_arrays.get_shape_bounding_boxes()
+    margin = np.array([-1, -1, 1, 1]) * min_spacing_nm / 2
+    pairs = CIF_spatial_index(boxes + margin).get_overlapping_pairs()
+
+    distances = _map_pair_chunks(_spacing_distances, shape_arrays, shape_arrays, pairs, boxes, processes)
+    is_violation = (distances > 0) & (distances < min_spacing_nm)
+
+    violations = []
+    for (first, second), distance in zip(pairs[is_violation].tolist(), distances[is_violation].tolist()):
+        x, y = _gap_center(boxes[first], boxes[second])
+        violations.append(
+            DRC_violation(
+                rule="min_spacing",
+                layer_alias=layer.layer_alias,
+                x_nm=x,
+                y_nm=y,
+                value_nm=distance,
+                limit_nm=min_spacing_nm,
+                shape_indices=(first, second),
+            )
+        )
+    return violations
+
+
+def check_enclosure(
+    inner_layer: CleWin_layer,
+    outer_layer: CleWin_layer,
+    enclosure_nm: float,
+    processes: int = 1,
+) -> List[DRC_violation]:
+    """
+    Finds shapes of inner_layer that are not inside a single shape of outer_layer with at least enclosure_nm
+    between their edges, e.g. metalization that must lie inside an etched area.
+    Inside a wire, the points of the inner shape are checked against the width of the wire.
+
+    Args:
+    -----
+    inner_layer: CleWin_layer
+        The layer with the enclosed shapes
+    outer_layer: CleWin_layer
+        The layer with the enclosing shapes
+    enclosure_nm: float
+        The minimum distance between the edges of the inner and the outer shape in nm
+    processes: int
+        The number of worker processes. Candidate pairs are split into region tiles that are checked in parallel.
+    """
+    inner_arrays = inner_layer.get_shape_arrays()
+    outer_arrays = outer_layer.get_shape_arrays()
+    inner_boxes = inner_arrays.get_shape_bounding_boxes()
+    outer_boxes = outer_arrays.get_shape_bounding_boxes()
+
+    # Pairs of an inner shape, grown by the enclosure, and an outer shape in one index
+    margin = np.array([-1, -1, 1, 1]) * enclosure_nm
+    inner_count = len(inner_boxes)
+    pairs = CIF_spatial_index(
+        np.concatenate([inner_boxes + margin, outer_boxes])
+    ).get_overlapping_pairs()
+    pairs = pairs[(pairs[:, 0] < inner_count) & (pairs[:, 1] >= inner_count)]
+    pairs[:, 1] -= inner_count
+
+    margins = _map_pair_chunks(_enclosure_margins, inner_arrays, outer_arrays, pairs, inner_boxes, processes)
+    best_margins = np.full(inner_count, -np.inf)
+    np.maximum.at(best_margins, pairs[:, 0], margins)
+
+    violations = []
+    for inner in np.flatnonzero(best_margins < enclosure_nm).tolist():
+        x_min, y_min, x_max, y_max = inner_boxes[inner].tolist()
+        best_margin = best_margins[inner]
+        violations.append(
+            DRC_violation(
+                rule="enclosure",
+                layer_alias=inner_layer.layer_alias,
+                x_nm=(x_min + x_max) / 2,
+                y_nm=(y_min + y_max) / 2,
+                value_nm=float(best_margin) if np.isfinite(best_margin) else None,
+                limit_nm=enclosure_nm,
+                shape_indices=(inner,),
+                other_layer_alias=outer_layer.layer_alias,
+            )
+        )
+    return violations
+
+
+class _Segment_table:
+    def __init__(self, shape_arrays: CIF_shape_arrays):
+        """
+        The outline of every shape as line segments with a radius, grouped by shape in insertion order.
+        Rectangles and polygons are closed outlines with radius 0, and wires are their centerline
+        segments with half the wire width as radius.
+        """
+        kinds = shape_arrays.kinds
+        segment_shapes, starts, ends, radii = [], [], [], []
+
+        corners = _rectangle_corners(shape_arrays.rectangles)
+        segment_shapes.append(np.repeat(np.flatnonzero(kinds == RECTANGLE_KIND), 4))
+        starts.append(corners.reshape(-1, 2))
+        ends.append(np.roll(corners, -1, axis=1).reshape(-1, 2))
+        radii.append(np.zeros(4 * len(corners)))
+
+        points, offsets = shape_arrays.polygon_points, shape_arrays.polygon_offsets
+        counts = np.diff(offsets)
+        next_points = np.arange(1, len(points) + 1)
+        next_points[offsets[1:] - 1] = offsets[:-1]
+        segment_shapes.append(np.repeat(np.flatnonzero(kinds == POLYGON_KIND), counts))
+        starts.append(points)
+        ends.append(points[next_points])
+        radii.append(np.zeros(len(points)))
+
+        # A wire with a single point is a disc, stored as a segment of length 0
+        points, offsets = shape_arrays.wire_points, shape_arrays.wire_offsets
+        counts = np.diff(offsets)
+        is_single = np.zeros(len(points), dtype=bool)
+        is_single[offsets[:-1][counts == 1]] = True
+        is_start = np.ones(len(points), dtype=bool)
+        is_start[offsets[1:] - 1] = False
+        is_start |= is_single
+        first_points = np.flatnonzero(is_start)
+        segment_counts = np.maximum(counts - 1, 1)
+        segment_shapes.append(np.repeat(np.flatnonzero(kinds == WIRE_KIND), segment_counts))
+        starts.append(points[first_points])
+        ends.append(points[np.where(is_single[first_points], first_points, first_points + 1)])
+        radii.append(np.repeat(shape_arrays.wire_widths / 2, segment_counts))
+
+        segment_shapes = np.concatenate(segment_shapes)
+        order = np.argsort(segment_shapes, kind="stable")
+        self.starts = np.concatenate(starts).astype(np.float64)[order]
+        self.ends = np.concatenate(ends).astype(np.float64)[order]
+        self.radii = np.concatenate(radii)[order]
+        self.counts = np.bincount(segment_shapes, minlength=len(kinds))
+        self.offsets = _offsets_from_counts(self.counts)
+        self.is_closed = kinds != WIRE_KIND
+
+
+def _map_pair_chunks(function, shape_arrays_a, shape_arrays_b, pairs, boxes, processes: int):
+    """
+    Applies function(shape_arrays_a, shape_arrays_b, pairs) to the pairs and returns one value per pair.
+    With several processes, the pairs are sorted into region tiles by the location of their first shape,
+    and every worker gets only the shapes of its tiles.
+    """
+    if len(pairs) == 0:
+        return np.zeros(0)
+    if processes <= 1:
+        return function(shape_arrays_a, shape_arrays_b, pairs)
+
+    centers = (boxes[pairs[:, 0], :2] + boxes[pairs[:, 0], 2:]) / 2
+    tiles_per_side = int(np.ceil(np.sqrt(4 * processes)))
+    lower, upper = centers.min(axis=0), centers.max(axis=0)
+    tiles = np.clip(
+        ((centers - lower) / np.maximum(upper - lower, 1) * tiles_per_side).astype(np.int64),
+        0,
+        tiles_per_side - 1,
+    )
+    order = np.argsort(tiles[:, 1] * tiles_per_side + tiles[:, 0], kind="stable")
+    chunks = np.array_split(order, 4 * processes)
+
+    jobs = []
+    for chunk in chunks:
+        chunk_pairs = pairs[chunk]
+        shapes_a, local_a = np.unique(chunk_pairs[:, 0], return_inverse=True)
+        shapes_b, local_b = np.unique(chunk_pairs[:, 1], return_inverse=True)
+        jobs.append(
+            (
+                shape_arrays_a.take(shapes_a),
+                shape_arrays_b.take(shapes_b),
+                np.stack([local_a.ravel(), local_b.ravel()], axis=1),
+            )
+        )
+
+    values = np.empty(len(pairs))
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        for chunk, chunk_values in zip(chunks, executor.map(function, *zip(*jobs))):
+            values[chunk] = chunk_values
+    return values
+
+
+def _spacing_distances(shape_arrays_a, shape_arrays_b, pairs: np.ndarray) -> np.ndarray:
+    """Returns the distance between the shapes of every pair, which is 0 if they touch or one contains the other"""
+    distances = np.empty(len(pairs))
+    kinds_a = shape_arrays_a.kinds[pairs[:, 0]]
+    kinds_b = shape_arrays_b.kinds[pairs[:, 1]]
+
+    # Rectangles are axis-aligned, so their distance follows from the gaps between their edges
+    is_box_pair = (kinds_a == RECTANGLE_KIND) & (kinds_b == RECTANGLE_KIND)
+    boxes_a = shape_arrays_a.get_shape_bounding_boxes()[pairs[is_box_pair, 0]]
+    boxes_b = shape_arrays_b.get_shape_bounding_boxes()[pairs[is_box_pair, 1]]
+    gaps = np.maximum(
+        np.maximum(boxes_a[:, :2] - boxes_b[:, 2:], boxes_b[:, :2] - boxes_a[:, 2:]), 0
+    )
+    distances[is_box_pair] = np.hypot(gaps[:, 0], gaps[:, 1])
+
+    other_pairs = np.flatnonzero(~is_box_pair)
+    if len(other_pairs):
+        table_a = _Segment_table(shape_arrays_a)
+        table_b = table_a if shape_arrays_b is shape_arrays_a else _Segment_table(shape_arrays_b)
+        for chunk in _pair_chunks(table_a, table_b, pairs[other_pairs]):
+            rows = _Segment_pairs(table_a, table_b, pairs[other_pairs[chunk]])
+            chunk_distances = rows.min_per_pair(
+                _segment_distances(
+                    table_a.starts[rows.segments_a],
+                    table_a.ends[rows.segments_a],
+                    table_b.starts[rows.segments_b],
+                    table_b.ends[rows.segments_b],
+                )
+                - table_a.radii[rows.segments_a]
+                - table_b.radii[rows.segments_b]
+            )
+            is_contained = rows.is_point_inside(table_a, table_b) | rows.is_point_inside(
+                table_a, table_b, reverse=True
+            )
+            distances[other_pairs[chunk]] = np.where(is_contained, 0, np.maximum(chunk_distances, 0))
+    return distances
+
+
+def _enclosure_margins(inner_arrays, outer_arrays, pairs: np.ndarray) -> np.ndarray:
+    """
+    Returns, for every (inner, outer) pair, the distance between the edges of the inner shape and the edges
+    of the outer shape if the inner shape is inside, and -inf otherwise
+    """
+    margins = np.empty(len(pairs))
+    kinds_a = inner_arrays.kinds[pairs[:, 0]]
+    kinds_b = outer_arrays.kinds[pairs[:, 1]]
+
+    # A rectangle inside a rectangle is enclosed by the smallest distance between their sides
+    is_box_pair = (kinds_a == RECTANGLE_KIND) & (kinds_b == RECTANGLE_KIND)
+    boxes_a = inner_arrays.get_shape_bounding_boxes()[pairs[is_box_pair, 0]]
+    boxes_b = outer_arrays.get_shape_bounding_boxes()[pairs[is_box_pair, 1]]
+    side_margins = np.concatenate([boxes_a[:, :2] - boxes_b[:, :2], boxes_b[:, 2:] - boxes_a[:, 2:]], axis=1)
+    box_margins = side_margins.min(axis=1)
+    margins[is_box_pair] = np.where(box_margins >= 0, box_margins, -np.inf)
+
+    other_pairs = np.flatnonzero(~is_box_pair)
+    if len(other_pairs) == 0:
+        return margins
+    table_a = _Segment_table(inner_arrays)
+    table_b = _Segment_table(outer_arrays)
+    for chunk in _pair_chunks(table_a, table_b, pairs[other_pairs]):
+        chunk = other_pairs[chunk]
+        rows = _Segment_pairs(table_a, table_b, pairs[chunk])
+        starts_a, ends_a = table_a.starts[rows.segments_a], table_a.ends[rows.segments_a]
+        starts_b, ends_b = table_b.starts[rows.segments_b], table_b.ends[rows.segments_b]
+        radii_a, radii_b = table_a.radii[rows.segments_a], table_b.radii[rows.segments_b]
+
+        # Closed outer shapes: the edges must not come closer than the margin
+        edge_margins = rows.min_per_pair(
+            _segment_distances(starts_a, ends_a, starts_b, ends_b) - radii_a
+        )
+        is_inside = rows.is_point_inside(table_a, table_b)
+
+        # Outer wires: every point of the inner shape must be within the width of the wire
+        point_distances = np.maximum(
+            _point_segment_distances(starts_a, starts_b, ends_b),
+            _point_segment_distances(ends_a, starts_b, ends_b),
+        )
+        wire_margins = -rows.max_per_pair(
+            rows.min_per_segment_a(point_distances + radii_a - radii_b)
+        )
+
+        is_closed = table_b.is_closed[pairs[chunk, 1]]
+        chunk_margins = np.where(is_closed, edge_margins, wire_margins)
+        is_inside = np.where(is_closed, is_inside, wire_margins >= 0)
+        margins[chunk] = np.where(is_inside, chunk_margins, -np.inf)
+    return margins
+
+
+def _pair_chunks(table_a: _Segment_table, table_b: _Segment_table, pairs: np.ndarray):
+    """Splits the pairs into chunks of about DRC_SEGMENT_PAIRS_PER_CHUNK segment pairs"""
+    row_counts = table_a.counts[pairs[:, 0]] * table_b.counts[pairs[:, 1]]
+    chunk_ids = np.cumsum(row_counts) // DRC_SEGMENT_PAIRS_PER_CHUNK
+    bounds = np.flatnonzero(np.diff(chunk_ids)) + 1
+    return np.split(np.arange(len(pairs)), bounds)
+
+
+class _Segment_pairs:
+    def __init__(self, table_a: _Segment_table, table_b: _Segment_table, pairs: np.ndarray):
+        """All combinations of a segment of the first and a segment of the second shape of every pair"""
+        counts_a = table_a.counts[pairs[:, 0]]
+        counts_b = table_b.counts[pairs[:, 1]]
+        row_counts = counts_a * counts_b
+        self.pair_starts = _offsets_from_counts(row_counts)[:-1]
+        pair_ids = np.repeat(np.arange(len(pairs)), row_counts)
+        local = np.arange(row_counts.sum()) - self.pair_starts[pair_ids]
+        self.pair_ids = pair_ids
+        self.local_a = local // counts_b[pair_ids]
+        self.local_b = local % counts_b[pair_ids]
+        self.segments_a = table_a.offsets[pairs[:, 0]][pair_ids] + self.local_a
+        self.segments_b = table_b.offsets[pairs[:, 1]][pair_ids] + self.local_b
+        self.counts_a = counts_a
+        self.counts_b = counts_b
+        self.pairs = pairs
+
+    def min_per_pair(self, values: np.ndarray) -> np.ndarray:
+        return np.minimum.reduceat(values, self.pair_starts)
+
+    def max_per_pair(self, values: np.ndarray) -> np.ndarray:
+        """Maximum over values given per segment of the first shape"""
+        return np.maximum.reduceat(values, _offsets_from_counts(self.counts_a)[:-1])
+
+    def min_per_segment_a(self, values: np.ndarray) -> np.ndarray:
+        """Minimum over the segments of the second shape, for every segment of the first shape"""
+        return np.minimum.reduceat(values, np.flatnonzero(self.local_b == 0))
+
+    def is_point_inside(self, table_a, table_b, reverse: bool = False) -> np.ndarray:
+        """
+        Returns whether the first point of the first shape of every pair lies inside the second shape,
+        by counting crossings of a ray in the +x direction with the outline of the second shape.
+        With reverse, the roles of the shapes are swapped. Only closed shapes can contain points.
+        """
+        if reverse:
+            point_table, point_shapes = table_b, self.pairs[:, 1]
+            outline_table, outline_shapes = table_a, self.pairs[:, 0]
+            rows = self.local_b == 0
+            segments = self.segments_a[rows]
+        else:
+            point_table, point_shapes = table_a, self.pairs[:, 0]
+            outline_table, outline_shapes = table_b, self.pairs[:, 1]
+            rows = self.local_a == 0
+            segments = self.segments_b[rows]
+
+        pair_ids = self.pair_ids[rows]
+        points = point_table.starts[point_table.offsets[point_shapes]][pair_ids]
+        starts, ends = outline_table.starts[segments], outline_table.ends[segments]
+        is_crossing_row = (starts[:, 1] > points[:, 1]) != (ends[:, 1] > points[:, 1])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            crossing_x = starts[:, 0] + (points[:, 1] - starts[:, 1]) * (
+                ends[:, 0] - starts[:, 0]
+            ) / (ends[:, 1] - starts[:, 1])
+        is_crossing = is_crossing_row & (points[:, 0] < crossing_x)
+        crossings = np.bincount(pair_ids, weights=is_crossing, minlength=len(self.pairs))
+        return (crossings % 2 == 1) & outline_table.is_closed[outline_shapes]
+
+
+def _point_segment_distances(points: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    directions = ends - starts
+    lengths_squared = np.einsum("ij,ij->i", directions, directions)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = np.einsum("ij,ij->i", points - starts, directions) / lengths_squared
+    t = np.clip(np.nan_to_num(t), 0, 1)
+    closest = starts + t[:, None] * directions
+    return np.hypot(*(points - closest).T)
+
+
+def _segment_distances(starts_a, ends_a, starts_b, ends_b) -> np.ndarray:
+    """Returns the distance between every pair of segments, which is 0 for intersecting segments"""
+    distances = np.minimum(
+        np.minimum(
+            _point_segment_distances(starts_a, starts_b, ends_b),
+            _point_segment_distances(ends_a, starts_b, ends_b),
+        ),
+        np.minimum(
+            _point_segment_distances(starts_b, starts_a, ends_a),
+            _point_segment_distances(ends_b, starts_a, ends_a),
+        ),
+    )
+    side_a = _cross(ends_a - starts_a, starts_b - starts_a) * _cross(ends_a - starts_a, ends_b - starts_a)
+    side_b = _cross(ends_b - starts_b, starts_a - starts_b) * _cross(ends_b - starts_b, ends_a - starts_b)
+    distances[(side_a < 0) & (side_b < 0)] = 0
+    return distances
+
+
+def _cross(u: np.ndarray, v: np.ndarray) -> np.ndarray:
+    return u[:, 0] * v[:, 1] - u[:, 1] * v[:, 0]
+
+
+def _polygon_widths(points: np.ndarray, offsets: np.ndarray, min_width_nm: float):
+    """
+    Yields (polygon index, x, y, width) for every polygon narrower than min_width_nm, see _polygon_edge_pairs
+    for the pairs of edges that are compared.
+    """
+    points = points.astype(np.float64)
+    counts = np.diff(offsets)
+    next_points = np.arange(1, len(points) + 1)
+    next_points[offsets[1:] - 1] = offsets[:-1]
+    edges = points[next_points] - points
+    edge_polygons = np.repeat(np.arange(len(counts)), counts)
+    # Outward normals, using the orientation of each polygon from its signed area
+    signed_areas = np.add.reduceat(_cross(points, points[next_points]), offsets[:-1]) if len(points) else []
+    orientation = np.repeat(np.sign(signed_areas), counts)
+    normals = np.stack([edges[:, 1], -edges[:, 0]], axis=1) * orientation[:, None]
+    midpoints = (points + points[next_points]) / 2
+
+    # The narrowest pair of edges of each narrow polygon in every chunk of edge pairs
+    narrowest = []
+    for first, second in _polygon_edge_pairs(points, next_points, offsets, edge_polygons, min_width_nm):
+        # Only edges facing each other across the inside of the polygon measure its width
+        between = midpoints[second] - midpoints[first]
+        is_facing = (
+            (np.einsum("ij,ij->i", normals[first], normals[second]) < 0)
+            & (np.einsum("ij,ij->i", between, normals[first]) < 0)
+            & (np.einsum("ij,ij->i", between, normals[second]) > 0)
+        )
+        first, second = first[is_facing], second[is_facing]
+        widths = _segment_distances(
+            points[first], points[next_points[first]], points[second], points[next_points[second]]
+        )
+        is_narrow = widths < min_width_nm
+        narrowest.append(_narrowest_per_polygon(first[is_narrow], second[is_narrow], widths[is_narrow], edge_polygons))
+
+    if not narrowest:
+        return
+    first, second, widths = (np.concatenate(arrays) for arrays in zip(*narrowest))
+    first, second, widths = _narrowest_per_polygon(first, second, widths, edge_polygons)
+    for first_edge, second_edge, width in zip(first.tolist(), second.tolist(), widths.tolist()):
+        x, y = ((midpoints[first_edge] + midpoints[second_edge]) / 2).tolist()
+        yield int(edge_polygons[first_edge]), x, y, width
+
+
+def _narrowest_per_polygon(first: np.ndarray, second: np.ndarray, widths: np.ndarray, edge_polygons: np.ndarray):
+    """Keeps the narrowest of the pairs of edges of every polygon, sorted by polygon"""
+    polygon_ids = edge_polygons[first]
+    order = np.lexsort((widths, polygon_ids))
+    is_first_of_polygon = np.ones(len(order), dtype=bool)
+    is_first_of_polygon[1:] = polygon_ids[order][1:] != polygon_ids[order][:-1]
+    order = order[is_first_of_polygon]
+    return first[order], second[order], widths[order]
+
+
+def _polygon_edge_pairs(
+    points: np.ndarray, next_points: np.ndarray, offsets: np.ndarray, edge_polygons: np.ndarray, min_width_nm: float
+):
+    """
+    Yields the pairs of non-adjacent edges within each polygon that are compared for its width, as arrays of
+    (first, second) edge indices in chunks of at most about DRC_SEGMENT_PAIRS_PER_CHUNK pairs.
+
+    Polygons with at most DRC_ALL_EDGE_PAIRS_MAX_VERTICES vertices compare all pairs of their edges, in chunks of
+    polygons. In larger polygons, a CIF_spatial_index over the edges grown by half of min_width_nm finds the pairs
+    of edges that can be closer than min_width_nm, so memory grows with the number of close edges rather than
+    with the square of the number of vertices.
+    """
+    counts = np.diff(offsets)
+    is_small = counts <= DRC_ALL_EDGE_PAIRS_MAX_VERTICES
+
+    small_polygons = np.flatnonzero(is_small)
+    row_counts = counts[small_polygons] ** 2
+    chunk_ids = np.cumsum(row_counts) // DRC_SEGMENT_PAIRS_PER_CHUNK
+    for chunk in np.split(small_polygons, np.flatnonzero(np.diff(chunk_ids)) + 1):
+        chunk_counts = counts[chunk]
+        chunk_rows = chunk_counts**2
+        polygon_ids = np.repeat(chunk, chunk_rows)
+        local = np.arange(chunk_rows.sum()) - np.repeat(_offsets_from_counts(chunk_rows)[:-1], chunk_rows)
+        polygon_counts = counts[polygon_ids]
+        first_local, second_local = local // polygon_counts, local % polygon_counts
+        is_candidate = (second_local > first_local + 1) & ~(
+            (first_local == 0) & (second_local == polygon_counts - 1)
+        )
+        yield offsets[polygon_ids][is_candidate] + first_local[is_candidate], (
+            offsets[polygon_ids][is_candidate] + second_local[is_candidate]
+        )
+
+    large_edges = np.flatnonzero(~is_small[edge_polygons])
+    if len(large_edges) == 0 or min_width_nm <= 0:
+        return
+    starts, ends = points[large_edges], points[next_points[large_edges]]
+    boxes = np.concatenate(
+        [np.minimum(starts, ends) - min_width_nm / 2, np.maximum(starts, ends) + min_width_nm / 2], axis=1
+    )
+    pairs = large_edges[CIF_spatial_index(boxes).get_overlapping_pairs()]
+    first, second = pairs[:, 0], pairs[:, 1]
+    polygon_ids = edge_polygons[first]
+    first_local, second_local = first - offsets[polygon_ids], second - offsets[polygon_ids]
+    is_candidate = (
+        (edge_polygons[second] == polygon_ids)
+        & (second_local > first_local + 1)
+        & ~((first_local == 0) & (second_local == counts[polygon_ids] - 1))
+    )
+    first, second = first[is_candidate], second[is_candidate]
+    for start in range(0, len(first), DRC_SEGMENT_PAIRS_PER_CHUNK):
+        yield first[start : start + DRC_SEGMENT_PAIRS_PER_CHUNK], second[start : start + DRC_SEGMENT_PAIRS_PER_CHUNK]
@@ -0,0 +1,1031 @@
+import copy
+import datetime
+import mmap
+import os
+import re
+import struct
+from typing import Dict, List
+import numpy as np
+
+from CleWin_cif_creator import (
+    CleWin_color,
+    CleWin_layer,
+    CIF_shape_arrays,
+    CIF_symbol,
+    CIF_symbol_call,
+    CIF_transformation,
+    CIF_SHAPES_PER_CHUNK,
+    CIF_WRITE_BUFFER_SIZE,
+    RECTANGLE_KIND,
+    POLYGON_KIND,
+    WIRE_KIND,
+    flatten_symbol_calls,
+    _concatenate_points,
+    _count_vertices,
+    _convert_to_object_backed,
+    _offsets_from_counts,
+    _record_loaded_layers,
+    _select_ragged,
+)
+from CleWin_instrumentation import get_active_report, phase, _file_report
+
+# The largest number of points in one XY record, limited by the 16-bit record length.
+# Boundaries repeat their first point at the end, so they have at most GDS_MAX_POINTS - 1 vertices.
+GDS_MAX_POINTS = 8191
+
+# The name of the structure holding the shapes of the layers and the calls of the main symbol
+GDS_MAIN_STRUCTURE_NAME = "MainSymbol"
+
+# The colors of layers created by load_gds for layer numbers that have no template layer
+GDS_DEFAULT_FILL_COLOR = CleWin_color(0, 0, 255)
+GDS_DEFAULT_BORDER_COLOR = CleWin_color(0, 0, 255)
+
+# Record types, combined with the type of their data
+_HEADER = 0x0002
+_BGNLIB = 0x0102
+_LIBNAME = 0x0206
+_UNITS = 0x0305
+_ENDLIB = 0x0400
+_BGNSTR = 0x0502
+_STRNAME = 0x0606
+_ENDSTR = 0x0700
+_BOUNDARY = 0x0800
+_PATH = 0x0900
+_SREF = 0x0A00
+_AREF = 0x0B00
+_TEXT = 0x0C00
+_LAYER = 0x0D02
+_DATATYPE = 0x0E02
+_WIDTH = 0x0F03
+_XY = 0x1003
+_ENDEL = 0x1100
+_SNAME = 0x1206
+_COLROW = 0x1302
+_NODE = 0x1500
+_STRANS = 0x1A01
+_MAG = 0x1B05
+_ANGLE = 0x1C05
+_PATHTYPE = 0x2102
+_BOX = 0x2D00
+
+_RECORD_HEADER = struct.Struct(">HH")
+
+# The records of a boundary and of a path up to their XY data, as written by write_gds_to_file
+_BOUNDARY_RECORDS = struct.Struct(">HH HHh HHh HH")
+_PATH_RECORDS = struct.Struct(">HH HHh HHh HHh HHi HH")
+
+# The largest number of boundaries of the same size compared at once while loading
+_BOUNDARY_RUN_LENGTH = 1 << 16
+
+# STRANS flags: reflection about the x axis before rotating, and absolute magnification and angle
+_STRANS_REFLECTION = 0x8000
+_STRANS_ABSOLUTE = 0x0006
+
+# Round ends that extend half the width beyond the end points, like a CIF wire
+_ROUND_PATHTYPE = 1
+
+# Characters allowed in structure names
+_STRUCTURE_NAME_PATTERN = re.compile(r"[^A-Za-z0-9_?$]")
+_MAX_STRUCTURE_NAME_LENGTH = 32
+
+
+def write_to_gds(
+    filename,
+    layers: List[CleWin_layer],
+    calls: List[CIF_symbol_call] = None,
+    max_points: int = GDS_MAX_POINTS,
+    timestamp: datetime.datetime = None,
+):
+    """
+    Writes the layers to the GDSII file {filename}.gds, with the same content as write_to_cif.
+    The file is written in chunks of CIF_SHAPES_PER_CHUNK shapes, so memory use does not grow with the file.
+
+    Args:
+    -----
+    filename: str
+        The path of the file without the .gds extension
+    layers: List[CleWin_layer]
+        The layers to write
+    calls: List[CIF_symbol_call]
+        Symbols placed in the main symbol. Every symbol is written once as a structure.
+    max_points: int
+        The largest number of points written in one element, see write_gds_to_file
+    timestamp: datetime.datetime
+        The modification time stored in the file. Defaults to now.
+    """
+    with _file_report("write_to_gds", filename):
+        with open(f"{filename}.gds", mode="wb", buffering=CIF_WRITE_BUFFER_SIZE) as file:
+            write_gds_to_file(
+                file=file,
+                layers=layers,
+                calls=calls,
+                library_name=os.path.basename(str(filename)),
+                max_points=max_points,
+                timestamp=timestamp,
+            )
+            with phase("write"):
+                file.flush()
+
+
+def write_gds_to_file(
+    file,
+    layers: List[CleWin_layer],
+    calls: List[CIF_symbol_call] = None,
+    library_name: str = "CleWin",
+    max_points: int = GDS_MAX_POINTS,
+    timestamp: datetime.datetime = None,
+):
+    """
+    Streams the layers as a GDSII library to an open binary file handle.
+
+    The database unit is 1 nm and the user unit 1 micron. Every layer is written to the GDSII layer given by its
+    layer_index, with datatype 0. The layers of a symbol are matched to the layers by their alias, and
+    use their own layer_index if no layer has that alias. Rectangles and polygons are written as boundaries and
+    wires as paths with round ends. Rectangles with an odd size are moved down and to the left by half a nanometer,
+    since GDSII has no half nanometers.
+
+    Polygons with more than max_points - 1 vertices are cut into pieces along horizontal and vertical lines.
+    The pieces cover the same area, but may touch along the cuts. Wires with more than max_points points
+    are split into wires that share their end points. Elements are packed with NumPy, a run of shapes
+    of the same kind at a time.
+
+    Args:
+    -----
+    file: BinaryIO
+        A file handle opened for writing bytes
+    layers: List[CleWin_layer]
+        The layers to write
+    calls: List[CIF_symbol_call]
+        Symbols placed in the main symbol
+    library_name: str
+        The name of the library stored in the file
+    max_points: int
+        The largest number of points written in one element. Defaults to the limit of the GDSII format.
+        Some older tools only accept 200 or 600.
+    timestamp: datetime.datetime
+        The modification time stored in the file. Defaults to now.
+    """
+    if not 5 <= max_points <= GDS_MAX_POINTS:
+        raise ValueError(f"max_points must be between 5 and {GDS_MAX_POINTS}")
+    stream = _GDS_stream(file)
+    calls = [] if calls is None else calls
+    symbols = _symbols_in_definition_order(calls)
+    structure_names = _structure_names(symbols)
+    layer_numbers = {layer.layer_alias: layer.layer_index for layer in layers}
+    date = _pack_date(datetime.datetime.now() if timestamp is None else timestamp)
+
+    stream.write(
+        _record(_HEADER, struct.pack(">h", 600))
+        + _record(_BGNLIB, date * 2)
+        + _record(_LIBNAME, library_name.encode("ascii", "replace"))
+        + _record(_UNITS, _gds_real(1e-3) + _gds_real(1e-9))
+    )
+
+    for symbol in symbols:
+        stream.write(
+            _record(_BGNSTR, date * 2)
+            + _record(_STRNAME, structure_names[id(symbol)].encode("ascii"))
+        )
+        for layer in symbol.layers:
+            _write_layer_elements(
+                stream, layer, layer_numbers.get(layer.layer_alias, layer.layer_index), max_points
+            )
+        _write_calls(stream, symbol.calls, structure_names)
+        stream.write(_record(_ENDSTR))
+
+    stream.write(
+        _record(_BGNSTR, date * 2) + _record(_STRNAME, GDS_MAIN_STRUCTURE_NAME.encode("ascii"))
+    )
+    for layer in layers:
+        _write_layer_elements(stream, layer, layer.layer_index, max_points)
+    _write_calls(stream, calls, structure_names)
+    stream.write(_record(_ENDSTR) + _record(_ENDLIB))
+
+
+class _GDS_stream:
+    def __init__(self, file):
+        """
+        Writes bytes to a file, recording the time spent writing and the bytes written per layer
+        while instrumentation is enabled
+        """
+        self.file = file
+        self.report = get_active_report()
+
+    def write(self, data: bytes, layer_alias: str = None):
+        if self.report is None:
+            self.file.write(data)
+            return
+        with phase("write"):
+            self.file.write(data)
+        if layer_alias is None:
+            self.report.add("bytes_written", len(data))
+        else:
+            self.report.add_layer(layer_alias, bytes_written=len(data))
+
+
+def _write_layer_elements(stream: _GDS_stream, layer: CleWin_layer, layer_number: int, max_points: int):
+    layer_number = int(layer_number)
+    if not 0 <= layer_number <= 0x7FFF:
+        raise ValueError(f"Layer {layer.layer_alias} has index {layer_number}, which is not a GDSII layer number")
+    shape_count = layer.get_shape_count()
+    for start in range(0, shape_count, CIF_SHAPES_PER_CHUNK):
+        stop = min(start + CIF_SHAPES_PER_CHUNK, shape_count)
+        with phase("serialize"):
+            if layer.array_backed and layer.transformation.is_identity():
+                data = _pack_shape_range(layer.shape_arrays, start, stop, layer_number, max_points)
+            else:
+                chunk = layer._transformed(layer._get_stored_shape_arrays(start, stop))
+                data = _pack_shape_range(chunk, 0, stop - start, layer_number, max_points)
+        stream.write(data, layer.layer_alias)
+
+    if stream.report is not None:
+        stream.report.add_layer(
+            layer.layer_alias, shapes_written=shape_count, vertices_written=_count_vertices(layer)
+        )
+
+
+def _pack_shape_range(
+    shape_arrays: CIF_shape_arrays, start: int, stop: int, layer_number: int, max_points: int
+) -> bytes:
+    """Packs the shapes with insertion indices start to stop as GDSII elements, a run of shapes of one kind at a time"""
+    kinds = shape_arrays.kinds
+    kind_indices = shape_arrays.get_kind_indices()
+    run_starts = np.flatnonzero(np.diff(kinds[start:stop])) + 1 + start
+    run_bounds = [start, *run_starts.tolist(), stop]
+    parts = []
+    for run_start, run_stop in zip(run_bounds[:-1], run_bounds[1:]):
+        first = int(kind_indices[run_start])
+        last = first + run_stop - run_start
+        kind = kinds[run_start]
+        if kind == RECTANGLE_KIND:
+            parts.append(_pack_rectangles(shape_arrays.rectangles[first:last], layer_number))
+        elif kind == POLYGON_KIND:
+            offsets = shape_arrays.polygon_offsets[first : last + 1]
+            parts.append(
+                _pack_polygons(
+                    shape_arrays.polygon_points[offsets[0] : offsets[-1]],
+                    offsets - offsets[0],
+                    layer_number,
+                    max_points,
+                )
+            )
+        else:
+            offsets = shape_arrays.wire_offsets[first : last + 1]
+            parts.append(
+                _pack_wires(
+                    shape_arrays.wire_points[offsets[0] : offsets[-1]],
+                    offsets - offsets[0],
+                    shape_arrays.wire_widths[first:last],
+                    layer_number,
+                    max_points,
+                )
+            )
+    return b"".join(parts)
+
+
+def _pack_rectangles(rectangles: np.ndarray, layer_number: int) -> bytes:
+    """Packs (x_size, y_size, x_center, y_center) rectangles as boundaries of five points"""
+    lower = rectangles[:, 2:] - rectangles[:, :2] // 2
+    upper = lower + rectangles[:, :2]
+    rings = np.stack(
+        [
+            lower,
+            np.stack([upper[:, 0], lower[:, 1]], axis=1),
+            upper,
+            np.stack([lower[:, 0], upper[:, 1]], axis=1),
+            lower,
+        ],
+        axis=1,
+    )
+    return _pack_elements(
+        _boundary_prefix(layer_number), rings.reshape(-1, 2), np.full(len(rectangles), 5)
+    )
+
+
+def _pack_polygons(points: np.ndarray, offsets: np.ndarray, layer_number: int, max_points: int) -> bytes:
+    """Packs polygons as boundaries, repeating the first point of every polygon at its end"""
+    counts = np.diff(offsets)
+    too_long = counts >= max_points
+    if np.any(too_long):
+        points, offsets = _fracture_long_polygons(points, offsets, too_long, max_points - 1)
+        counts = np.diff(offsets)
+    ring_indices = _ragged_indices(offsets[:-1], counts + 1)
+    is_closing = ring_indices == np.repeat(offsets[1:], counts + 1)
+    ring_indices[is_closing] = np.repeat(offsets[:-1], counts + 1)[is_closing]
+    return _pack_elements(_boundary_prefix(layer_number), points[ring_indices], counts + 1)
+
+
+def _pack_wires(
+    points: np.ndarray, offsets: np.ndarray, widths: np.ndarray, layer_number: int, max_points: int
+) -> bytes:
+    """
+    Packs wires as paths with round ends. Wires with more than max_points points are split into several paths
+    that share their end points, and wires with a single point are written with the point twice.
+    """
+    counts = np.diff(offsets)
+    step = max_points - 1
+    pieces_per_wire = np.maximum(1, -(-(counts - 1) // step))
+    wire_of_piece = np.repeat(np.arange(len(counts)), pieces_per_wire)
+    piece_in_wire = np.arange(len(wire_of_piece)) - np.repeat(
+        _offsets_from_counts(pieces_per_wire)[:-1], pieces_per_wire
+    )
+    piece_starts = offsets[:-1][wire_of_piece] + piece_in_wire * step
+    piece_counts = np.maximum(2, np.minimum(max_points, counts[wire_of_piece] - piece_in_wire * step))
+    point_indices = np.minimum(
+        _ragged_indices(piece_starts, piece_counts),
+        np.repeat(offsets[1:][wire_of_piece] - 1, piece_counts),
+    )
+    widths = np.asarray(widths[wire_of_piece], dtype=">i4").view(np.uint16).reshape(-1, 2)
+    return _pack_elements(_path_prefix(layer_number), points[point_indices], piece_counts, widths)
+
+
+def _pack_elements(prefix: bytes, points: np.ndarray, counts: np.ndarray, varying: np.ndarray = None) -> bytes:
+    """
+    Packs elements that consist of the records in prefix, the data of a record that varies per element,
+    an XY record with the next counts[n] points and ENDEL. Everything is handled as 16-bit words,
+    so the coordinates are moved into place with one masked assignment.
+
+    Args:
+    -----
+    prefix: bytes
+        The records at the start of every element
+    points: np.ndarray
+        (N, 2) array with the points of all elements
+    counts: np.ndarray
+        The number of points of every element
+    varying: np.ndarray
+        (n, k) uint16 array with k words of big-endian data written after the prefix of every element
+    """
+    if len(points) and (points.min() < -(2**31) or points.max() >= 2**31):
+        raise ValueError("Coordinates do not fit in the 32-bit integers of GDSII")
+    counts = np.asarray(counts, dtype=np.int64)
+    element_count = len(counts)
+    if varying is None:
+        varying = np.zeros((element_count, 0), dtype=np.uint16)
+
+    xy_headers = np.empty((element_count, 2), dtype=">u2")
+    xy_headers[:, 0] = 4 + 8 * counts
+    xy_headers[:, 1] = _XY
+    prefix_words = np.frombuffer(prefix, dtype=np.uint16)
+    endel_words = np.frombuffer(_record(_ENDEL), dtype=np.uint16)
+    fixed = np.concatenate(
+        [
+            np.broadcast_to(prefix_words, (element_count, len(prefix_words))),
+            varying,
+            xy_headers.view(np.uint16),
+            np.broadcast_to(endel_words, (element_count, len(endel_words))),
+        ],
+        axis=1,
+    )
+
+    # Every point is two big-endian 32-bit integers, or four words
+    element_words = fixed.shape[1] + 4 * counts
+    element_starts = _offsets_from_counts(element_words)
+    coordinate_starts = element_starts[:-1] + fixed.shape[1] - len(endel_words)
+    steps = np.zeros(element_starts[-1] + 1, dtype=np.int8)
+    np.add.at(steps, coordinate_starts, 1)
+    np.add.at(steps, coordinate_starts + 4 * counts, -1)
+    is_coordinate = np.cumsum(steps[:-1], dtype=np.int8).astype(bool)
+
+    words = np.empty(element_starts[-1], dtype=np.uint16)
+    words[is_coordinate] = points.astype(">i4").view(np.uint16).ravel()
+    words[~is_coordinate] = fixed.ravel()
+    return words.tobytes()
+
+
+def _fracture_long_polygons(points: np.ndarray, offsets: np.ndarray, too_long: np.ndarray, max_vertices: int):
+    """Replaces the polygons marked too_long by pieces with at most max_vertices vertices"""
+    parts = []
+    counts = []
+    previous = 0
+    for index in np.flatnonzero(too_long).tolist():
+        parts.append(points[offsets[previous] : offsets[index]])
+        counts.extend(np.diff(offsets[previous : index + 1]).tolist())
+        for piece in _fracture_polygon(points[offsets[index] : offsets[index + 1]], max_vertices):
+            parts.append(piece)
+            counts.append(len(piece))
+        previous = index + 1
+    parts.append(points[offsets[previous] :])
+    counts.extend(np.diff(offsets[previous:]).tolist())
+    return _concatenate_points(parts), _offsets_from_counts(counts)
+
+
+def _fracture_polygon(points: np.ndarray, max_vertices: int) -> List[np.ndarray]:
+    """
+    Cuts a polygon into pieces with at most max_vertices vertices. Pieces that are too large are cut in two
+    along a line through their median vertex, across the longer side of their bounding box.
+    """
+    pieces = []
+    to_cut = [points]
+    while to_cut:
+        piece = to_cut.pop()
+        if len(piece) <= max_vertices:
+            pieces.append(piece)
+            continue
+        halves = _halve_polygon(piece)
+        if halves is None:
+            raise ValueError(f"Cannot cut a polygon with {len(points)} vertices into pieces of {max_vertices}")
+        to_cut.extend(half for half in reversed(halves) if len(half) >= 3)
+    return pieces
+
+
+def _halve_polygon(points: np.ndarray):
+    """Returns the two sides of a cut that leaves both sides with fewer vertices, or None if there is none"""
+    lower, upper = points.min(axis=0), points.max(axis=0)
+    longer_axis = int(upper[1] - lower[1] > upper[0] - lower[0])
+    for axis in (longer_axis, 1 - longer_axis):
+        values = points[:, axis]
+        median = int(np.partition(values, len(values) // 2)[len(values) // 2])
+        for coordinate in (median, (int(lower[axis]) + int(upper[axis])) // 2):
+            halves = [_clip_polygon(points, axis, coordinate, side) for side in (-1, 1)]
+            if max(len(half) for half in halves) < len(points):
+                return halves
+    return None
+
+
+def _clip_polygon(points: np.ndarray, axis: int, coordinate: int, side: int) -> np.ndarray:
+    """
+    Returns the part of a polygon on one side of the line where axis equals coordinate, including the line.
+    side is -1 for the part below the line and 1 for the part above it.
+    """
+    following = np.roll(points, -1, axis=0)
+    distances = (points[:, axis] - coordinate) * side
+    is_inside = distances >= 0
+    is_crossing = is_inside != np.roll(is_inside, -1)
+
+    # The crossing point is computed from the edge itself, so both sides of a cut round it the same way
+    other = 1 - axis
+    edges = following - points
+    crossings = np.empty_like(points)
+    crossings[:, axis] = coordinate
+    with np.errstate(divide="ignore", invalid="ignore"):
+        fractions = (coordinate - points[:, axis]) / edges[:, axis]
+    crossings[is_crossing, other] = points[is_crossing, other] + np.rint(
+        fractions[is_crossing] * edges[is_crossing, other]
+    ).astype(np.int64)
+
+    candidates = np.stack([points, crossings], axis=1)
+    clipped = candidates[np.stack([is_inside, is_crossing], axis=1)]
+    is_repeated = np.all(clipped == np.roll(clipped, 1, axis=0), axis=1)
+    return clipped[~is_repeated] if len(clipped) > 1 else clipped
+
+
+def _write_calls(stream: _GDS_stream, calls: List[CIF_symbol_call], structure_names: Dict[int, str]):
+    if not calls:
+        return
+    with phase("serialize"):
+        data = b"".join(_pack_call(call, structure_names[id(call.symbol)]) for call in calls)
+    stream.write(data)
+
+
+def _pack_call(call: CIF_symbol_call, structure_name: str) -> bytes:
+    """
+    Packs a call as an SREF. GDSII reflects about the x axis before rotating, and mirroring in the x direction
+    is the same as reflecting about the x axis and rotating by 180 degrees.
+    """
+    transformation = call.transformation
+    data = _record(_SREF) + _record(_SNAME, structure_name.encode("ascii"))
+    angle = (transformation.rotation_deg + (180 if transformation.mirror_x else 0)) % 360
+    if transformation.mirror_x or angle != 0:
+        data += _record(_STRANS, struct.pack(">H", _STRANS_REFLECTION if transformation.mirror_x else 0))
+        if angle != 0:
+            data += _record(_ANGLE, _gds_real(angle))
+    return (
+        data
+        + _record(_XY, struct.pack(">ii", int(transformation.x_shift_nm), int(transformation.y_shift_nm)))
+        + _record(_ENDEL)
+    )
+
+
+def _symbols_in_definition_order(calls: List[CIF_symbol_call]) -> List[CIF_symbol]:
+    """Returns every symbol reachable from the calls, with every symbol after the symbols it calls"""
+    ordered: Dict[int, CIF_symbol] = {}
+
+    def visit(symbol: CIF_symbol):
+        if id(symbol) in ordered:
+            return
+        for call in symbol.calls:
+            visit(call.symbol)
+        ordered[id(symbol)] = symbol
+
+    for call in calls:
+        visit(call.symbol)
+    return list(ordered.values())
+
+
+def _structure_names(symbols: List[CIF_symbol]) -> Dict[int, str]:
+    """Gives every symbol a unique structure name made of the characters allowed in GDSII"""
+    used_names = {GDS_MAIN_STRUCTURE_NAME}
+    structure_names = {}
+    for symbol in symbols:
+        base_name = _STRUCTURE_NAME_PATTERN.sub("_", symbol.symbol_name)[:_MAX_STRUCTURE_NAME_LENGTH] or "Symbol"
+        name = base_name
+        number = 1
+        while name in used_names:
+            number += 1
+            suffix = f"_{number}"
+            name = base_name[: _MAX_STRUCTURE_NAME_LENGTH - len(suffix)] + suffix
+        used_names.add(name)
+        structure_names[id(symbol)] = name
+    return structure_names
+
+
+def _boundary_prefix(layer_number: int) -> bytes:
+    return (
+        _record(_BOUNDARY)
+        + _record(_LAYER, struct.pack(">h", layer_number))
+        + _record(_DATATYPE, struct.pack(">h", 0))
+    )
+
+
+def _path_prefix(layer_number: int) -> bytes:
+    """The records of a path up to the data of its WIDTH record"""
+    return (
+        _record(_PATH)
+        + _record(_LAYER, struct.pack(">h", layer_number))
+        + _record(_DATATYPE, struct.pack(">h", 0))
+        + _record(_PATHTYPE, struct.pack(">h", _ROUND_PATHTYPE))
+        + _RECORD_HEADER.pack(8, _WIDTH)
+    )
+
+
+def _record(record_type: int, data: bytes = b"") -> bytes:
+    if len(data) % 2:
+        data += b"\0"
+    return _RECORD_HEADER.pack(4 + len(data), record_type) + data
+
+
+def _pack_date(timestamp: datetime.datetime) -> bytes:
+    return struct.pack(
+        ">6h",
+        timestamp.year,
+        timestamp.month,
+        timestamp.day,
+        timestamp.hour,
+        timestamp.minute,
+        timestamp.second,
+    )
+
+
+def _gds_real(value: float) -> bytes:
+    """Encodes an 8-byte GDSII real: a sign bit, a base 16 exponent in excess 64 and a 56-bit mantissa"""
+    if value == 0:
+        return bytes(8)
+    sign = 0x80 if value < 0 else 0
+    value = abs(value)
+    exponent = 64
+    while value >= 1:
+        value /= 16
+        exponent += 1
+    while value < 1 / 16:
+        value *= 16
+        exponent -= 1
+    mantissa = int(round(value * 2**56))
+    if mantissa == 2**56:
+        mantissa >>= 4
+        exponent += 1
+    return bytes([sign | exponent]) + mantissa.to_bytes(7, "big")
+
+
+def _gds_real_value(data: bytes) -> float:
+    sign = -1 if data[0] & 0x80 else 1
+    exponent = (data[0] & 0x7F) - 64
+    return sign * int.from_bytes(data[1:8], "big") / 2**56 * 16.0**exponent
+
+
+def _ragged_indices(starts: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """Returns the concatenated ranges starts[n]:starts[n] + counts[n]"""
+    return np.repeat(starts - _offsets_from_counts(counts)[:-1], counts) + np.arange(counts.sum())
+
+
+def load_gds(filename, layers: List[CleWin_layer] = None, array_backed: bool = False) -> List[CleWin_layer]:
+    """
+    Loads the layers of the GDSII file {filename}.gds.
+    Structures placed with references are flattened into the layers.
+
+    Args:
+    -----
+    filename: str
+        The path of the file without the .gds extension
+    layers: List[CleWin_layer]
+        Template layers, see load_gds_with_symbols
+    array_backed: bool
+        Whether the returned layers store their shapes in a CIF_shape_arrays
+
+    Returns:
+    --------
+    layers: List[CleWin_layer]
+        The layers with all their shapes
+    """
+    with _file_report("load_gds", filename):
+        loaded_layers, calls = _load_gds_file(f"{filename}.gds", layers)
+        with phase("flatten"):
+            flatten_symbol_calls(loaded_layers, calls)
+        if not array_backed:
+            with phase("convert"):
+                for layer in loaded_layers:
+                    _convert_to_object_backed(layer)
+        _record_loaded_layers(loaded_layers)
+    return loaded_layers
+
+
+def load_gds_with_symbols(filename, layers: List[CleWin_layer] = None, array_backed: bool = False):
+    """
+    Loads the GDSII file {filename}.gds while keeping its structures as symbols.
+
+    GDSII layers are matched to the template layers by their layer_index, and every returned layer is an empty
+    copy of its template with the shapes of the file. Layer numbers without a template get a layer with the alias
+    L{number}. Datatypes are ignored. Boundaries that are rectangles along the axes are loaded as rectangles,
+    other boundaries as polygons and paths as wires, whatever their path type. Arrays of references are loaded as
+    one call per placement, and text, boxes and nodes are skipped.
+
+    If the file has one structure that is not referenced by another, its shapes are loaded into the layers and its
+    references are returned as calls. Otherwise every unreferenced structure is returned as a call without
+    a transformation.
+
+    Args:
+    -----
+    filename: str
+        The path of the file without the .gds extension
+    layers: List[CleWin_layer]
+        Template layers giving the name, alias and colors of each layer number. All templates are returned,
+        also those without shapes in the file.
+    array_backed: bool
+        Whether the returned layers store their shapes in a CIF_shape_arrays
+
+    Returns:
+    --------
+    layers: List[CleWin_layer]
+        The layers with the shapes of the top structure
+    calls: List[CIF_symbol_call]
+        The symbols placed in the top structure
+    """
+    with _file_report("load_gds", filename):
+        loaded_layers, calls = _load_gds_file(f"{filename}.gds", layers)
+        if not array_backed:
+            with phase("convert"):
+                for layer in loaded_layers:
+                    _convert_to_object_backed(layer)
+                for symbol in {id(call.symbol): call.symbol for call in _iter_all_calls(calls)}.values():
+                    for layer in symbol.layers:
+                        _convert_to_object_backed(layer)
+        _record_loaded_layers(loaded_layers)
+    return loaded_layers, calls
+
+
+def _iter_all_calls(calls: List[CIF_symbol_call]):
+    visited = set()
+    to_visit = list(calls)
+    while to_visit:
+        call = to_visit.pop()
+        yield call
+        if id(call.symbol) not in visited:
+            visited.add(id(call.symbol))
+            to_visit.extend(call.symbol.calls)
+
+
+def _load_gds_file(path, layers: List[CleWin_layer] = None):
+    with open(path, mode="rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            raise ValueError(f"{path} is empty")
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer, phase("parse"):
+            return _GDS_parser(path, layers).parse(buffer)
+
+
+class _GDS_structure:
+    def __init__(self, name: str):
+        """The elements of a structure, with the position of their XY data in the file"""
+        self.name = name
+        self.element_types: List[int] = []
+        self.layer_numbers: List[int] = []
+        self.widths: List[int] = []
+        self.data_offsets: List[int] = []
+        self.point_counts: List[int] = []
+        # (structure name, transformation, positions) of every SREF and AREF
+        self.references: List[tuple] = []
+        self.shape_arrays: Dict[int, CIF_shape_arrays] = {}
+
+
+class _GDS_parser:
+    def __init__(self, path, layers: List[CleWin_layer] = None):
+        """
+        Parses a GDSII file in one pass over its records. The positions of the XY data of all boundaries and paths
+        of a structure are collected, and their coordinates are read in bulk when the structure ends.
+        """
+        self.path = path
+        self.templates = {} if layers is None else {int(layer.layer_index): layer for layer in layers}
+        self.template_order = [] if layers is None else [int(layer.layer_index) for layer in layers]
+        self.scale = 1.0
+        self.structures: Dict[str, _GDS_structure] = {}
+
+    def parse(self, buffer):
+        # 32-bit views at byte offsets 0 and 2, since XY data starts at any even offset
+        self.words = (
+            np.frombuffer(buffer, dtype=">i4", count=len(buffer) // 4),
+            np.frombuffer(buffer, dtype=">i4", count=max(len(buffer) - 2, 0) // 4, offset=min(2, len(buffer))),
+        )
+        try:
+            self._parse_records(buffer)
+        finally:
+            self.words = None
+        return self._build_layers_and_calls()
+
+    def _parse_records(self, buffer):
+        structure = None
+        element = None
+        position = 0
+        end = len(buffer)
+        unpack_header = _RECORD_HEADER.unpack_from
+        unpack_boundary = _BOUNDARY_RECORDS.unpack_from
+        unpack_path = _PATH_RECORDS.unpack_from
+        while position + 4 <= end:
+            length, record_type = unpack_header(buffer, position)
+            if length < 4 or position + length > end:
+                raise ValueError(f"{self.path} has an invalid record at byte {position}")
+
+            # Boundaries and paths laid out as write_to_gds writes them are read in one step
+            if record_type == _BOUNDARY and position + _BOUNDARY_RECORDS.size <= end:
+                records = unpack_boundary(buffer, position)
+                if records[2:4] == (6, _LAYER) and records[5:7] == (6, _DATATYPE) and records[9] == _XY:
+                    endel = position + _BOUNDARY_RECORDS.size - 4 + records[8]
+                    if records[8] > 4 and endel + 4 <= end and unpack_header(buffer, endel) == (4, _ENDEL):
+                        position = self._read_boundary_run(buffer, structure, position, endel + 4 - position)
+                        continue
+            elif record_type == _PATH and position + _PATH_RECORDS.size <= end:
+                records = unpack_path(buffer, position)
+                if (
+                    records[2:4] == (6, _LAYER)
+                    and records[5:7] == (6, _DATATYPE)
+                    and records[8:10] == (6, _PATHTYPE)
+                    and records[11:13] == (8, _WIDTH)
+                    and records[15] == _XY
+                ):
+                    endel = position + _PATH_RECORDS.size - 4 + records[14]
+                    if records[14] > 4 and endel + 4 <= end and unpack_header(buffer, endel) == (4, _ENDEL):
+                        structure.element_types.append(_PATH)
+                        structure.layer_numbers.append(records[4])
+                        structure.widths.append(abs(records[13]))
+                        structure.data_offsets.append(position + _PATH_RECORDS.size)
+                        structure.point_counts.append((records[14] - 4) // 8)
+                        position = endel + 4
+                        continue
+
+            data = position + 4
+            position += length
+            if record_type == _XY:
+                element["data_offset"] = data
+                element["point_count"] = (length - 4) // 8
+            elif record_type == _LAYER:
+                element["layer"] = struct.unpack_from(">h", buffer, data)[0]
+            elif record_type == _ENDEL:
+                self._add_element(structure, element)
+                element = None
+            elif record_type in (_BOUNDARY, _PATH, _SREF, _AREF, _TEXT, _BOX, _NODE):
+                if structure is None:
+                    raise ValueError(f"{self.path} has an element outside any structure at byte {data - 4}")
+                element = {"type": record_type, "width": 0, "strans": 0, "angle": 0.0, "mag": 1.0}
+            elif record_type == _WIDTH:
+                element["width"] = abs(struct.unpack_from(">i", buffer, data)[0])
+            elif record_type == _SNAME:
+                element["sname"] = self._string(buffer, data, position)
+            elif record_type == _STRANS:
+                element["strans"] = struct.unpack_from(">H", buffer, data)[0]
+            elif record_type == _ANGLE:
+                element["angle"] = _gds_real_value(buffer[data : data + 8])
+            elif record_type == _MAG:
+                element["mag"] = _gds_real_value(buffer[data : data + 8])
+            elif record_type == _COLROW:
+                element["colrow"] = struct.unpack_from(">hh", buffer, data)
+            elif record_type == _BGNSTR:
+                structure = _GDS_structure(name="")
+            elif record_type == _STRNAME:
+                structure.name = self._string(buffer, data, position)
+            elif record_type == _ENDSTR:
+                self._finish_structure(structure)
+                structure = None
+            elif record_type == _UNITS:
+                # The size of the database unit in meters, converted to nanometers
+                self.scale = _gds_real_value(buffer[data + 8 : data + 16]) / 1e-9
+                if abs(self.scale - 1) < 1e-9:
+                    self.scale = 1.0
+            elif record_type == _ENDLIB:
+                return
+        raise ValueError(f"{self.path} ends without ENDLIB")
+
+    def _read_boundary_run(self, buffer, structure: _GDS_structure, position: int, element_size: int) -> int:
+        """
+        Reads the boundary at position and the boundaries directly after it that have the same records
+        and number of points, up to _BOUNDARY_RUN_LENGTH at a time, and returns the position after them
+        """
+        run_length = min(_BOUNDARY_RUN_LENGTH, (len(buffer) - position) // element_size)
+        elements = np.frombuffer(
+            buffer, dtype=np.uint8, count=run_length * element_size, offset=position
+        ).reshape(run_length, element_size)
+        # Everything except the layer number and the coordinates must match the first boundary
+        fixed_columns = np.r_[0:8, 10:_BOUNDARY_RECORDS.size, element_size - 4 : element_size]
+        is_same = np.all(elements[:, fixed_columns] == elements[0, fixed_columns], axis=1)
+        run_length = int(np.argmin(is_same)) if not np.all(is_same) else run_length
+        layer_numbers = elements[:run_length, 8:10].copy().view(">i2").ravel()
+        del elements
+
+        structure.element_types.extend([_BOUNDARY] * run_length)
+        structure.layer_numbers.extend(layer_numbers.tolist())
+        structure.widths.extend([0] * run_length)
+        structure.data_offsets.extend(
+            range(position + _BOUNDARY_RECORDS.size, position + run_length * element_size, element_size)
+        )
+        structure.point_counts.extend([(element_size - _BOUNDARY_RECORDS.size - 4) // 8] * run_length)
+        return position + run_length * element_size
+
+    @staticmethod
+    def _string(buffer, start: int, stop: int) -> str:
+        return bytes(buffer[start:stop]).rstrip(b"\0").decode("latin-1")
+
+    def _add_element(self, structure: _GDS_structure, element: Dict):
+        element_type = element["type"]
+        if element_type in (_BOUNDARY, _PATH):
+            if not element.get("point_count"):
+                raise ValueError(f"{self.path} has an element without points in structure {structure.name}")
+            structure.element_types.append(element_type)
+            structure.layer_numbers.append(element["layer"])
+            structure.widths.append(element["width"])
+            structure.data_offsets.append(element["data_offset"])
+            structure.point_counts.append(element["point_count"])
+        elif element_type in (_SREF, _AREF):
+            points = self._read_points(
+                np.array([element["data_offset"]]), np.array([element["point_count"]])
+            )
+            structure.references.append(
+                (element["sname"], self._transformation(element), self._reference_positions(element, points))
+            )
+
+    def _reference_positions(self, element: Dict, points: np.ndarray) -> np.ndarray:
+        """Returns the origin of every placement of an SREF or AREF"""
+        if element["type"] == _SREF:
+            return points[:1]
+        columns, rows = element["colrow"]
+        column_step = (points[1] - points[0]) // columns
+        row_step = (points[2] - points[0]) // rows
+        column_indices, row_indices = np.meshgrid(np.arange(columns), np.arange(rows))
+        return (
+            points[0]
+            + column_indices.reshape(-1, 1) * column_step
+            + row_indices.reshape(-1, 1) * row_step
+        )
+
+    def _transformation(self, element: Dict) -> CIF_transformation:
+        """
+        Returns the rotation and mirroring of a reference. Reflecting about the x axis before rotating is the same
+        as mirroring in the x direction and rotating by a further 180 degrees.
+        """
+        if element["mag"] != 1 or element["strans"] & _STRANS_ABSOLUTE:
+            raise ValueError(f"{self.path} places {element['sname']} with a magnification or absolute angle")
+        is_reflected = bool(element["strans"] & _STRANS_REFLECTION)
+        rotation_deg = element["angle"] + (180 if is_reflected else 0)
+        if abs(rotation_deg / 90 - round(rotation_deg / 90)) > 1e-9:
+            raise ValueError(f"{self.path} places {element['sname']} rotated by {element['angle']} degrees")
+        return CIF_transformation(rotation_deg=int(round(rotation_deg)), mirror_x=is_reflected)
+
+    def _read_points(self, data_offsets: np.ndarray, point_counts: np.ndarray) -> np.ndarray:
+        """Reads the XY data at the given byte offsets as an (N, 2) int64 array in nanometers"""
+        value_counts = 2 * point_counts
+        word_indices = _ragged_indices(data_offsets // 4, value_counts)
+        is_shifted = np.repeat(data_offsets % 4 != 0, value_counts)
+        values = np.empty(len(word_indices), dtype=np.int64)
+        values[~is_shifted] = self.words[0][word_indices[~is_shifted]]
+        values[is_shifted] = self.words[1][word_indices[is_shifted]]
+        if self.scale != 1:
+            values = np.rint(values * self.scale).astype(np.int64)
+        return values.reshape(-1, 2)
+
+    def _finish_structure(self, structure: _GDS_structure):
+        if structure.name in self.structures:
+            raise ValueError(f"{self.path} defines structure {structure.name} twice")
+        self.structures[structure.name] = structure
+        if not structure.element_types:
+            return
+
+        point_counts = np.array(structure.point_counts, dtype=np.int64)
+        points = self._read_points(np.array(structure.data_offsets, dtype=np.int64), point_counts)
+        element_types = np.array(structure.element_types)
+        layer_numbers = np.array(structure.layer_numbers)
+        widths = np.array(structure.widths, dtype=np.int64)
+        if self.scale != 1:
+            widths = np.rint(widths * self.scale).astype(np.int64)
+
+        # Drop the repeated first point at the end of boundaries
+        offsets = _offsets_from_counts(point_counts)
+        is_boundary = element_types == _BOUNDARY
+        is_closed = (
+            is_boundary
+            & (point_counts > 1)
+            & np.all(points[offsets[:-1]] == points[offsets[1:] - 1], axis=1)
+        )
+        keep = np.ones(len(points), dtype=bool)
+        keep[offsets[1:][is_closed] - 1] = False
+        points = points[keep]
+        point_counts = point_counts - is_closed
+        offsets = _offsets_from_counts(point_counts)
+
+        # Boundaries with four vertices along the axes are rectangles
+        is_rectangle = is_boundary & (point_counts == 4)
+        candidates = np.flatnonzero(is_rectangle)
+        corners = points[offsets[candidates][:, None] + np.arange(4)]
+        edges = np.roll(corners, -1, axis=1) - corners
+        starts_along_x = np.all(edges[:, 0::2, 1] == 0, axis=1) & np.all(edges[:, 1::2, 0] == 0, axis=1)
+        starts_along_y = np.all(edges[:, 0::2, 0] == 0, axis=1) & np.all(edges[:, 1::2, 1] == 0, axis=1)
+        is_rectangle[candidates] = starts_along_x | starts_along_y
+        lower = corners.min(axis=1)
+        sizes = corners.max(axis=1) - lower
+        rectangle_rows = np.concatenate([sizes, lower + sizes // 2], axis=1)
+        rectangle_rows = rectangle_rows[is_rectangle[candidates]]
+
+        kinds = np.where(
+            is_rectangle, RECTANGLE_KIND, np.where(is_boundary, POLYGON_KIND, WIRE_KIND)
+        ).astype(np.uint8)
+        is_polygon = kinds == POLYGON_KIND
+        is_wire = element_types == _PATH
+        rectangle_layers = layer_numbers[is_rectangle]
+        for layer_number in np.unique(layer_numbers).tolist():
+            on_layer = layer_numbers == layer_number
+            polygon_points, polygon_offsets = _select_ragged(
+                points, offsets, np.flatnonzero(is_polygon & on_layer)
+            )
+            wire_indices = np.flatnonzero(is_wire & on_layer)
+            wire_points, wire_offsets = _select_ragged(points, offsets, wire_indices)
+            structure.shape_arrays[layer_number] = CIF_shape_arrays.from_arrays(
+                rectangles=rectangle_rows[rectangle_layers == layer_number],
+                polygon_points=polygon_points,
+                polygon_offsets=polygon_offsets,
+                wire_points=wire_points,
+                wire_offsets=wire_offsets,
+                wire_widths=widths[wire_indices],
+                kinds=kinds[on_layer],
+            )
+
+    def _build_layers_and_calls(self):
+        layer_numbers = set(self.template_order)
+        for structure in self.structures.values():
+            layer_numbers.update(structure.shape_arrays)
+        order = self.template_order + sorted(layer_numbers - set(self.template_order))
+
+        symbols = {
+            name: CIF_symbol(
+                symbol_name=name,
+                layers=[
+                    self._layer(layer_number, structure.shape_arrays[layer_number])
+                    for layer_number in order
+                    if layer_number in structure.shape_arrays
+                ],
+            )
+            for name, structure in self.structures.items()
+        }
+        referenced_names = set()
+        for name, structure in self.structures.items():
+            for structure_name, transformation, positions in structure.references:
+                if structure_name not in symbols:
+                    raise ValueError(f"{self.path} references the undefined structure {structure_name}")
+                referenced_names.add(structure_name)
+                symbols[name].calls.extend(_calls_at_positions(symbols[structure_name], transformation, positions))
+
+        top_names = [name for name in self.structures if name not in referenced_names]
+        if len(top_names) == 1:
+            top_symbol = symbols[top_names[0]]
+            top_layers = {layer.layer_index: layer for layer in top_symbol.layers}
+            layers = [
+                top_layers[layer_number] if layer_number in top_layers else self._layer(layer_number)
+                for layer_number in order
+            ]
+            return layers, top_symbol.calls
+
+        layers = [self._layer(layer_number) for layer_number in order]
+        return layers, [symbols[name].place() for name in top_names]
+
+    def _layer(self, layer_number: int, shape_arrays: CIF_shape_arrays = None) -> CleWin_layer:
+        """Returns an array-backed copy of the template of the layer number, holding shape_arrays"""
+        if layer_number in self.templates:
+            layer = self.templates[layer_number].empty_copy()
+        else:
+            layer = CleWin_layer(
+                layer_name=f"GDS layer {layer_number}",
+                layer_alias=f"L{layer_number}",
+                layer_index=layer_number,
+                fill_color=copy.deepcopy(GDS_DEFAULT_FILL_COLOR),
+                border_color=copy.deepcopy(GDS_DEFAULT_BORDER_COLOR),
+            )
+        layer.shape_arrays = CIF_shape_arrays() if shape_arrays is None else shape_arrays
+        return layer
+
+
+def _calls_at_positions(
+    symbol: CIF_symbol, transformation: CIF_transformation, positions: np.ndarray
+) -> List[CIF_symbol_call]:
+    return [
+        symbol.place(
+            x_shift_nm=x,
+            y_shift_nm=y,
+            rotation_deg=transformation.rotation_deg,
+            mirror_x=transformation.mirror_x,
+        )
+        for x, y in positions.tolist()
+    ]
@@ -0,0 +1,403 @@
+from typing import Tuple
+import numpy as np
+
+from CleWin_cif_creator import (
+    CIF_shape_arrays,
+    CIF_polygon,
+    CIF_wire,
+    POLYGON_KIND,
+    WIRE_KIND,
+    _offsets_from_counts,
+    _concatenate_offsets,
+    _concatenate_points,
+    _select_ragged,
+    _new_polygon,
+    _remove_repeated_points,
+)
+
+# Default largest distance in nm between a curve and the chords that approximate it
+CHORD_TOLERANCE_NM = 1.0
+
+# The number of wire points outlined at a time, which bounds the memory use of outline_wires
+GEOMETRY_WIRE_POINTS_PER_CHUNK = 1 << 18
+
+
+def chord_segment_counts(radii_nm, sweeps_rad, tolerance_nm: float = CHORD_TOLERANCE_NM) -> np.ndarray:
+    """
+    Returns the smallest number of chords that approximate circular arcs within tolerance_nm, at least 1 per arc.
+    A chord spanning the angle a on a circle with radius r is r * (1 - cos(a / 2)) away from the circle at its middle.
+
+    Args:
+    -----
+    radii_nm: np.ndarray
+        The radius of each arc in nm
+    sweeps_rad: np.ndarray
+        The angle spanned by each arc in radians, in either direction
+    tolerance_nm: float
+        The largest allowed distance between the arc and its chords in nm
+    """
+    if tolerance_nm <= 0:
+        raise ValueError("tolerance_nm must be positive")
+    radii = np.abs(np.asarray(radii_nm, dtype=np.float64))
+    sweeps = np.abs(np.asarray(sweeps_rad, dtype=np.float64))
+    with np.errstate(divide="ignore"):
+        max_chord_angles = 2 * np.arccos(np.clip(1 - tolerance_nm / radii, -1, 1))
+    # The small margin keeps rounding errors from adding a chord to arcs that fit exactly
+    counts = np.ceil(sweeps / max_chord_angles - 1e-9)
+    return np.maximum(counts, 1).astype(np.int64)
+
+
+def arc_points(
+    x_center_nm: float,
+    y_center_nm: float,
+    radius_nm: float,
+    start_angle_deg: float,
+    stop_angle_deg: float,
+    tolerance_nm: float = CHORD_TOLERANCE_NM,
+) -> np.ndarray:
+    """
+    Returns the points of a circular arc as an (N, 2) int64 array, e.g. as the centerline of a CIF_wire.
+    The arc runs counterclockwise from start_angle_deg to stop_angle_deg, or clockwise if stop_angle_deg is smaller,
+    and has as few points as keep its chords within tolerance_nm of the arc.
+    """
+    points, _ = _arc_shapes(
+        np.array([[x_center_nm, y_center_nm]], dtype=np.float64),
+        np.array([radius_nm], dtype=np.float64),
+        np.radians([start_angle_deg]),
+        np.radians([stop_angle_deg - start_angle_deg]),
+        tolerance_nm,
+    )
+    return points
+
+
+def arcs(
+    centers_nm,
+    radii_nm,
+    start_angles_deg,
+    stop_angles_deg,
+    widths_nm,
+    tolerance_nm: float = CHORD_TOLERANCE_NM,
+) -> CIF_shape_arrays:
+    """
+    Returns wires along circular arcs, see arc_points. All arcs are generated in bulk.
+
+    Args:
+    -----
+    centers_nm: np.ndarray
+        (N, 2) array with the center of each arc in nm
+    radii_nm: float | np.ndarray
+        The radius of the centerline of each arc in nm
+    start_angles_deg: float | np.ndarray
+        The angle at which each arc starts, counterclockwise from the x axis in degrees
+    stop_angles_deg: float | np.ndarray
+        The angle at which each arc stops in degrees
+    widths_nm: int | np.ndarray
+        The width of each wire in nm
+    tolerance_nm: float
+        The largest distance between the centerline of a wire and the arc in nm
+    """
+    centers, radii, start_angles, stop_angles, widths = _broadcast_per_shape(
+        centers_nm, radii_nm, start_angles_deg, stop_angles_deg, widths_nm
+    )
+    points, offsets = _arc_shapes(
+        centers, radii, np.radians(start_angles), np.radians(stop_angles - start_angles), tolerance_nm
+    )
+    return CIF_shape_arrays.from_arrays(wire_points=points, wire_offsets=offsets, wire_widths=widths)
+
+
+def circles(centers_nm, radii_nm, tolerance_nm: float = CHORD_TOLERANCE_NM) -> CIF_shape_arrays:
+    """
+    Returns polygons approximating circles with vertices on the circles, with at least 3 and otherwise as few
+    vertices as keep the edges within tolerance_nm of the circles
+
+    Args:
+    -----
+    centers_nm: np.ndarray
+        (N, 2) array with the center of each circle in nm
+    radii_nm: float | np.ndarray
+        The radius of each circle in nm
+    tolerance_nm: float
+        The largest distance between a circle and the edges of its polygon in nm
+    """
+    centers, radii = _broadcast_per_shape(centers_nm, radii_nm)
+    counts = np.maximum(chord_segment_counts(radii, 2 * np.pi, tolerance_nm), 3)
+    points = _arc_points(centers, radii, np.zeros(len(radii)), np.full(len(radii), 2 * np.pi), counts, closed=True)
+    points, offsets = _remove_repeated_points(_rounded(points), _offsets_from_counts(counts))
+    return CIF_shape_arrays.from_arrays(polygon_points=points, polygon_offsets=offsets)
+
+
+def rings(centers_nm, inner_radii_nm, outer_radii_nm, tolerance_nm: float = CHORD_TOLERANCE_NM) -> CIF_shape_arrays:
+    """
+    Returns polygons approximating rings, see circles. CIF polygons cannot have holes, so each ring is a single
+    polygon that runs around the outer circle counterclockwise, along a cut on the positive x axis to the inner
+    circle, around the inner circle clockwise and back along the cut.
+
+    Args:
+    -----
+    centers_nm: np.ndarray
+        (N, 2) array with the center of each ring in nm
+    inner_radii_nm: float | np.ndarray
+        The radius of the hole of each ring in nm
+    outer_radii_nm: float | np.ndarray
+        The outer radius of each ring in nm
+    tolerance_nm: float
+        The largest distance between a circle and the edges of the polygon in nm
+    """
+    centers, inner_radii, outer_radii = _broadcast_per_shape(centers_nm, inner_radii_nm, outer_radii_nm)
+    if np.any(inner_radii < 0) or np.any(inner_radii >= outer_radii):
+        raise ValueError("The inner radius of a ring must be at least 0 and smaller than the outer radius")
+    ring_count = len(centers)
+    # The outer and inner circle of ring n are arcs 2n and 2n + 1
+    radii = np.stack([outer_radii, inner_radii], axis=1).ravel()
+    start_angles = np.tile([0, 2 * np.pi], ring_count)
+    sweeps = np.tile([2 * np.pi, -2 * np.pi], ring_count)
+    counts = np.maximum(chord_segment_counts(radii, sweeps, tolerance_nm), 3)
+    points = _arc_points(np.repeat(centers, 2, axis=0), radii, start_angles, sweeps, counts, closed=False)
+    ring_counts = (counts + 1).reshape(-1, 2).sum(axis=1)
+    points, offsets = _remove_repeated_points(_rounded(points), _offsets_from_counts(ring_counts))
+    return CIF_shape_arrays.from_arrays(polygon_points=points, polygon_offsets=offsets)
+
+
+def rounded_rectangles(
+    rectangles, corner_radii_nm, tolerance_nm: float = CHORD_TOLERANCE_NM
+) -> CIF_shape_arrays:
+    """
+    Returns polygons of rectangles with rounded corners. Corner radii larger than half the smallest side
+    of a rectangle are reduced to it, and rectangles with corner radius 0 have 4 vertices.
+
+    Args:
+    -----
+    rectangles: np.ndarray
+        (N, 4) array of (x_size_nm, y_size_nm, x_center_nm, y_center_nm), as in CIF_shape_arrays.rectangles
+    corner_radii_nm: float | np.ndarray
+        The radius of the corners of each rectangle in nm
+    tolerance_nm: float
+        The largest distance between a rounded corner and the edges of the polygon in nm
+    """
+    rectangles = np.asarray(rectangles, dtype=np.float64).reshape(-1, 4)
+    corner_radii = np.broadcast_to(np.asarray(corner_radii_nm, dtype=np.float64), len(rectangles))
+    corner_radii = np.clip(corner_radii, 0, rectangles[:, :2].min(axis=1) / 2)
+    # The corners counterclockwise from the upper right, as quarter circles around points inside the rectangle
+    corner_signs = np.array([[1, 1], [-1, 1], [-1, -1], [1, -1]], dtype=np.float64)
+    half_extents = rectangles[:, None, :2] / 2 - corner_radii[:, None, None]
+    centers = (rectangles[:, None, 2:] + corner_signs * half_extents).reshape(-1, 2)
+    radii = np.repeat(corner_radii, 4)
+    start_angles = np.tile(np.arange(4) * np.pi / 2, len(rectangles))
+    sweeps = np.full(len(radii), np.pi / 2)
+    counts = chord_segment_counts(radii, sweeps, tolerance_nm)
+    points = _arc_points(centers, radii, start_angles, sweeps, counts, closed=False)
+    rectangle_counts = (counts + 1).reshape(-1, 4).sum(axis=1)
+    points, offsets = _remove_repeated_points(_rounded(points), _offsets_from_counts(rectangle_counts))
+    return CIF_shape_arrays.from_arrays(polygon_points=points, polygon_offsets=offsets)
+
+
+def wire_outline(wire: CIF_wire, tolerance_nm: float = CHORD_TOLERANCE_NM) -> CIF_polygon:
+    """Returns the outline of a wire as a polygon, see outline_wires"""
+    outline = outline_wires(CIF_shape_arrays.from_shapes([wire]), tolerance_nm)
+    return _new_polygon(outline.polygon_points, wire.color)
+
+
+def outline_wires(shape_arrays: CIF_shape_arrays, tolerance_nm: float = CHORD_TOLERANCE_NM) -> CIF_shape_arrays:
+    """
+    Returns the shapes with every wire replaced by a polygon of its outline, in the same position in insertion order,
+    e.g. to compute areas or to export to tools without round wires. Rectangles and polygons are kept.
+
+    The outline has round caps and round joins on the outside of every bend, with vertices on the circles and as
+    few of them as keep the edges within tolerance_nm of the circles. Inside a bend, the two sides meet at the
+    intersection of their edges. Where that intersection lies beyond a segment, at sharp bends after short segments,
+    the side runs through the wire point instead. Such outlines, and those of wires that cross themselves,
+    overlap themselves but cover the wire under the nonzero fill rule. Vertices are rounded to whole nanometers.
+
+    Args:
+    -----
+    shape_arrays: CIF_shape_arrays
+        The shapes, e.g. from CleWin_layer.get_shape_arrays
+    tolerance_nm: float
+        The largest distance between a round cap or join and the edges of the outline in nm
+    """
+    kinds = shape_arrays.kinds
+    outline_points, outline_offsets = _wire_outlines(
+        shape_arrays.wire_points, shape_arrays.wire_offsets, shape_arrays.wire_widths, tolerance_nm
+    )
+    # Polygons and outlines are merged into one ragged array in insertion order
+    is_wire = kinds == WIRE_KIND
+    is_polygon_or_wire = (kinds == POLYGON_KIND) | is_wire
+    polygon_count = len(shape_arrays.polygon_offsets) - 1
+    source_indices = np.cumsum(kinds == POLYGON_KIND) - 1
+    source_indices[is_wire] = polygon_count + np.arange(int(is_wire.sum()))
+    combined_offsets = np.concatenate(
+        [shape_arrays.polygon_offsets, shape_arrays.polygon_offsets[-1] + outline_offsets[1:]]
+    )
+    points, offsets = _select_ragged(
+        np.concatenate([shape_arrays.polygon_points, outline_points]),
+        combined_offsets,
+        source_indices[is_polygon_or_wire],
+    )
+    return CIF_shape_arrays.from_arrays(
+        rectangles=shape_arrays.rectangles,
+        polygon_points=points,
+        polygon_offsets=offsets,
+        kinds=np.where(is_wire, POLYGON_KIND, kinds).astype(np.uint8),
+    )
+
+
+def _wire_outlines(
+    points: np.ndarray, offsets: np.ndarray, widths: np.ndarray, tolerance_nm: float
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns the points and offsets of the outlines of wires, a chunk of about GEOMETRY_WIRE_POINTS_PER_CHUNK points at a time"""
+    wire_count = len(offsets) - 1
+    chunk_starts = np.searchsorted(
+        offsets, np.arange(0, offsets[-1], GEOMETRY_WIRE_POINTS_PER_CHUNK), side="right"
+    ) - 1
+    chunk_bounds = np.unique(np.concatenate([[0], chunk_starts, [wire_count]])).tolist()
+    outline_points, outline_offsets = [], []
+    for start, stop in zip(chunk_bounds[:-1], chunk_bounds[1:]):
+        chunk_points, chunk_offsets = _wire_outline_chunk(
+            points[offsets[start] : offsets[stop]],
+            offsets[start : stop + 1] - offsets[start],
+            widths[start:stop],
+            tolerance_nm,
+        )
+        outline_points.append(chunk_points)
+        outline_offsets.append(chunk_offsets)
+    return _concatenate_points(outline_points), _concatenate_offsets(outline_offsets or [np.zeros(1, dtype=np.int64)])
+
+
+def _wire_outline_chunk(
+    points: np.ndarray, offsets: np.ndarray, widths: np.ndarray, tolerance_nm: float
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the points and offsets of the outlines of wires, see outline_wires.
+
+    Every wire is traced twice, forward along its right side and backward along its left side, which gives
+    a counterclockwise outline. Both passes consist of the same events: a join at every inner point and a cap
+    at the last point, so the events of all passes of all wires are found and filled in bulk.
+    """
+    wire_count = len(offsets) - 1
+    wire_ids = np.repeat(np.arange(wire_count), np.diff(offsets))
+    points = points.astype(np.float64)
+    # Repeated points have no direction and are dropped
+    is_kept = np.ones(len(points), dtype=bool)
+    is_kept[1:] = np.any(points[1:] != points[:-1], axis=1) | (wire_ids[1:] != wire_ids[:-1])
+    points, wire_ids = points[is_kept], wire_ids[is_kept]
+    counts = np.bincount(wire_ids, minlength=wire_count)
+    offsets = _offsets_from_counts(counts)
+
+    # Pass 2n is wire n forward, pass 2n + 1 is wire n backward
+    pass_counts = np.repeat(counts, 2)
+    pass_offsets = _offsets_from_counts(pass_counts)
+    steps = np.arange(pass_offsets[-1]) - np.repeat(pass_offsets[:-1], pass_counts)
+    pass_ids = np.repeat(np.arange(2 * wire_count), pass_counts)
+    wire_of_step = pass_ids // 2
+    is_backward = pass_ids % 2 == 1
+    step_counts = counts[wire_of_step]
+    point_indices = offsets[wire_of_step] + np.where(is_backward, step_counts - 1 - steps, steps)
+    path = points[point_indices]
+    radii = widths.astype(np.float64)[wire_of_step] / 2
+
+    # The direction of the segment from every step to the next one in the same pass
+    directions = np.zeros_like(path)
+    lengths = np.zeros(len(path))
+    if len(path) > 1:
+        vectors = path[1:] - path[:-1]
+        lengths[:-1] = np.hypot(vectors[:, 0], vectors[:, 1])
+        has_segment = steps[:-1] < step_counts[:-1] - 1
+        np.divide(vectors, lengths[:-1, None], out=directions[:-1], where=has_segment[:, None])
+    x_directions, y_directions = directions[:, 0].copy(), directions[:, 1].copy()
+
+    # Every step after the first is a join or the end cap, and single points are a full circle in their first pass
+    is_event = (steps > 0) | ((step_counts == 1) & ~is_backward)
+    events = np.flatnonzero(is_event)
+    is_circle = step_counts[events] == 1
+    is_cap = (steps[events] == step_counts[events] - 1) & ~is_circle
+    is_join = ~is_cap & ~is_circle
+    incoming = np.clip(events - 1, 0, None)
+    x_in, y_in = x_directions[incoming], y_directions[incoming]
+    x_out, y_out = x_directions[events], y_directions[events]
+    cross = x_in * y_out - y_in * x_out
+    dot = x_in * x_out + y_in * y_out
+    turns = np.arctan2(cross, dot)
+    # Left turns bend around the right side, which is then rounded
+    is_outer_join = is_join & (turns > 0)
+    is_inner_join = is_join & ~is_outer_join
+
+    # Arcs start at the right normal (y, -x) of the incoming segment
+    is_arc = is_circle | is_cap | is_outer_join
+    arc_events = events[is_arc]
+    is_arc_circle = is_circle[is_arc]
+    arc_starts = np.where(is_arc_circle, 0.0, np.arctan2(-x_in[is_arc], y_in[is_arc]))
+    arc_sweeps = np.select([is_arc_circle, is_cap[is_arc]], [2 * np.pi, np.pi], turns[is_arc])
+    arc_radii = radii[arc_events]
+    chord_counts = chord_segment_counts(arc_radii, arc_sweeps, tolerance_nm)
+    chord_counts[is_arc_circle] = np.maximum(chord_counts[is_arc_circle], 3)
+    arc_points = _arc_points(path[arc_events], arc_radii, arc_starts, arc_sweeps, chord_counts, closed=is_arc_circle)
+
+    # Inside a bend the sides meet at the intersection of their edges, if it lies on both segments
+    inner_events = events[is_inner_join]
+    inner_radii = radii[inner_events]
+    inner_cross, inner_dot = cross[is_inner_join], dot[is_inner_join]
+    is_mitered = inner_radii * np.abs(inner_cross) <= (1 + inner_dot) * np.minimum(
+        lengths[incoming[is_inner_join]], lengths[inner_events]
+    )
+    normals_in = np.stack([y_in[is_inner_join], -x_in[is_inner_join]], axis=1) * inner_radii[:, None]
+    normals_out = np.stack([y_out[is_inner_join], -x_out[is_inner_join]], axis=1) * inner_radii[:, None]
+    inner_path = path[inner_events]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        miters = inner_path + (normals_in + normals_out) / (1 + inner_dot[:, None])
+    candidates = np.stack(
+        [np.where(is_mitered[:, None], miters, inner_path + normals_in), inner_path, inner_path + normals_out],
+        axis=1,
+    )
+    is_candidate_used = np.ones(candidates.shape[:2], dtype=bool)
+    is_candidate_used[:, 1:] = ~is_mitered[:, None]
+    inner_points = candidates[is_candidate_used]
+
+    # Fill in the points of all events in order
+    event_counts = np.zeros(len(events), dtype=np.int64)
+    event_counts[is_arc] = chord_counts + ~is_arc_circle
+    event_counts[is_inner_join] = np.where(is_mitered, 1, 3)
+    event_offsets = _offsets_from_counts(event_counts)
+    outline = np.zeros((event_offsets[-1], 2), dtype=np.float64)
+    outline[_range_indices(event_offsets[:-1][is_arc], event_counts[is_arc])] = arc_points
+    outline[_range_indices(event_offsets[:-1][is_inner_join], event_counts[is_inner_join])] = inner_points
+
+    outline_counts = np.bincount(wire_of_step[events], weights=event_counts, minlength=wire_count).astype(np.int64)
+    return _remove_repeated_points(_rounded(outline), _offsets_from_counts(outline_counts))
+
+
+def _arc_shapes(centers, radii, start_angles, sweeps, tolerance_nm: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns the rounded points and offsets of open arcs"""
+    counts = chord_segment_counts(radii, sweeps, tolerance_nm)
+    points = _arc_points(centers, radii, start_angles, sweeps, counts, closed=False)
+    return _remove_repeated_points(_rounded(points), _offsets_from_counts(counts + 1), closed=False)
+
+
+def _arc_points(centers, radii, start_angles, sweeps, counts, closed) -> np.ndarray:
+    """
+    Returns the points of arcs divided into counts chords, arc after arc, as one (M, 2) float array.
+    Open arcs include both ends, closed arcs leave out the end as it is the start.
+    """
+    point_counts = counts + ~np.broadcast_to(closed, counts.shape)
+    arc_ids = np.repeat(np.arange(len(counts)), point_counts)
+    steps = np.arange(point_counts.sum()) - np.repeat(_offsets_from_counts(point_counts)[:-1], point_counts)
+    angles = start_angles[arc_ids] + sweeps[arc_ids] * (steps / counts[arc_ids])
+    return centers[arc_ids] + radii[arc_ids, None] * np.stack([np.cos(angles), np.sin(angles)], axis=1)
+
+
+def _range_indices(starts: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """Returns the indices start, start + 1, ..., start + count - 1 of all ranges, range after range"""
+    return np.repeat(starts, counts) + (
+        np.arange(counts.sum()) - np.repeat(_offsets_from_counts(counts)[:-1], counts)
+    )
+
+
+def _rounded(points: np.ndarray) -> np.ndarray:
+    return np.rint(points).astype(np.int64)
+
+
+def _broadcast_per_shape(centers_nm, *values):
+    """Returns (N, 2) float centers and every value as an (N,) array, with scalars repeated for every shape"""
+    centers = np.asarray(centers_nm, dtype=np.float64).reshape(-1, 2)
+    return (centers,) + tuple(
+        np.broadcast_to(np.asarray(value, dtype=np.float64), len(centers)).copy() for value in values
+    )
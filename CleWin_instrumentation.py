@@ -0,0 +1,215 @@
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Dict, List
+
+# Returned by phase when nothing is being recorded, so disabled instrumentation costs one check per phase
+_NULL_PHASE = nullcontext()
+
+
+class CIF_phase_timing:
+    def __init__(self):
+        """
+        The time spent in one phase. seconds includes the phases nested in it, self_seconds does not,
+        so the self_seconds of all phases add up to the time spent in instrumented code.
+        """
+        self.calls = 0
+        self.seconds = 0.0
+        self.self_seconds = 0.0
+
+    def merge(self, other: "CIF_phase_timing"):
+        self.calls += other.calls
+        self.seconds += other.seconds
+        self.self_seconds += other.self_seconds
+
+    def to_dict(self) -> Dict:
+        return {"calls": self.calls, "seconds": self.seconds, "self_seconds": self.self_seconds}
+
+
+class CIF_report:
+    def __init__(self, operation: str = None, filename=None):
+        """
+        Timings and counts recorded while instrumentation is enabled.
+
+        Phases recorded by the library are "write_to_cif", "serialize" (building the CIF text) and "write"
+        (handing it to the file) when writing, and "load_cif", "read" (reading and decoding the file), "parse",
+        "flatten" (placing symbol calls) and "convert" (creating shape objects) when loading.
+        GDSII files record the same phases under "write_to_gds" and "load_gds", with "serialize" packing the records.
+        Code around the library can add its own phases, e.g. "generate", with the phase context manager.
+
+        Counters are bytes_written, bytes_read (characters for text files), shapes_written, shapes_read,
+        vertices_written and vertices_read. Vertices are the points of polygons and wires; rectangles
+        are only counted as shapes. The same counters are kept per layer alias in layers.
+
+        Args:
+        -----
+        operation: str
+            "write_to_cif", "load_cif", "write_to_gds" or "load_gds" for the report of a single file
+        filename: str
+            The file of a single-file report, without its extension
+        """
+        self.operation = operation
+        self.filename = filename
+        self.phases: Dict[str, CIF_phase_timing] = {}
+        self.counters: Dict[str, int] = {}
+        self.layers: Dict[str, Dict[str, int]] = {}
+        self.files: List = []
+
+    def add(self, counter: str, amount: int):
+        self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def add_layer(self, layer_alias: str, **amounts):
+        """Adds amounts to the counters of a layer, and to the totals"""
+        layer_counters = self.layers.setdefault(layer_alias, {})
+        for counter, amount in amounts.items():
+            layer_counters[counter] = layer_counters.get(counter, 0) + amount
+            self.add(counter, amount)
+
+    def add_phase(self, name: str, seconds: float, self_seconds: float):
+        timing = self.phases.setdefault(name, CIF_phase_timing())
+        timing.calls += 1
+        timing.seconds += seconds
+        timing.self_seconds += self_seconds
+
+    def merge(self, other: "CIF_report"):
+        """Adds the timings and counts of another report to this one"""
+        for name, timing in other.phases.items():
+            self.phases.setdefault(name, CIF_phase_timing()).merge(timing)
+        for counter, amount in other.counters.items():
+            self.add(counter, amount)
+        for layer_alias, layer_counters in other.layers.items():
+            target = self.layers.setdefault(layer_alias, {})
+            for counter, amount in layer_counters.items():
+                target[counter] = target.get(counter, 0) + amount
+        self.files.extend(other.files)
+
+    def to_dict(self) -> Dict:
+        """Returns the report as plain dictionaries and lists, e.g. for json.dump"""
+        return {
+            "operation": self.operation,
+            "filename": None if self.filename is None else str(self.filename),
+            "phases": {name: timing.to_dict() for name, timing in self.phases.items()},
+            "counters": dict(self.counters),
+            "layers": {layer_alias: dict(counters) for layer_alias, counters in self.layers.items()},
+            "files": [str(filename) for filename in self.files],
+        }
+
+    def summary(self) -> str:
+        """Returns a table of the phases, slowest first, and the counters"""
+        lines = [f"{'phase':<16}{'calls':>8}{'seconds':>12}{'self':>12}"]
+        for name, timing in sorted(self.phases.items(), key=lambda item: -item[1].self_seconds):
+            lines.append(f"{name:<16}{timing.calls:>8}{timing.seconds:>12.4f}{timing.self_seconds:>12.4f}")
+        lines.extend(f"{counter}: {amount}" for counter, amount in sorted(self.counters.items()))
+        return "\n".join(lines)
+
+    def __repr__(self):
+        seconds = sum(timing.self_seconds for timing in self.phases.values())
+        target = "" if self.filename is None else f" {self.filename}"
+        return f"CIF_report({self.operation or 'all'}{target}: {seconds:.4f} s, {self.counters})"
+
+
+class _Instrumentation_state(threading.local):
+    def __init__(self):
+        # Reports being recorded, innermost last. Phases and counts go to the innermost one.
+        self.reports: List[CIF_report] = []
+        # (name, start, seconds of nested phases) for every open phase, innermost last
+        self.phases: List[list] = []
+        self.file_callback: Callable[[CIF_report], None] | None = None
+
+
+_state = _Instrumentation_state()
+
+
+def get_active_report() -> CIF_report | None:
+    """Returns the report that is being recorded in this thread, or None if instrumentation is disabled"""
+    return _state.reports[-1] if _state.reports else None
+
+
+@contextmanager
+def instrument(callback: Callable[[CIF_report], None] = None):
+    """
+    Records the timings and counts of everything the library does in this thread within the block.
+
+    Example:
+    --------
+    with instrument() as report:
+        layers = generate_mask()
+        write_to_cif("mask", layers)
+    print(report.summary())
+
+    Args:
+    -----
+    callback: Callable[[CIF_report], None]
+        Called with the report when the block ends
+
+    Yields:
+    -------
+    report: CIF_report
+        The report, which is complete when the block ends
+    """
+    report = CIF_report()
+    _state.reports.append(report)
+    try:
+        yield report
+    finally:
+        _state.reports.remove(report)
+        if _state.reports:
+            _state.reports[-1].merge(report)
+    if callback is not None:
+        callback(report)
+
+
+def set_file_report_callback(callback: Callable[[CIF_report], None] | None):
+    """
+    Records a separate report for every file written or loaded in this thread and hands it to callback,
+    e.g. to log metrics for every mask that is built. Pass None to stop.
+    """
+    _state.file_callback = callback
+
+
+@contextmanager
+def _file_report(operation: str, filename):
+    """Records a report for one file if a file callback is set, adding it to any enclosing report"""
+    callback = _state.file_callback
+    if callback is None:
+        if _state.reports:
+            _state.reports[-1].files.append(filename)
+        with phase(operation):
+            yield
+        return
+    report = CIF_report(operation, filename)
+    report.files.append(filename)
+    _state.reports.append(report)
+    try:
+        with phase(operation):
+            yield
+    finally:
+        _state.reports.remove(report)
+        if _state.reports:
+            _state.reports[-1].merge(report)
+    callback(report)
+
+
+def phase(name: str):
+    """
+    Returns a context manager that records the time spent in it as the phase name, if instrumentation is enabled.
+    Phases can be nested.
+    """
+    if not _state.reports:
+        return _NULL_PHASE
+    return _timed_phase(name)
+
+
+@contextmanager
+def _timed_phase(name: str):
+    frame = [name, time.perf_counter(), 0.0]
+    _state.phases.append(frame)
+    try:
+        yield
+    finally:
+        _state.phases.pop()
+        seconds = time.perf_counter() - frame[1]
+        if _state.phases:
+            _state.phases[-1][2] += seconds
+        if _state.reports:
+            _state.reports[-1].add_phase(name, seconds, seconds - frame[2])
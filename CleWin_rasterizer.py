@@ -0,0 +1,561 @@
+import math
+from typing import Iterable, List, Tuple
+import numpy as np
+
+from CleWin_cif_creator import (
+    CleWin_layer,
+    CIF_shape_arrays,
+    RECTANGLE_KIND,
+    POLYGON_KIND,
+    WIRE_KIND,
+    _offsets_from_counts,
+    _select_ragged,
+)
+from CleWin_boolean import _boolean_rectangles
+
+# Define an alias for a window (x_min, y_min, x_max, y_max) in nm
+Window = Tuple[float, float, float, float]
+
+
+def rasterize_layers(
+    layers: CleWin_layer | List[CleWin_layer],
+    pixel_size_nm: float,
+    window: Window,
+    polygon_samples: int = 1,
+) -> np.ndarray:
+    """
+    Rasterizes layers into an array with the fraction of each pixel covered by the union of the shapes.
+    Rectangles are merged into their union first and rasterized with its exact area. Polygons and wires are
+    scanline filled at polygon_samples x polygon_samples sample points per pixel, where wires are filled as
+    capsules (a quadrilateral per segment and a disc at every point). In pixels where polygons or wires cover
+    a sample, the coverage is the fraction of samples covered by any shape, rectangles included.
+
+    A sample is covered if its center lies inside a shape or on its lower or left edge, but not on its upper or
+    right edge, so a sample on the border between two abutting shapes is counted once.
+
+    Use iter_raster_tiles for windows that are too large to hold in memory.
+
+    Args:
+    -----
+    layers: CleWin_layer | List[CleWin_layer]
+        The layers to rasterize. The union of all layers is rasterized.
+    pixel_size_nm: float
+        The side-length of a pixel in nm
+    window: Tuple[float, float, float, float]
+        The rasterized area as (x_min, y_min, x_max, y_max) in nm
+    polygon_samples: int
+        The number of samples per pixel in each direction for polygons and wires
+
+    Returns:
+    --------
+    coverage: np.ndarray
+        (ny, nx) float array, where coverage[j, i] is the pixel with lower left corner
+        (x_min + i * pixel_size_nm, y_min + j * pixel_size_nm)
+    """
+    shape_arrays = _combined_shape_arrays(layers)
+    nx, ny = _raster_size(window, pixel_size_nm)
+    return _rasterize_tile(
+        shape_arrays, window[0], window[1], nx, ny, pixel_size_nm, polygon_samples
+    )
+
+
+def iter_raster_tiles(
+    layers: CleWin_layer | List[CleWin_layer],
+    pixel_size_nm: float,
+    window: Window,
+    tile_size_px: int = 2048,
+    polygon_samples: int = 1,
+):
+    """
+    Rasterizes layers tile by tile, so only one tile of the bitmap is in memory at a time.
+    Shapes are sorted into tiles once using their bounding boxes. See rasterize_layers for the arguments.
+
+    Args:
+    -----
+    tile_size_px: int
+        The side-length of a tile in pixels
+
+    Yields:
+    -------
+    column: int
+        The pixel column of the lower left corner of the tile within the window
+    row: int
+        The pixel row of the lower left corner of the tile within the window
+    coverage: np.ndarray
+        (tile_ny, tile_nx) float array with the coverage of the tile
+    """
+    shape_arrays = _combined_shape_arrays(layers)
+    nx, ny = _raster_size(window, pixel_size_nm)
+    tiles_x = math.ceil(nx / tile_size_px)
+    tiles_y = math.ceil(ny / tile_size_px)
+    tile_size_nm = tile_size_px * pixel_size_nm
+
+    shapes_in_tiles = [
+        _bin_to_tiles(
+            shape_arrays.get_kind_bounding_boxes(kind), window, tile_size_nm, tiles_x, tiles_y
+        )
+        for kind in (RECTANGLE_KIND, POLYGON_KIND, WIRE_KIND)
+    ]
+
+    for tile_row in range(tiles_y):
+        for tile_column in range(tiles_x):
+            tile = tile_row * tiles_x + tile_column
+            column = tile_column * tile_size_px
+            row = tile_row * tile_size_px
+            tile_shapes = _select_shapes(
+                shape_arrays,
+                *[
+                    shape_indices[tile_starts[tile] : tile_starts[tile + 1]]
+                    for shape_indices, tile_starts in shapes_in_tiles
+                ],
+            )
+            yield column, row, _rasterize_tile(
+                tile_shapes,
+                window[0] + column * pixel_size_nm,
+                window[1] + row * pixel_size_nm,
+                min(tile_size_px, nx - column),
+                min(tile_size_px, ny - row),
+                pixel_size_nm,
+                polygon_samples,
+            )
+
+
+class CleWin_density_map:
+    def __init__(self, density: np.ndarray, window: Window, tile_size_nm: float):
+        """
+        The pattern density of layers per tile, e.g. for etch loading and CMP checks.
+
+        Args:
+        -----
+        density: np.ndarray
+            (tiles_y, tiles_x) array with the covered fraction of every tile, where density[j, i] is the tile with
+            lower left corner (x_min + i * tile_size_nm, y_min + j * tile_size_nm)
+        window: Tuple[float, float, float, float]
+            The analysed area as (x_min, y_min, x_max, y_max) in nm
+        tile_size_nm: float
+            The side-length of a tile in nm
+        """
+        self.density = density
+        self.window = window
+        self.tile_size_nm = tile_size_nm
+
+    @property
+    def mean(self) -> float:
+        return float(self.density.mean())
+
+    @property
+    def min(self) -> float:
+        return float(self.density.min())
+
+    @property
+    def max(self) -> float:
+        return float(self.density.max())
+
+    @property
+    def std(self) -> float:
+        return float(self.density.std())
+
+    def get_tile_center(self, column: int, row: int) -> Tuple[float, float]:
+        """Returns the center of a tile in nm"""
+        return (
+            self.window[0] + (column + 0.5) * self.tile_size_nm,
+            self.window[1] + (row + 0.5) * self.tile_size_nm,
+        )
+
+    def get_tiles_outside(self, min_density: float = 0, max_density: float = 1):
+        """Returns the (column, row) of every tile with a density outside [min_density, max_density]"""
+        rows, columns = np.nonzero(
+            (self.density < min_density) | (self.density > max_density)
+        )
+        return list(zip(columns.tolist(), rows.tolist()))
+
+
+def density_map(
+    layers: CleWin_layer | List[CleWin_layer],
+    pixel_size_nm: float,
+    tile_size_nm: float,
+    window: Window = None,
+    polygon_samples: int = 1,
+    raster_tile_size_px: int = 2048,
+) -> CleWin_density_map:
+    """
+    Computes the pattern density per tile by rasterizing the layers tile by tile,
+    so whole wafers can be analysed at fine pixel sizes without holding the bitmap in memory.
+
+    Args:
+    -----
+    layers: CleWin_layer | List[CleWin_layer]
+        The layers to analyse. The union of all layers is used.
+    pixel_size_nm: float
+        The side-length of a pixel in nm
+    tile_size_nm: float
+        The side-length of a density tile in nm. Must be a whole number of pixels.
+    window: Tuple[float, float, float, float]
+        The analysed area as (x_min, y_min, x_max, y_max) in nm. Defaults to the bounding box of the layers.
+    polygon_samples: int
+        The number of samples per pixel in each direction for polygons and wires
+    raster_tile_size_px: int
+        The side-length of the tiles used for rasterization, in pixels
+
+    Returns:
+    --------
+    density_map: CleWin_density_map
+        The density of every tile
+    """
+    pixels_per_tile = tile_size_nm / pixel_size_nm
+    if not float(pixels_per_tile).is_integer() or pixels_per_tile < 1:
+        raise ValueError("tile_size_nm must be a whole multiple of pixel_size_nm")
+    pixels_per_tile = int(pixels_per_tile)
+
+    if window is None:
+        window = _combined_shape_arrays(layers).get_bounding_box()
+        if window is None:
+            raise ValueError("Cannot determine the window of empty layers")
+
+    nx, ny = _raster_size(window, pixel_size_nm)
+    tiles_x = math.ceil(nx / pixels_per_tile)
+    tiles_y = math.ceil(ny / pixels_per_tile)
+    covered_pixels = np.zeros((tiles_y, tiles_x))
+
+    for column, row, coverage in iter_raster_tiles(
+        layers, pixel_size_nm, window, raster_tile_size_px, polygon_samples
+    ):
+        tile_rows, row_starts = _tile_runs(row, coverage.shape[0], pixels_per_tile)
+        tile_columns, column_starts = _tile_runs(column, coverage.shape[1], pixels_per_tile)
+        sums = np.add.reduceat(np.add.reduceat(coverage, row_starts, axis=0), column_starts, axis=1)
+        covered_pixels[np.ix_(tile_rows, tile_columns)] += sums
+
+    # Tiles at the upper and right edge may be cut off by the window
+    pixels_x = np.minimum(pixels_per_tile, nx - pixels_per_tile * np.arange(tiles_x))
+    pixels_y = np.minimum(pixels_per_tile, ny - pixels_per_tile * np.arange(tiles_y))
+    density = covered_pixels / np.outer(pixels_y, pixels_x)
+
+    return CleWin_density_map(density=density, window=window, tile_size_nm=tile_size_nm)
+
+
+def _tile_runs(start: int, length: int, pixels_per_tile: int):
+    """Returns the density tiles touched by pixels start..start + length and the local index where each begins"""
+    first_tile = start // pixels_per_tile
+    last_tile = (start + length - 1) // pixels_per_tile
+    tiles = np.arange(first_tile, last_tile + 1)
+    starts = np.maximum(tiles * pixels_per_tile - start, 0)
+    return tiles, starts
+
+
+def _combined_shape_arrays(layers) -> CIF_shape_arrays:
+    if isinstance(layers, CleWin_layer):
+        return layers.get_shape_arrays()
+    return CIF_shape_arrays.concatenate([layer.get_shape_arrays() for layer in layers])
+
+
+def _raster_size(window: Window, pixel_size_nm: float) -> Tuple[int, int]:
+    x_min, y_min, x_max, y_max = window
+    return (
+        max(math.ceil((x_max - x_min) / pixel_size_nm), 1),
+        max(math.ceil((y_max - y_min) / pixel_size_nm), 1),
+    )
+
+
+def _bin_to_tiles(boxes: np.ndarray, window: Window, tile_size_nm: float, tiles_x: int, tiles_y: int):
+    """
+    Sorts shapes into all tiles their bounding box overlaps.
+    Returns the shape indices sorted by tile and, for every tile, where its shapes start.
+    """
+    first_columns = np.floor((boxes[:, 0] - window[0]) / tile_size_nm)
+    last_columns = np.floor((boxes[:, 2] - window[0]) / tile_size_nm)
+    first_rows = np.floor((boxes[:, 1] - window[1]) / tile_size_nm)
+    last_rows = np.floor((boxes[:, 3] - window[1]) / tile_size_nm)
+    first_columns = np.clip(first_columns, 0, tiles_x - 1).astype(np.int64)
+    last_columns = np.clip(last_columns, 0, tiles_x - 1).astype(np.int64)
+    first_rows = np.clip(first_rows, 0, tiles_y - 1).astype(np.int64)
+    last_rows = np.clip(last_rows, 0, tiles_y - 1).astype(np.int64)
+    is_inside = (
+        (boxes[:, 2] >= window[0])
+        & (boxes[:, 0] <= window[2])
+        & (boxes[:, 3] >= window[1])
+        & (boxes[:, 1] <= window[3])
+    )
+
+    shape_indices = np.flatnonzero(is_inside)
+    widths = (last_columns - first_columns + 1)[shape_indices]
+    heights = (last_rows - first_rows + 1)[shape_indices]
+    counts = widths * heights
+
+    # One (shape, tile) pair for every tile the bounding box of a shape overlaps
+    pair_shapes = np.repeat(shape_indices, counts)
+    local = np.arange(counts.sum()) - np.repeat(_offsets_from_counts(counts)[:-1], counts)
+    pair_widths = np.repeat(widths, counts)
+    pair_columns = first_columns[pair_shapes] + local % pair_widths
+    pair_rows = first_rows[pair_shapes] + local // pair_widths
+    pair_tiles = pair_rows * tiles_x + pair_columns
+
+    order = np.argsort(pair_tiles, kind="stable")
+    tile_starts = np.searchsorted(pair_tiles[order], np.arange(tiles_x * tiles_y + 1))
+    return pair_shapes[order], tile_starts
+
+
+def _select_shapes(
+    shape_arrays: CIF_shape_arrays,
+    rectangle_indices: np.ndarray,
+    polygon_indices: np.ndarray,
+    wire_indices: np.ndarray,
+) -> CIF_shape_arrays:
+    polygon_points, polygon_offsets = _select_ragged(
+        shape_arrays.polygon_points, shape_arrays.polygon_offsets, polygon_indices
+    )
+    wire_points, wire_offsets = _select_ragged(
+        shape_arrays.wire_points, shape_arrays.wire_offsets, wire_indices
+    )
+    return CIF_shape_arrays.from_arrays(
+        rectangles=shape_arrays.rectangles[rectangle_indices],
+        polygon_points=polygon_points,
+        polygon_offsets=polygon_offsets,
+        wire_points=wire_points,
+        wire_offsets=wire_offsets,
+        wire_widths=shape_arrays.wire_widths[wire_indices],
+    )
+
+
+def _rasterize_tile(
+    shape_arrays: CIF_shape_arrays,
+    x_min: float,
+    y_min: float,
+    nx: int,
+    ny: int,
+    pixel_size_nm: float,
+    polygon_samples: int,
+) -> np.ndarray:
+    boxes = _rectangle_union_boxes(shape_arrays.rectangles)
+    coverage = _rectangle_coverage(boxes, x_min, y_min, nx, ny, pixel_size_nm)
+
+    if len(shape_arrays.polygon_points) or len(shape_arrays.wire_points):
+        samples = polygon_samples
+        scale = samples / pixel_size_nm
+        origin = np.array([x_min, y_min])
+        spans = [
+            _polygon_spans(
+                (shape_arrays.polygon_points - origin) * scale,
+                shape_arrays.polygon_offsets,
+                ny * samples,
+            )
+        ]
+        spans.extend(
+            _wire_spans(
+                (shape_arrays.wire_points - origin) * scale,
+                shape_arrays.wire_offsets,
+                shape_arrays.wire_widths * scale / 2,
+                ny * samples,
+            )
+        )
+        is_outline_covered = _fill_spans(spans, nx * samples, ny * samples)
+        is_covered = is_outline_covered | _fill_boxes(
+            (boxes - np.tile(origin, 2)) * scale, nx * samples, ny * samples
+        )
+        # Pixels without covered samples of polygons or wires keep the exact area of the rectangles
+        coverage = np.where(
+            _count_samples(is_outline_covered, samples) > 0,
+            _count_samples(is_covered, samples) / samples**2,
+            coverage,
+        )
+
+    return np.minimum(coverage, 1)
+
+
+def _count_samples(is_covered: np.ndarray, samples: int) -> np.ndarray:
+    """Returns the number of covered samples in every pixel of samples x samples samples"""
+    rows, columns = is_covered.shape[0] // samples, is_covered.shape[1] // samples
+    is_covered = is_covered.view(np.uint8).reshape(rows, samples, columns, samples)
+    covered_samples = np.zeros((rows, columns), dtype=np.uint16)
+    for row_sample in range(samples):
+        for column_sample in range(samples):
+            covered_samples += is_covered[:, row_sample, :, column_sample]
+    return covered_samples
+
+
+def _rectangle_union_boxes(rectangles: np.ndarray) -> np.ndarray:
+    """
+    Returns the union of rectangles as non-overlapping (x_min, y_min, x_max, y_max) boxes in nm,
+    so the area covered by several rectangles is counted once
+    """
+    if len(rectangles) < 2:
+        half_sizes = rectangles[:, :2] / 2
+        return np.concatenate([rectangles[:, 2:] - half_sizes, rectangles[:, 2:] + half_sizes], axis=1)
+    doubled = _boolean_rectangles([CIF_shape_arrays.from_arrays(rectangles=rectangles)], "union")
+    return doubled[:, [0, 2, 1, 3]] / 2
+
+
+def _rectangle_coverage(
+    boxes: np.ndarray, x_min: float, y_min: float, nx: int, ny: int, pixel_size_nm: float
+) -> np.ndarray:
+    """
+    Exact area coverage of (x_min, y_min, x_max, y_max) boxes, which must not overlap. The coverage of a box is
+    the product of its overlap with the pixel columns and rows, which is written as a sum of 3 x 3 weighted boxes
+    and accumulated in one 2D difference array.
+    """
+    lower = (boxes[:, :2] - [x_min, y_min]) / pixel_size_nm
+    upper = (boxes[:, 2:] - [x_min, y_min]) / pixel_size_nm
+    lower = np.clip(lower, 0, [nx, ny])
+    upper = np.clip(upper, 0, [nx, ny])
+    is_inside = np.all(upper > lower, axis=1)
+    lower, upper = lower[is_inside], upper[is_inside]
+    if len(lower) == 0:
+        return np.zeros((ny, nx))
+
+    x_starts, x_ends, x_weights = _interval_boxes(lower[:, 0], upper[:, 0])
+    y_starts, y_ends, y_weights = _interval_boxes(lower[:, 1], upper[:, 1])
+
+    # Every combination of an x box and a y box, as (n, 3, 3) arrays
+    x_starts, x_ends, x_weights = (a[:, None, :] for a in (x_starts, x_ends, x_weights))
+    y_starts, y_ends, y_weights = (a[:, :, None] for a in (y_starts, y_ends, y_weights))
+    weights = (x_weights * y_weights).ravel()
+    corners = [
+        (y_starts, x_starts, weights),
+        (y_starts, x_ends, -weights),
+        (y_ends, x_starts, -weights),
+        (y_ends, x_ends, weights),
+    ]
+    indices = np.concatenate(
+        [np.broadcast_to(rows * (nx + 1) + columns, (len(lower), 3, 3)).ravel() for rows, columns, _ in corners]
+    )
+    difference = np.bincount(
+        indices,
+        weights=np.concatenate([w for _, _, w in corners]),
+        minlength=(nx + 1) * (ny + 1),
+    ).reshape(ny + 1, nx + 1)
+    return difference.cumsum(axis=0).cumsum(axis=1)[:ny, :nx]
+
+
+def _interval_boxes(lower: np.ndarray, upper: np.ndarray):
+    """
+    Writes the overlap of [lower, upper] with every pixel as three weighted boxes: weight 1 on all
+    touched pixels, plus corrections on the first and the last pixel
+    """
+    first = np.floor(lower).astype(np.int64)
+    last = np.ceil(upper).astype(np.int64) - 1
+    is_single = first == last
+    first_weight = np.where(is_single, upper - lower, np.minimum(upper, first + 1) - lower) - 1
+    last_weight = np.where(is_single, 0, upper - np.maximum(lower, last) - 1)
+    starts = np.stack([first, first, last], axis=1)
+    ends = np.stack([last + 1, first + 1, last + 1], axis=1)
+    weights = np.stack([np.ones_like(lower), first_weight, last_weight], axis=1)
+    return starts, ends, weights
+
+
+def _polygon_spans(points: np.ndarray, offsets: np.ndarray, rows: int):
+    """
+    Scanline fill of polygons given in sample units. Returns (row, first_column, end_column) of every
+    filled span of sample centers, using the even-odd rule within each polygon.
+    """
+    counts = np.diff(offsets)
+    if len(points) == 0:
+        return _no_spans()
+    polygon_ids = np.repeat(np.arange(len(counts)), counts)
+    starts = np.arange(len(points))
+    # The edge from the last point of each polygon goes back to its first point
+    ends = starts + 1
+    ends[offsets[1:] - 1] = offsets[:-1]
+
+    x0, y0 = points[starts, 0], points[starts, 1]
+    x1, y1 = points[ends, 0], points[ends, 1]
+    is_sloped = y0 != y1
+    x0, y0, x1, y1, polygon_ids = (a[is_sloped] for a in (x0, y0, x1, y1, polygon_ids))
+
+    # Rows whose center lies in [y_low, y_high)
+    first_rows = np.clip(np.ceil(np.minimum(y0, y1) - 0.5), 0, rows).astype(np.int64)
+    end_rows = np.clip(np.ceil(np.maximum(y0, y1) - 0.5), 0, rows).astype(np.int64)
+    row_counts = np.maximum(end_rows - first_rows, 0)
+
+    edge_indices = np.repeat(np.arange(len(x0)), row_counts)
+    crossing_rows = np.repeat(first_rows, row_counts) + (
+        np.arange(row_counts.sum()) - np.repeat(_offsets_from_counts(row_counts)[:-1], row_counts)
+    )
+    t = (crossing_rows + 0.5 - y0[edge_indices]) / (y1 - y0)[edge_indices]
+    crossing_x = x0[edge_indices] + t * (x1 - x0)[edge_indices]
+    crossing_polygons = polygon_ids[edge_indices]
+
+    order = np.lexsort((crossing_x, crossing_rows, crossing_polygons))
+    crossing_x = crossing_x[order]
+    crossing_rows = crossing_rows[order]
+    return (
+        crossing_rows[0::2],
+        np.ceil(crossing_x[0::2] - 0.5),
+        np.ceil(crossing_x[1::2] - 0.5),
+    )
+
+
+def _wire_spans(points: np.ndarray, offsets: np.ndarray, radii: np.ndarray, rows: int):
+    """Scanline fill of wires given in sample units, as one quadrilateral per segment and one disc per point"""
+    if len(points) == 0:
+        return [_no_spans()]
+    counts = np.diff(offsets)
+    point_radii = np.repeat(radii, counts)
+
+    is_segment_start = np.ones(len(points), dtype=bool)
+    is_segment_start[offsets[1:] - 1] = False
+    starts = np.flatnonzero(is_segment_start)
+    vectors = points[starts + 1] - points[starts]
+    lengths = np.linalg.norm(vectors, axis=1)
+    is_long = lengths > 0
+    starts, vectors, lengths = starts[is_long], vectors[is_long], lengths[is_long]
+    normals = np.stack([-vectors[:, 1], vectors[:, 0]], axis=1) / lengths[:, None]
+    normals *= point_radii[starts][:, None]
+    quads = np.stack(
+        [
+            points[starts] - normals,
+            points[starts + 1] - normals,
+            points[starts + 1] + normals,
+            points[starts] + normals,
+        ],
+        axis=1,
+    ).reshape(-1, 2)
+    quad_spans = _polygon_spans(quads, 4 * np.arange(len(starts) + 1), rows)
+
+    # Discs: rows whose center lies within the radius of the point
+    first_rows = np.clip(np.ceil(points[:, 1] - point_radii - 0.5), 0, rows).astype(np.int64)
+    end_rows = np.clip(np.floor(points[:, 1] + point_radii - 0.5) + 1, 0, rows).astype(np.int64)
+    row_counts = np.maximum(end_rows - first_rows, 0)
+    point_indices = np.repeat(np.arange(len(points)), row_counts)
+    disc_rows = np.repeat(first_rows, row_counts) + (
+        np.arange(row_counts.sum()) - np.repeat(_offsets_from_counts(row_counts)[:-1], row_counts)
+    )
+    dy = disc_rows + 0.5 - points[point_indices, 1]
+    half_widths = np.sqrt(np.maximum(point_radii[point_indices] ** 2 - dy**2, 0))
+    disc_spans = (
+        disc_rows,
+        np.ceil(points[point_indices, 0] - half_widths - 0.5),
+        np.floor(points[point_indices, 0] + half_widths - 0.5) + 1,
+    )
+    return [quad_spans, disc_spans]
+
+
+def _no_spans():
+    return (np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0))
+
+
+def _fill_boxes(boxes: np.ndarray, columns: int, rows: int) -> np.ndarray:
+    """Returns a boolean (rows, columns) array with all samples covered by (x_min, y_min, x_max, y_max) boxes"""
+    first = np.clip(np.ceil(boxes[:, :2] - 0.5), 0, [columns, rows]).astype(np.int64)
+    end = np.clip(np.ceil(boxes[:, 2:] - 0.5), 0, [columns, rows]).astype(np.int64)
+    is_filled = np.all(end > first, axis=1)
+    first, end = first[is_filled], end[is_filled]
+
+    difference = np.zeros((rows + 1, columns + 1), dtype=np.int32)
+    np.add.at(difference, (first[:, 1], first[:, 0]), 1)
+    np.add.at(difference, (first[:, 1], end[:, 0]), -1)
+    np.add.at(difference, (end[:, 1], first[:, 0]), -1)
+    np.add.at(difference, (end[:, 1], end[:, 0]), 1)
+    return difference.cumsum(axis=0, dtype=np.int32).cumsum(axis=1, dtype=np.int32)[:rows, :columns] > 0
+
+
+def _fill_spans(spans: Iterable, columns: int, rows: int) -> np.ndarray:
+    """Returns a boolean (rows, columns) array with all samples covered by at least one span"""
+    span_rows = np.concatenate([span[0] for span in spans]).astype(np.int64)
+    first = np.clip(np.concatenate([span[1] for span in spans]), 0, columns).astype(np.int64)
+    end = np.clip(np.concatenate([span[2] for span in spans]), 0, columns).astype(np.int64)
+    is_filled = end > first
+    span_rows, first, end = span_rows[is_filled], first[is_filled], end[is_filled]
+
+    difference = np.zeros((rows, columns + 1), dtype=np.int32)
+    np.add.at(difference, (span_rows, first), 1)
+    np.add.at(difference, (span_rows, end), -1)
+    return difference.cumsum(axis=1, dtype=np.int32)[:, :columns] > 0
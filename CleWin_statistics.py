@@ -0,0 +1,343 @@
+import math
+from typing import Dict, List
+import numpy as np
+
+from CleWin_cif_creator import (
+    CleWin_layer,
+    CIF_shape_arrays,
+    RECTANGLE_KIND,
+    POLYGON_KIND,
+    WIRE_KIND,
+    _remove_repeated_points,
+)
+from CleWin_boolean import _boolean_rectangles, _split_manhattan
+from CleWin_rasterizer import iter_raster_tiles
+
+
+class CIF_layer_statistics:
+    def __init__(
+        self,
+        rectangle_count: int = 0,
+        polygon_count: int = 0,
+        wire_count: int = 0,
+        vertex_count: int = 0,
+        area_nm2: float = 0.0,
+        bounding_box=None,
+        min_feature_nm: float | None = None,
+        max_feature_nm: float | None = None,
+        merged_area_nm2: float | None = None,
+    ):
+        """
+        Statistics of the shapes of a layer, see get_layer_statistics.
+
+        Args:
+        -----
+        rectangle_count, polygon_count, wire_count: int
+            The number of shapes of each kind
+        vertex_count: int
+            The number of polygon and wire points
+        area_nm2: float
+            The sum of the areas of all shapes in nm^2, where overlapping areas are counted once per shape
+        bounding_box: Tuple[float, float, float, float]
+            The bounding box of all shapes as (x_min, y_min, x_max, y_max) in nm, or None without shapes
+        min_feature_nm, max_feature_nm: float | None
+            The smallest and largest feature size in nm, or None without shapes. The feature size is the shorter
+            side of a rectangle, the width of a wire and the shorter side of the bounding box of a polygon.
+        merged_area_nm2: float | None
+            The area covered by the shapes in nm^2, where overlapping areas are counted once.
+            None if it was not computed.
+        """
+        self.rectangle_count = rectangle_count
+        self.polygon_count = polygon_count
+        self.wire_count = wire_count
+        self.vertex_count = vertex_count
+        self.area_nm2 = area_nm2
+        self.bounding_box = bounding_box
+        self.min_feature_nm = min_feature_nm
+        self.max_feature_nm = max_feature_nm
+        self.merged_area_nm2 = merged_area_nm2
+
+    @property
+    def shape_count(self) -> int:
+        return self.rectangle_count + self.polygon_count + self.wire_count
+
+    @property
+    def fill_fraction(self) -> float | None:
+        """
+        The fraction of the bounding box covered by shapes, using the merged area if it was computed.
+        None without shapes or for a bounding box without area.
+        """
+        if self.bounding_box is None:
+            return None
+        x_min, y_min, x_max, y_max = self.bounding_box
+        box_area = (x_max - x_min) * (y_max - y_min)
+        if box_area == 0:
+            return None
+        area = self.area_nm2 if self.merged_area_nm2 is None else self.merged_area_nm2
+        return area / box_area
+
+    @classmethod
+    def combine(cls, statistics_list: List["CIF_layer_statistics"]) -> "CIF_layer_statistics":
+        """
+        Returns the statistics of several layers together. Areas are added, so the merged area does not
+        remove overlaps between the layers. The merged area is None unless it is known for every layer.
+        """
+        statistics_list = list(statistics_list)
+        boxes = [statistics.bounding_box for statistics in statistics_list if statistics.bounding_box is not None]
+        min_features = [s.min_feature_nm for s in statistics_list if s.min_feature_nm is not None]
+        max_features = [s.max_feature_nm for s in statistics_list if s.max_feature_nm is not None]
+        merged_areas = [statistics.merged_area_nm2 for statistics in statistics_list]
+        return cls(
+            rectangle_count=sum(statistics.rectangle_count for statistics in statistics_list),
+            polygon_count=sum(statistics.polygon_count for statistics in statistics_list),
+            wire_count=sum(statistics.wire_count for statistics in statistics_list),
+            vertex_count=sum(statistics.vertex_count for statistics in statistics_list),
+            area_nm2=sum(statistics.area_nm2 for statistics in statistics_list),
+            bounding_box=_union_box(boxes),
+            min_feature_nm=min(min_features) if min_features else None,
+            max_feature_nm=max(max_features) if max_features else None,
+            merged_area_nm2=None if None in merged_areas else sum(merged_areas),
+        )
+
+    def __repr__(self):
+        return (
+            f"CIF_layer_statistics({self.shape_count} shapes, {self.vertex_count} vertices, "
+            f"area {self.area_nm2:g} nm^2, merged area {self.merged_area_nm2}, "
+            f"bounding box {self.bounding_box}, features {self.min_feature_nm}..{self.max_feature_nm} nm)"
+        )
+
+
+class _CIF_statistics_cache:
+    def __init__(self, storage, transformation):
+        """
+        The statistics of the first shape_count shapes of a layer. Like _CIF_content_cache, it stays valid while
+        shapes are only added to storage and the transformation of the layer is not replaced, and statistics of
+        added shapes are combined with it. Every other change to storage, including edits of its shapes, is
+        counted in its _modification_count. Merged areas are kept per pixel size for the current shape count.
+        """
+        self.storage = storage
+        self.transformation = transformation
+        self.modification_count = storage._modification_count
+        self.shape_count = 0
+        self.statistics = CIF_layer_statistics()
+        # Whether all shapes are rectangles or rectilinear polygons, None until the merged area is needed
+        self.is_manhattan: bool | None = None
+        # The merged area by pixel size, with None for the exact area of rectilinear layers
+        self.merged_areas: Dict[float | None, float] = {}
+
+    def is_valid_for(self, storage, transformation) -> bool:
+        return (
+            self.storage is storage
+            and self.transformation is transformation
+            and self.modification_count == storage._modification_count
+            and len(storage) >= self.shape_count
+        )
+
+
+def get_layer_statistics(
+    layer: CleWin_layer, remove_overlap: bool = False, pixel_size_nm: float = None
+) -> CIF_layer_statistics:
+    """
+    Returns the shape and vertex counts, area, bounding box and feature sizes of a layer, computed in bulk.
+
+    The statistics are kept with the layer. As long as shapes are only added, with add_shape_to_layer,
+    add_shape_arrays_to_layer or by appending to shapes, only the new shapes are analysed by the next call.
+    Transforming the layer, assigning or removing shapes and changing the sizes, positions, points or widths of
+    shapes, directly or with shift and transform, analyse the layer again. Like for the CIF text of the layer,
+    see CleWin_layer.iter_cif_content, only in-place changes of a points array or of the arrays of an
+    array-backed layer need layer.invalidate_statistics.
+
+    Rectangles have their exact area and polygons the area from the shoelace formula. Wires are the area swept by
+    a disc of their width along the points, which is exact for wires that do not overlap themselves and whose
+    segments are longer than the width at sharp turns.
+
+    With remove_overlap, the area covered by the layer is computed as well. It is exact for layers with only
+    rectangles and rectilinear polygons. Layers with other shapes need pixel_size_nm, and are rasterized with that
+    pixel size to estimate the covered area.
+
+    Args:
+    -----
+    layer: CleWin_layer
+        The layer to analyse
+    remove_overlap: bool
+        Whether to compute merged_area_nm2
+    pixel_size_nm: float
+        The side-length of the pixels used to estimate the covered area of layers with wires or
+        non-rectilinear polygons
+
+    Returns:
+    --------
+    statistics: CIF_layer_statistics
+        The statistics of the layer. It must not be modified, as it is shared with later calls.
+    """
+    storage = layer._get_storage()
+    cache = layer._statistics_cache
+    if cache is None or not cache.is_valid_for(storage, layer.transformation):
+        cache = _CIF_statistics_cache(storage, layer.transformation)
+        layer._statistics_cache = cache
+
+    shape_count = len(storage)
+    if cache.shape_count < shape_count:
+        added = _get_shape_statistics(layer._transformed(layer._get_stored_shape_arrays(cache.shape_count)))
+        cache.statistics = CIF_layer_statistics.combine([cache.statistics, added])
+        cache.shape_count = shape_count
+        cache.is_manhattan = None
+        cache.merged_areas = {}
+
+    if not remove_overlap:
+        return cache.statistics
+
+    if cache.is_manhattan is None:
+        manhattan, other = _split_manhattan(layer.get_shape_arrays())
+        cache.is_manhattan = len(other) == 0
+        if cache.is_manhattan:
+            cache.merged_areas[None] = _get_manhattan_union_area(manhattan)
+    if cache.is_manhattan:
+        pixel_size_nm = None
+    elif pixel_size_nm is None:
+        raise ValueError("The covered area of layers with wires or non-rectilinear polygons needs a pixel_size_nm")
+    elif pixel_size_nm not in cache.merged_areas:
+        cache.merged_areas[pixel_size_nm] = _get_rasterized_area(
+            layer, cache.statistics.bounding_box, pixel_size_nm
+        )
+
+    statistics = CIF_layer_statistics.combine([cache.statistics])
+    statistics.merged_area_nm2 = cache.merged_areas[pixel_size_nm]
+    return statistics
+
+
+def get_layers_statistics(
+    layers: List[CleWin_layer], remove_overlap: bool = False, pixel_size_nm: float = None
+) -> Dict[str, CIF_layer_statistics]:
+    """
+    Returns the statistics of every layer by its alias, see get_layer_statistics.
+    Use CIF_layer_statistics.combine for the statistics of all layers together.
+    """
+    return {
+        layer.layer_alias: get_layer_statistics(layer, remove_overlap, pixel_size_nm) for layer in layers
+    }
+
+
+def get_shape_areas(shape_arrays: CIF_shape_arrays) -> np.ndarray:
+    """
+    Returns the area of every shape in insertion order in nm^2, see get_layer_statistics
+
+    Args:
+    -----
+    shape_arrays: CIF_shape_arrays
+        The shapes
+    """
+    kinds = shape_arrays.kinds
+    kind_indices = shape_arrays.get_kind_indices()
+    areas = np.empty(len(kinds))
+    rectangles = shape_arrays.rectangles
+    for kind, kind_areas in (
+        (RECTANGLE_KIND, rectangles[:, 0].astype(np.float64) * rectangles[:, 1]),
+        (POLYGON_KIND, _polygon_areas(shape_arrays.polygon_points, shape_arrays.polygon_offsets)),
+        (WIRE_KIND, _wire_areas(shape_arrays.wire_points, shape_arrays.wire_offsets, shape_arrays.wire_widths)),
+    ):
+        is_kind = kinds == kind
+        areas[is_kind] = kind_areas[kind_indices[is_kind]]
+    return areas
+
+
+def _get_shape_statistics(shape_arrays: CIF_shape_arrays) -> CIF_layer_statistics:
+    rectangles = shape_arrays.rectangles
+    polygon_boxes = shape_arrays.get_kind_bounding_boxes(POLYGON_KIND)
+    features = np.concatenate(
+        [
+            np.min(rectangles[:, :2], axis=1),
+            np.min(polygon_boxes[:, 2:] - polygon_boxes[:, :2], axis=1),
+            shape_arrays.wire_widths,
+        ]
+    )
+    bounding_box = shape_arrays.get_bounding_box()
+    return CIF_layer_statistics(
+        rectangle_count=len(rectangles),
+        polygon_count=len(polygon_boxes),
+        wire_count=len(shape_arrays.wire_widths),
+        vertex_count=len(shape_arrays.polygon_points) + len(shape_arrays.wire_points),
+        area_nm2=float(np.sum(get_shape_areas(shape_arrays))),
+        bounding_box=None if bounding_box is None else tuple(float(value) for value in bounding_box),
+        min_feature_nm=float(features.min()) if len(features) else None,
+        max_feature_nm=float(features.max()) if len(features) else None,
+    )
+
+
+def _polygon_areas(points: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """Returns the area of every polygon from the shoelace formula"""
+    counts = np.diff(offsets)
+    polygon_ids = np.repeat(np.arange(len(counts)), counts)
+    following = np.arange(1, len(points) + 1)
+    following[offsets[1:][counts > 0] - 1] = offsets[:-1][counts > 0]
+    # Relative to the first vertex, so the terms stay small for polygons far from the origin
+    relative = (points - points[offsets[:-1][polygon_ids]]).astype(np.float64)
+    terms = relative[:, 0] * relative[following, 1] - relative[:, 1] * relative[following, 0]
+    return np.abs(np.bincount(polygon_ids, weights=terms, minlength=len(counts))) / 2
+
+
+def _wire_areas(points: np.ndarray, offsets: np.ndarray, widths: np.ndarray) -> np.ndarray:
+    """
+    Returns the area swept by a disc of the width of every wire along its points:
+    the rectangles along the segments and a disc for the two ends, plus at every turn by the angle a
+    the wedge a * r^2 / 2 on the outside, minus the overlap r^2 * tan(a / 2) of the rectangles on the inside
+    """
+    points, offsets = _remove_repeated_points(points, offsets, closed=False)
+    counts = np.diff(offsets)
+    wire_ids = np.repeat(np.arange(len(counts)), counts)
+    radii = widths.astype(np.float64) / 2
+
+    is_segment = np.ones(len(points), dtype=bool)
+    is_segment[offsets[1:][counts > 0] - 1] = False
+    segment_starts = np.flatnonzero(is_segment)
+    segments = (points[segment_starts + 1] - points[segment_starts]).astype(np.float64)
+    lengths = np.hypot(segments[:, 0], segments[:, 1])
+    segment_wires = wire_ids[segment_starts]
+    areas = 2 * radii * np.bincount(segment_wires, weights=lengths, minlength=len(counts))
+    areas += np.where(counts > 0, math.pi * radii**2, 0)
+
+    # A turn is between two consecutive segments of the same wire
+    is_turn = segment_wires[1:] == segment_wires[:-1]
+    incoming, outgoing = segments[:-1][is_turn], segments[1:][is_turn]
+    turn_wires = segment_wires[1:][is_turn]
+    angles = np.arctan2(
+        np.abs(incoming[:, 0] * outgoing[:, 1] - incoming[:, 1] * outgoing[:, 0]),
+        np.sum(incoming * outgoing, axis=1),
+    )
+    turn_radii = radii[turn_wires]
+    # The overlap cannot reach beyond the segments, e.g. where a wire turns back on itself
+    overlap_lengths = np.minimum.reduce(
+        [turn_radii * np.tan(angles / 2), lengths[:-1][is_turn], lengths[1:][is_turn]]
+    )
+    corrections = angles * turn_radii**2 / 2 - turn_radii * overlap_lengths
+    return areas + np.bincount(turn_wires, weights=corrections, minlength=len(counts))
+
+
+def _get_manhattan_union_area(shape_arrays: CIF_shape_arrays) -> float:
+    """Returns the exact area covered by rectangles and rectilinear polygons"""
+    if len(shape_arrays) == 0:
+        return 0.0
+    rectangles = _boolean_rectangles([shape_arrays], "union").astype(np.float64)
+    return float(np.sum((rectangles[:, 1] - rectangles[:, 0]) * (rectangles[:, 3] - rectangles[:, 2]))) / 4
+
+
+def _get_rasterized_area(layer: CleWin_layer, bounding_box, pixel_size_nm: float) -> float:
+    """Returns the area covered by a layer, estimated by rasterizing its bounding box"""
+    if bounding_box is None:
+        return 0.0
+    covered_pixels = sum(
+        float(coverage.sum()) for _, _, coverage in iter_raster_tiles(layer, pixel_size_nm, bounding_box)
+    )
+    return covered_pixels * pixel_size_nm**2
+
+
+def _union_box(boxes):
+    if not boxes:
+        return None
+    boxes = np.array(boxes, dtype=np.float64)
+    return (
+        float(boxes[:, 0].min()),
+        float(boxes[:, 1].min()),
+        float(boxes[:, 2].max()),
+        float(boxes[:, 3].max()),
+    )
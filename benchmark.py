@@ -0,0 +1,346 @@
+"""
+Benchmarks of CIF generation, parsing, transforms and plotting on synthetic layouts.
+
+Every operation is timed on layouts of rectangles, many-vertex polygons, long wires and a mix of all three,
+for each requested number of shapes and storage mode. The peak memory of every operation is measured in a
+separate run with tracemalloc, which includes the buffers of numpy arrays. The results are written as JSON,
+so runs of different versions can be compared with --compare.
+
+Example:
+    python benchmark.py --sizes 1e3 1e5 1e7 --output results.json
+    python benchmark.py --compare baseline.json --output results.json
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+import warnings
+
+import matplotlib
+
+# The preview is rendered off screen
+matplotlib.use("Agg")
+
+import matplotlib.pyplot as plt
+import numpy as np
+
+from CleWin_cif_creator import (
+    CleWin_color,
+    CleWin_layer,
+    CIF_shape_arrays,
+    load_cif,
+    plotLayers,
+    write_to_cif,
+)
+
+LAYOUT_KINDS = ("rectangles", "polygons", "wires", "mixed")
+OPERATIONS = ("write_to_cif", "rewrite_to_cif", "load_cif", "shift", "deepcopy", "plotLayers")
+STORAGE_MODES = ("arrays", "objects")
+
+# The distance between neighbouring shapes of a synthetic layout
+PITCH_NM = 10_000
+
+
+def make_layout(kind: str, shape_count: int, polygon_vertices: int = 64, wire_points: int = 32, seed: int = 0):
+    """
+    Returns two array-backed layers with shape_count shapes in total, on a square grid with PITCH_NM spacing.
+
+    Args:
+    -----
+    kind: str
+        "rectangles", "polygons" (regular polygons with polygon_vertices vertices),
+        "wires" (zigzag wires with wire_points points, several pitches long) or "mixed" (a third of each)
+    shape_count: int
+        The number of shapes
+    polygon_vertices: int
+        The number of vertices of each polygon
+    wire_points: int
+        The number of points of each wire
+    seed: int
+        Seed of the random sizes
+    """
+    rng = np.random.default_rng(seed)
+    side = int(np.ceil(np.sqrt(shape_count)))
+    index = np.arange(shape_count)
+    centers = PITCH_NM * np.stack([index % side - side // 2, index // side - side // 2], axis=1)
+
+    if kind == "mixed":
+        parts = np.array_split(index, 3)
+        kinds = ["rectangles", "polygons", "wires"]
+    else:
+        parts, kinds = [index], [kind]
+
+    shape_arrays = CIF_shape_arrays()
+    for part, part_kind in zip(parts, kinds):
+        part_centers = centers[part]
+        if part_kind == "rectangles":
+            sizes = rng.integers(PITCH_NM // 10, PITCH_NM // 2, (len(part), 2))
+            rectangles = np.concatenate([sizes, part_centers], axis=1)
+            shape_arrays.extend_arrays(CIF_shape_arrays.from_arrays(rectangles=rectangles))
+        elif part_kind == "polygons":
+            angles = np.linspace(0, 2 * np.pi, polygon_vertices, endpoint=False)
+            radii = rng.integers(PITCH_NM // 10, PITCH_NM // 3, len(part))
+            offsets = np.stack([np.cos(angles), np.sin(angles)], axis=1)
+            points = part_centers[:, None, :] + (radii[:, None, None] * offsets[None]).astype(np.int64)
+            shape_arrays.extend_arrays(
+                CIF_shape_arrays.from_arrays(
+                    polygon_points=points.reshape(-1, 2),
+                    polygon_offsets=polygon_vertices * np.arange(len(part) + 1),
+                )
+            )
+        elif part_kind == "wires":
+            steps = np.arange(wire_points)
+            offsets = np.stack([steps * PITCH_NM // 4, (steps % 2) * PITCH_NM // 4], axis=1)
+            points = part_centers[:, None, :] + offsets[None]
+            shape_arrays.extend_arrays(
+                CIF_shape_arrays.from_arrays(
+                    wire_points=points.reshape(-1, 2),
+                    wire_offsets=wire_points * np.arange(len(part) + 1),
+                    wire_widths=rng.integers(PITCH_NM // 100, PITCH_NM // 20, len(part)),
+                )
+            )
+        else:
+            raise ValueError(f"Unknown layout kind {part_kind}, use one of {LAYOUT_KINDS}")
+
+    # Every other shape goes to the second layer
+    layers = []
+    for layer_index in range(2):
+        layer = CleWin_layer(
+            layer_name=f"Benchmark{layer_index}",
+            layer_alias=f"L{layer_index}",
+            layer_index=layer_index,
+            fill_color=CleWin_color(255 * layer_index, 0, 255),
+            border_color=CleWin_color(0, 0, 0),
+            array_backed=True,
+        )
+        layer.add_shape_arrays_to_layer(shape_arrays.take(np.arange(layer_index, len(shape_arrays), 2)))
+        layers.append(layer)
+    return layers
+
+
+def as_objects(layers):
+    """Returns object-backed copies of the layers"""
+    copies = []
+    for layer in layers:
+        copy = layer.empty_copy()
+        copy.shape_arrays = None
+        copy.shapes = layer.shape_arrays.to_shapes()
+        copies.append(copy)
+    return copies
+
+
+def _window_size(layers) -> float:
+    boxes = np.array([layer.get_bounding_box() for layer in layers if len(layer.shapes)])
+    return 2 * float(np.abs(boxes).max()) if len(boxes) else PITCH_NM
+
+
+def _operation(name: str, layers, directory: str, array_backed: bool):
+    """Returns a function that runs the operation once, and a function that prepares each run"""
+    filename = os.path.join(directory, "benchmark")
+    if name == "write_to_cif":
+        return lambda: write_to_cif(filename, layers), lambda: [layer.invalidate_cif_cache() for layer in layers]
+    if name == "rewrite_to_cif":
+        # Writing unchanged layers again, which reuses the CIF text kept by the layers
+        return lambda: write_to_cif(filename, layers), lambda: write_to_cif(filename, layers)
+    if name == "load_cif":
+        return lambda: load_cif(filename, array_backed=array_backed), lambda: write_to_cif(filename, layers)
+    if name == "shift":
+        return lambda: [layer.shift(1000, -1000) for layer in layers], None
+    if name == "deepcopy":
+        return lambda: [layer.deepcopy() for layer in layers], None
+    if name == "plotLayers":
+        window_size = _window_size(layers)
+
+        def plot():
+            with warnings.catch_warnings():
+                # plt.show warns that the Agg backend is non-interactive
+                warnings.simplefilter("ignore", UserWarning)
+                fig, _ = plotLayers(layers, window_size=window_size)
+            fig.canvas.draw()
+            plt.close(fig)
+
+        return plot, None
+    raise ValueError(f"Unknown operation {name}, use one of {OPERATIONS}")
+
+
+def time_operation(run, prepare=None, repeat: int = 3):
+    """Returns the time of every run in seconds"""
+    times = []
+    for _ in range(repeat):
+        if prepare is not None:
+            prepare()
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def peak_memory(run, prepare=None) -> int:
+    """Returns the peak memory allocated by one run in bytes, above what was allocated before it"""
+    if prepare is not None:
+        prepare()
+    tracemalloc.start()
+    try:
+        baseline = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        result = run()
+        peak = tracemalloc.get_traced_memory()[1]
+        del result
+    finally:
+        tracemalloc.stop()
+    return peak - baseline
+
+
+def run_benchmarks(
+    sizes,
+    kinds=LAYOUT_KINDS,
+    operations=OPERATIONS,
+    storage_modes=STORAGE_MODES,
+    repeat: int = 3,
+    measure_memory: bool = True,
+    max_object_shapes: int = 1_000_000,
+    max_plot_shapes: int = 1_000_000,
+    polygon_vertices: int = 64,
+    wire_points: int = 32,
+    log=print,
+):
+    """
+    Runs every operation on every layout and returns a list of result records.
+    Object-backed layouts and plots are skipped above max_object_shapes and max_plot_shapes shapes.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for kind in kinds:
+            for size in sizes:
+                array_layers = make_layout(kind, size, polygon_vertices, wire_points)
+                for storage in storage_modes:
+                    if storage == "objects" and size > max_object_shapes:
+                        continue
+                    layers = array_layers if storage == "arrays" else as_objects(array_layers)
+                    for name in operations:
+                        if name == "plotLayers" and size > max_plot_shapes:
+                            continue
+                        run, prepare = _operation(name, layers, directory, storage == "arrays")
+                        times = time_operation(run, prepare, repeat)
+                        record = {
+                            "operation": name,
+                            "layout": kind,
+                            "shape_count": size,
+                            "storage": storage,
+                            "seconds_min": min(times),
+                            "seconds_median": statistics.median(times),
+                            "repeat": repeat,
+                            "peak_memory_bytes": peak_memory(run, prepare) if measure_memory else None,
+                        }
+                        if name in ("write_to_cif", "rewrite_to_cif"):
+                            record["file_size_bytes"] = os.path.getsize(os.path.join(directory, "benchmark.cif"))
+                        results.append(record)
+                        log(_format_record(record))
+                    del layers
+                del array_layers
+    return results
+
+
+def get_metadata():
+    """Returns the versions and machine the benchmarks were run with"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "matplotlib": matplotlib.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def compare_results(baseline, results):
+    """
+    Returns (record, baseline_record, time_ratio) for every record that is also in the baseline,
+    with time_ratio the ratio of the minimum times
+    """
+    key_names = ("operation", "layout", "shape_count", "storage")
+    baseline_records = {tuple(record[key] for key in key_names): record for record in baseline}
+    comparisons = []
+    for record in results:
+        baseline_record = baseline_records.get(tuple(record[key] for key in key_names))
+        if baseline_record is not None and baseline_record["seconds_min"] > 0:
+            comparisons.append((record, baseline_record, record["seconds_min"] / baseline_record["seconds_min"]))
+    return comparisons
+
+
+def _format_record(record) -> str:
+    memory = record["peak_memory_bytes"]
+    memory_text = "" if memory is None else f"  {memory / 2**20:10.1f} MiB"
+    return (
+        f"{record['operation']:<15}{record['layout']:<11}{record['storage']:<8}{record['shape_count']:>10}"
+        f"  {record['seconds_min']:10.4f} s{memory_text}"
+    )
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="+", type=float, default=[1e3, 1e4, 1e5, 1e6], help="Numbers of shapes")
+    parser.add_argument("--layouts", nargs="+", choices=LAYOUT_KINDS, default=list(LAYOUT_KINDS))
+    parser.add_argument("--operations", nargs="+", choices=OPERATIONS, default=list(OPERATIONS))
+    parser.add_argument("--storage", nargs="+", choices=STORAGE_MODES, default=list(STORAGE_MODES))
+    parser.add_argument("--repeat", type=int, default=3, help="Number of timed runs of every operation")
+    parser.add_argument("--no-memory", action="store_true", help="Skip the peak memory measurement")
+    parser.add_argument("--max-object-shapes", type=float, default=1e6)
+    parser.add_argument("--max-plot-shapes", type=float, default=1e6)
+    parser.add_argument("--polygon-vertices", type=int, default=64)
+    parser.add_argument("--wire-points", type=int, default=32)
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON file to write the results to")
+    parser.add_argument("--compare", help="JSON file of an earlier run to compare the times with")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Relative slowdown reported as a regression")
+    args = parser.parse_args(arguments)
+
+    results = run_benchmarks(
+        sizes=[int(size) for size in args.sizes],
+        kinds=args.layouts,
+        operations=args.operations,
+        storage_modes=args.storage,
+        repeat=args.repeat,
+        measure_memory=not args.no_memory,
+        max_object_shapes=int(args.max_object_shapes),
+        max_plot_shapes=int(args.max_plot_shapes),
+        polygon_vertices=args.polygon_vertices,
+        wire_points=args.wire_points,
+    )
+    with open(args.output, "w") as file:
+        json.dump({"metadata": get_metadata(), "results": results}, file, indent=1)
+    print(f"Wrote {len(results)} results to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)["results"]
+        regressions = 0
+        for record, _, ratio in compare_results(baseline, results):
+            is_regression = ratio > 1 + args.threshold
+            regressions += is_regression
+            print(f"{_format_record(record)}  x{ratio:5.2f}{'  REGRESSION' if is_regression else ''}")
+        print(f"{regressions} regressions against {args.compare}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
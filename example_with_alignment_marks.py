@@ -1,5 +1,6 @@
 from CleWin_cif_creator import (
-    load_cif,
+    load_cif_cached,
+    default_cif_load_cache,
     write_to_cif,
     CleWin_layer,
     plotLayers,
@@ -14,7 +15,8 @@ def get_shifted_alignment_mark(
 ):
     file_path = os.path.dirname(os.path.abspath(__file__))
     alignment_mark_filename = "/centered_alignment_mark"
-    alignment_mark_layers: list[CleWin_layer] = load_cif(
+    # The file is only parsed the first time, later calls get fresh copies from the cache
+    alignment_mark_layers: list[CleWin_layer] = load_cif_cached(
         filename=file_path + alignment_mark_filename
     )
 
@@ -61,6 +63,34 @@ def aligned_example():
     return [metalization_layer, etch_layer]
 
 
+def aligned_example_with_symbols():
+    """
+    Same as aligned_example, but the alignment mark is defined once as a symbol and placed with calls.
+    Write the result with write_to_cif(filename, layers, calls).
+    """
+    hello_world_layers: list[CleWin_layer] = example_layers()
+
+    file_path = os.path.dirname(os.path.abspath(__file__))
+    alignment_mark = default_cif_load_cache.load_symbol(
+        filename=file_path + "/centered_alignment_mark",
+        symbol_name="AlignmentMark",
+    )
+
+    alignment_mark_positions = [
+        [10e6, 10e6],
+        [-10e6, 10e6],
+        [10e6, -10e6],
+        [-10e6, -10e6],
+    ]
+
+    calls = [
+        alignment_mark.place(x_shift_nm=position[0], y_shift_nm=position[1])
+        for position in alignment_mark_positions
+    ]
+
+    return hello_world_layers, calls
+
+
 if __name__ == "__main__":
     import numpy as np
 
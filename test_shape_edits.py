@@ -0,0 +1,36 @@
+from CleWin_cif_creator import CIF_polygon, CIF_rectangle, CIF_shape_arrays, CIF_wire, CleWin_color, CleWin_layer
+
+
+def _get_cif_content(layer):
+    # One shape per chunk, so every shape is kept with the layer and reused unless it changed
+    return "".join(layer.iter_cif_content(shapes_per_chunk=1))
+
+
+def _new_layer():
+    color = CleWin_color(0, 0, 255)
+    return CleWin_layer("layer", "L1", 1, color, color)
+
+
+def test_in_place_edits_of_points_are_written():
+    layer = _new_layer()
+    polygon = CIF_polygon([(0, 0), (10, 0), (0, 10)])
+    wire = CIF_wire([(0, 0), (10, 0)], 2)
+    for shape in (CIF_rectangle(4, 4, 0, 0), polygon, wire):
+        layer.add_shape_to_layer(shape)
+    assert "P 0 0 10 0 0 10;" in _get_cif_content(layer)
+
+    polygon.points[0][0] += 100
+    wire.points[1] = (20, 5)
+    content = _get_cif_content(layer)
+    assert "P 100 0 10 0 0 10;" in content
+    assert "W 2 0 0 20 5;" in content
+
+
+def test_in_place_edits_of_array_backed_points_are_written():
+    layer = _new_layer()
+    layer.shape_arrays = CIF_shape_arrays.from_shapes([CIF_polygon([(0, 0), (10, 0), (0, 10)])])
+    assert "P 0 0 10 0 0 10;" in _get_cif_content(layer)
+
+    layer.shapes[0].points[:, 0] += 100
+    assert "P 100 0 110 0 100 10;" in _get_cif_content(layer)
+